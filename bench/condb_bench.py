@@ -0,0 +1,85 @@
+"""
+condb_bench.py — micro-benchmark for ConDB row decoding.
+
+Compares the per-value ConditionsDBAPI._clean_row with the column-aware
+_RowDecoder used for /search responses, on synthetic rows shaped like the
+HD run-conditions folder (repeated categorical values and config_files
+strings, unique timestamps). Run from the project root:
+
+    python -m bench.condb_bench [n_rows]
+"""
+
+import random
+import sys
+import time
+
+from src.lib import condb_api
+from src.lib.condb_api import ConditionsDBAPI, FIELD_METADATA, _RowDecoder
+
+FOLDER = "pdunesp.run_conditionstest"
+
+
+def synthetic_rows(n: int, seed: int = 0) -> tuple[list[str], list[list[str]]]:
+    """Header plus `n` rows of raw (string) values, config_files last."""
+    rng = random.Random(seed)
+    columns = [c for c in FIELD_METADATA[FOLDER] if c != "config_files"] + ["config_files"]
+    configs = [
+        "{'np04_daq': 'np04_daq_%d.json', 'np04_wib': 'wib_%d.json'}" % (i, i)
+        for i in range(5)
+    ]
+    categorical = {
+        "run_type": ["PROD", "TEST"],
+        "data_stream": ["cosmic", "physics", "calibration"],
+        "detector_id": ["np04_hd"],
+        "data_type": ["np04_hd"],
+        "software_version": ["fddaq-v4.4.3-a9-1", "fddaq-v4.4.8-a9"],
+        "data_quality": ["good", "bad", "None"],
+        "beam_polarity": ["positive", "negative", ""],
+        "ac_couple": ["dc_coupling", "ac_coupling"],
+        "detector_type": ["wib_default"],
+    }
+    rows = []
+    for i in range(n):
+        start = 1_700_000_000 + 3600 * i
+        row = []
+        for c in columns:
+            if c == "tv":
+                row.append(str(27000 + i))
+            elif c in ("tr", "upload_time"):
+                row.append("%.3f" % (start + 7200 + rng.random()))
+            elif c == "start_time":
+                row.append(str(start))
+            elif c == "stop_time":
+                row.append(str(start + 3000))
+            elif c == "config_files":
+                row.append(rng.choice(configs))
+            elif c in categorical:
+                row.append(rng.choice(categorical[c]))
+            else:
+                row.append(rng.choice(["0", "1", "14", "2.0", "0.5", "None"]))
+        rows.append(row)
+    return columns, rows
+
+
+def bench(n: int = 50_000) -> None:
+    columns, rows = synthetic_rows(n)
+
+    condb_api._parse_literal.cache_clear()
+    t0 = time.perf_counter()
+    baseline = [ConditionsDBAPI._clean_row(dict(zip(columns, values))) for values in rows]
+    t_clean = time.perf_counter() - t0
+
+    condb_api._parse_literal.cache_clear()
+    t0 = time.perf_counter()
+    decoder = _RowDecoder(FOLDER, columns)
+    decoded = [decoder.decode(values) for values in rows]
+    t_decoder = time.perf_counter() - t0
+
+    assert decoded == baseline, "decoder output differs from _clean_row"
+    print(f"{n} rows x {len(columns)} columns")
+    print(f"  _clean_row   {n / t_clean:>12,.0f} rows/s")
+    print(f"  _RowDecoder  {n / t_decoder:>12,.0f} rows/s  ({t_clean / t_decoder:.1f}x)")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
@@ -50,6 +50,7 @@ function HomeContent() {
   const [searching, setSearching] = useState(false);
   const [searched, setSearched] = useState(false);
   const [searchError, setSearchError] = useState<string | null>(null);
+  const [searchTruncated, setSearchTruncated] = useState(false);
   const [isClient, setIsClient] = useState(false)
   const [isLoaded, setIsLoaded] = useState(false)
 
@@ -124,7 +125,7 @@ function HomeContent() {
     setSearchError(null);
     (async () => {
       try {
-        const { results } = await searchDataSets(
+        const { results, truncated } = await searchDataSets(
           searchParams?.get('q') ?? '',
           searchParams?.get('category') ?? '',
           tab,
@@ -134,6 +135,7 @@ function HomeContent() {
         );
         if (!controller.signal.aborted) {
           setResults(results);
+          setSearchTruncated(truncated);
           setSearchError(null);
           setSearched(true);
         }
@@ -222,6 +224,11 @@ function HomeContent() {
                 ) : (
                   tabs.map((tab) => (
                     <TabsContent key={tab} value={tab} className="mt-4">
+                      {searchTruncated && searched && !searching && (
+                        <p className="mb-2 text-sm text-muted-foreground">
+                          MetaCat is slow right now: showing the first {results.length} results found. Narrow the search for a complete list.
+                        </p>
+                      )}
                       <DatasetTable results={results} mode={resultsMode} hasSearched={searched && !searching}/>
                     </TabsContent>
                   ))
@@ -0,0 +1,270 @@
+"""
+admission.py — admission control for the upstream-bound endpoints.
+
+Sync endpoints run on anyio's worker-thread limiter, which queues without
+bound: under a burst every request waits its turn while latency climbs
+until the frontend gives up at 2 minutes. Instead each endpoint gets an
+Admission with a concurrency limit and a bounded wait queue, checked on the
+event loop *before* a worker thread is taken:
+
+    _admit_datasets = admission.controller("queryDatasets", concurrency=6, queue=12)
+
+    @app.post("/queryDatasets", dependencies=[Depends(_admit_datasets)])
+    def get_datasets(...): ...
+
+  * a free slot is taken at once;
+  * otherwise the request waits (up to ADMISSION_MAX_WAIT seconds) in the
+    queue, unless the queue is full, or the user already has their share
+    of it queued, in which case it gets 503 with Retry-After immediately;
+  * a freed slot goes to the waiting user with the fewest requests already
+    running (oldest request first among equals), so one user's scripted
+    loop can't starve everyone else.
+
+Limits can be overridden per endpoint with
+ADMISSION_LIMITS="queryDatasets=6:12,runFiles=2:4" (concurrency:queue), and
+admission switched off with ADMISSION_ENABLED=0. Decisions and waits are
+exported as dunecat_admission_* metrics.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from fastapi import Depends, HTTPException
+
+from src.backend import auth
+from src.lib import metrics
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") != "0"
+ADMISSION_MAX_WAIT_S = float(os.getenv("ADMISSION_MAX_WAIT", "15"))
+
+
+def _parse_limits(spec: str) -> dict[str, tuple[int, int]]:
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            name, value = item.split("=")
+            concurrency, queue = value.split(":")
+            limits[name.strip()] = (int(concurrency), int(queue))
+        except ValueError:
+            logger.warning(f"Ignoring malformed ADMISSION_LIMITS entry: {item!r}")
+    return limits
+
+
+_OVERRIDES = _parse_limits(os.getenv("ADMISSION_LIMITS", ""))
+
+DECISIONS = metrics.counter(
+    "dunecat_admission_total",
+    "Admission decisions: admitted (at once), queued (after waiting), "
+    "rejected_queue_full, rejected_user_share, rejected_timeout.",
+    ("endpoint", "decision"))
+WAIT_SECONDS = metrics.histogram(
+    "dunecat_admission_wait_seconds",
+    "Time admitted requests spent in the admission queue.", ("endpoint",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30))
+
+
+class _Waiter:
+    __slots__ = ("user", "seq", "loop", "future", "granted")
+
+    def __init__(self, user, seq, loop):
+        self.user, self.seq, self.loop = user, seq, loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+def _grant(future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class Ticket:
+    """A held slot. Released when the request finishes; a streaming endpoint
+    can keep() it and release it itself once the stream ends."""
+
+    __slots__ = ("_admission", "user", "_start", "_released", "kept")
+
+    def __init__(self, admission, user):
+        self._admission, self.user = admission, user
+        self._start = time.perf_counter()
+        self._released = False
+        self.kept = False
+
+    def keep(self) -> "Ticket":
+        self.kept = True
+        return self
+
+    def release(self) -> None:
+        """Idempotent; safe to call from any thread."""
+        if self._admission is None:
+            return
+        with self._admission._lock:
+            if self._released:
+                return
+            self._released = True
+        self._admission._release(self.user, time.perf_counter() - self._start)
+
+
+class Admission:
+    def __init__(self, name: str, concurrency: int, queue: int,
+                 max_wait_s: float = ADMISSION_MAX_WAIT_S):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue)
+        # No user may hold more than a quarter of the queue (at least one).
+        self.user_queue_share = max(1, self.queue_size // 4)
+        self.max_wait_s = max_wait_s
+        self._running = 0
+        self._running_by_user: dict[str, int] = {}
+        self._waiters: dict[str, deque] = {}
+        self._queued = 0
+        self._seq = 0
+        # Smoothed slot hold time, for Retry-After.
+        self._hold_s = 1.0
+        self._lock = threading.Lock()
+
+    # -- state, all under self._lock ---------------------------------------
+
+    def _take(self, user) -> None:
+        self._running += 1
+        self._running_by_user[user] = self._running_by_user.get(user, 0) + 1
+
+    def _next_waiter(self) -> "_Waiter | None":
+        if not self._waiters:
+            return None
+        user = min(self._waiters, key=lambda u: (self._running_by_user.get(u, 0),
+                                                 self._waiters[u][0].seq))
+        queue = self._waiters[user]
+        waiter = queue.popleft()
+        if not queue:
+            del self._waiters[user]
+        self._queued -= 1
+        return waiter
+
+    def _unqueue(self, waiter) -> None:
+        queue = self._waiters.get(waiter.user)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._waiters[waiter.user]
+            self._queued -= 1
+
+    def _retry_after(self) -> int:
+        return min(60, max(1, math.ceil((self._queued + 1) * self._hold_s / self.concurrency)))
+
+    # ----------------------------------------------------------------------
+
+    def _release(self, user, held_s: float) -> None:
+        with self._lock:
+            self._running -= 1
+            left = self._running_by_user.get(user, 1) - 1
+            if left:
+                self._running_by_user[user] = left
+            else:
+                self._running_by_user.pop(user, None)
+            self._hold_s = 0.8 * self._hold_s + 0.2 * held_s
+            waiter = self._next_waiter()
+            if waiter is not None:
+                waiter.granted = True
+                self._take(waiter.user)
+        if waiter is not None:
+            try:
+                waiter.loop.call_soon_threadsafe(_grant, waiter.future)
+            except RuntimeError:  # loop closed (shutdown): nobody to hand it to
+                Ticket(self, waiter.user).release()
+
+    def _reject(self, decision: str, retry_after: int):
+        DECISIONS.inc(1, self.name, decision)
+        logger.warning(f"Admission {self.name}: {decision} (retry after {retry_after}s)")
+        return HTTPException(status_code=503, detail="Server busy, please retry shortly",
+                             headers={"Retry-After": str(retry_after)})
+
+    async def acquire(self, user: str) -> Ticket:
+        """Wait for a slot; raises HTTPException(503) when shedding load."""
+        if not ADMISSION_ENABLED:
+            return Ticket(None, user)
+        with self._lock:
+            if self._running < self.concurrency and not self._queued:
+                self._take(user)
+                waiter = None
+            elif self._queued >= self.queue_size:
+                raise self._reject("rejected_queue_full", self._retry_after())
+            elif len(self._waiters.get(user, ())) >= self.user_queue_share:
+                raise self._reject("rejected_user_share", self._retry_after())
+            else:
+                self._seq += 1
+                waiter = _Waiter(user, self._seq, asyncio.get_running_loop())
+                self._waiters.setdefault(user, deque()).append(waiter)
+                self._queued += 1
+        if waiter is None:
+            DECISIONS.inc(1, self.name, "admitted")
+            return Ticket(self, user)
+
+        start = time.perf_counter()
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.max_wait_s)
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._unqueue(waiter)
+            if granted:
+                # Handed a slot just as the request was cancelled: pass it on.
+                Ticket(self, user).release()
+            raise
+        with self._lock:
+            granted = waiter.granted
+            if not granted:
+                self._unqueue(waiter)
+                retry_after = self._retry_after()
+        if not granted:
+            raise self._reject("rejected_timeout", retry_after)
+        WAIT_SECONDS.observe(time.perf_counter() - start, self.name)
+        DECISIONS.inc(1, self.name, "queued")
+        return Ticket(self, user)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"running": self._running, "queued": self._queued,
+                    "concurrency": self.concurrency, "queue_size": self.queue_size,
+                    "users_waiting": len(self._waiters)}
+
+    async def __call__(self, user: auth.UserInfo = Depends(auth.get_current_user)):
+        """FastAPI dependency: hold a slot for the duration of the request."""
+        ticket = await self.acquire(user.sub)
+        try:
+            yield ticket
+        finally:
+            if not ticket.kept:
+                ticket.release()
+
+
+_controllers: dict[str, Admission] = {}
+
+
+def controller(name: str, concurrency: int, queue: int) -> Admission:
+    """The Admission for endpoint `name` (ADMISSION_LIMITS overrides the
+    defaults given here)."""
+    concurrency, queue = _OVERRIDES.get(name, (concurrency, queue))
+    admission = _controllers[name] = Admission(name, concurrency, queue)
+    return admission
+
+
+def all_stats() -> dict:
+    return {name: a.stats() for name, a in _controllers.items()}
+
+
+def _gauge_values():
+    return {(name, key): value
+            for name, stats in all_stats().items()
+            for key, value in stats.items()}
+
+
+metrics.gauge("dunecat_admission", "Admission slots in use, queue length and limits per endpoint.",
+              _gauge_values, ("endpoint", "stat"))
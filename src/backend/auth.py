@@ -25,11 +25,15 @@ usernames.
 
 from __future__ import annotations
 
+import asyncio
 import base64
 import hashlib
 import logging
 import os
 import secrets
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from typing import Any, Optional
 from urllib.parse import urlencode
@@ -40,6 +44,8 @@ from fastapi import HTTPException, Request, Response, status
 from fastapi.responses import RedirectResponse
 from pydantic import BaseModel
 
+from src.lib import http_pool, timing
+
 logger = logging.getLogger(__name__)
 
 
@@ -71,8 +77,22 @@ VERIFIER_COOKIE = "dunecat_oauth_verifier"
 # Short-lived cookies used only during the OAuth round-trip.
 _OAUTH_COOKIE_TTL_SECONDS = 10 * 60  # 10 minutes
 
-# Cached OIDC discovery document (fetched lazily on first use).
+# Cached OIDC discovery document: fetched on first use (or at startup via
+# refresh_discovery_document), then refreshed in the background once older
+# than _DISCOVERY_TTL_SECONDS, so logins never wait on it after the first.
 _discovery_cache: Optional[dict[str, Any]] = None
+_discovery_fetched_at = 0.0
+# The background refresh in flight, if any. Held here so the task isn't
+# garbage-collected before it finishes (the loop only keeps a weak ref).
+_discovery_refresh: Optional[asyncio.Task] = None
+_DISCOVERY_TTL_SECONDS = 6 * 60 * 60
+
+# Verified session tokens: sha256(token) -> (exp, UserInfo), LRU order.
+# Lets get_current_user skip the HS256 verify + claim parsing for a token
+# it has already accepted; an entry is only used until the token's exp.
+_session_cache: "OrderedDict[bytes, tuple[float, UserInfo]]" = OrderedDict()
+_session_cache_lock = threading.Lock()
+_SESSION_CACHE_MAX = 4096
 
 # Admin email allowlist, populated by ``set_admin_emails`` at startup and
 # whenever admins.json is edited via the admin config API.
@@ -109,6 +129,9 @@ def set_admin_emails(emails: list[str]) -> None:
     """Replace the in-memory admin allowlist (case-insensitive emails)."""
     global _admin_emails
     _admin_emails = {e.strip().lower() for e in emails if e and e.strip()}
+    # Cached UserInfo carries is_admin from the old list.
+    with _session_cache_lock:
+        _session_cache.clear()
     logger.info("Loaded %d admin email(s)", len(_admin_emails))
 
 
@@ -124,15 +147,44 @@ def is_admin(email: Optional[str]) -> bool:
 # ---------------------------------------------------------------------------
 
 
+async def _fetch_discovery_document() -> dict[str, Any]:
+    global _discovery_cache, _discovery_fetched_at
+    client = http_pool.get_async_client("cilogon", timeout=15.0)
+    resp = await client.get(CILOGON_DISCOVERY_URL, timeout=10.0)
+    resp.raise_for_status()
+    _discovery_cache = resp.json()
+    _discovery_fetched_at = time.monotonic()
+    logger.debug("Loaded CILogon OIDC discovery from %s", CILOGON_DISCOVERY_URL)
+    return _discovery_cache
+
+
+async def refresh_discovery_document() -> None:
+    """Re-fetch the discovery document, keeping the old one on failure."""
+    try:
+        await _fetch_discovery_document()
+    except (httpx.HTTPError, ValueError) as exc:
+        logger.warning("Could not refresh CILogon OIDC discovery: %s", exc)
+
+
+def start_discovery_refresh() -> None:
+    """Refresh the discovery document in the background (unless a refresh
+    is already running). Must be called from the event loop."""
+    global _discovery_refresh
+    if _discovery_refresh is not None and not _discovery_refresh.done():
+        return
+    _discovery_refresh = asyncio.get_running_loop().create_task(refresh_discovery_document())
+
+
 async def get_discovery_document() -> dict[str, Any]:
-    """Fetch and cache the CILogon OIDC discovery document."""
-    global _discovery_cache
+    """Return the CILogon OIDC discovery document.
+
+    Only the very first call waits for CILogon; afterwards the cached copy
+    is returned at once and refreshed in the background when it is stale.
+    """
     if _discovery_cache is None:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(CILOGON_DISCOVERY_URL)
-            resp.raise_for_status()
-            _discovery_cache = resp.json()
-        logger.debug("Loaded CILogon OIDC discovery from %s", CILOGON_DISCOVERY_URL)
+        return await _fetch_discovery_document()
+    if time.monotonic() - _discovery_fetched_at > _DISCOVERY_TTL_SECONDS:
+        start_discovery_refresh()
     return _discovery_cache
 
 
@@ -196,17 +248,50 @@ def _claims_to_user_info(claims: dict[str, Any]) -> UserInfo:
     )
 
 
+def _user_from_token(token: str) -> Optional[UserInfo]:
+    """Verified user for a session token, or ``None`` if it is invalid.
+
+    Tokens that verified before are answered from ``_session_cache`` until
+    their ``exp``.
+    """
+    with timing.phase("auth"):
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        now = time.time()
+        with _session_cache_lock:
+            cached = _session_cache.get(key)
+            if cached is not None:
+                if now < cached[0]:
+                    _session_cache.move_to_end(key)
+                    return cached[1]
+                del _session_cache[key]
+
+        claims = decode_token(token)
+        if claims is None or not claims.get("sub"):
+            return None
+        user = _claims_to_user_info(claims)
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            with _session_cache_lock:
+                _session_cache[key] = (float(exp), user)
+                while len(_session_cache) > _SESSION_CACHE_MAX:
+                    _session_cache.popitem(last=False)
+        return user
+
+
 def get_current_user(request: Request) -> UserInfo:
     """FastAPI dependency that resolves the authenticated user or 401s."""
     token = request.cookies.get(TOKEN_COOKIE)
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    claims = decode_token(token)
-    if claims is None or not claims.get("sub"):
+    user = _user_from_token(token)
+    if user is None:
         raise HTTPException(status_code=401, detail="Not authenticated")
-
-    return _claims_to_user_info(claims)
+    # Lets per-request records (e.g. the MetaCat query log) name the user.
+    request_timing = timing.current()
+    if request_timing is not None:
+        request_timing.user = user.email or user.sub
+    return user
 
 
 def require_admin(request: Request) -> UserInfo:
@@ -329,32 +414,33 @@ async def login_callback(request: Request) -> RedirectResponse:
     userinfo_endpoint = discovery["userinfo_endpoint"]
 
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            token_resp = await client.post(
-                token_endpoint,
-                data={
-                    "grant_type": "authorization_code",
-                    "code": code,
-                    "redirect_uri": CILOGON_REDIRECT_URI,
-                    "client_id": CILOGON_CLIENT_ID,
-                    "client_secret": CILOGON_CLIENT_SECRET,
-                    "code_verifier": verifier,
-                },
-                headers={"Accept": "application/json"},
-            )
-            token_resp.raise_for_status()
-            tokens = token_resp.json()
-
-            access_token = tokens.get("access_token")
-            if not access_token:
-                raise RuntimeError("CILogon token response did not include access_token")
-
-            userinfo_resp = await client.get(
-                userinfo_endpoint,
-                headers={"Authorization": f"Bearer {access_token}"},
-            )
-            userinfo_resp.raise_for_status()
-            userinfo = userinfo_resp.json()
+        # Pooled: logins reuse the connection to CILogon.
+        client = http_pool.get_async_client("cilogon", timeout=15.0)
+        token_resp = await client.post(
+            token_endpoint,
+            data={
+                "grant_type": "authorization_code",
+                "code": code,
+                "redirect_uri": CILOGON_REDIRECT_URI,
+                "client_id": CILOGON_CLIENT_ID,
+                "client_secret": CILOGON_CLIENT_SECRET,
+                "code_verifier": verifier,
+            },
+            headers={"Accept": "application/json"},
+        )
+        token_resp.raise_for_status()
+        tokens = token_resp.json()
+
+        access_token = tokens.get("access_token")
+        if not access_token:
+            raise RuntimeError("CILogon token response did not include access_token")
+
+        userinfo_resp = await client.get(
+            userinfo_endpoint,
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        userinfo_resp.raise_for_status()
+        userinfo = userinfo_resp.json()
     except (httpx.HTTPError, RuntimeError) as exc:
         logger.exception("CILogon token/userinfo exchange failed: %s", exc)
         response = _frontend_redirect("/", auth_error="token_exchange_failed")
@@ -418,12 +504,12 @@ async def check_auth(request: Request) -> AuthResponse:
     if not token:
         return AuthResponse(authenticated=False, message="Not authenticated")
 
-    claims = decode_token(token)
-    if claims is None or not claims.get("sub"):
+    user = _user_from_token(token)
+    if user is None:
         return AuthResponse(authenticated=False, message="Not authenticated")
 
     return AuthResponse(
         authenticated=True,
         message="Authenticated",
-        user=_claims_to_user_info(claims),
+        user=user,
     )
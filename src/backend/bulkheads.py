@@ -0,0 +1,164 @@
+"""
+bulkheads.py — separate, sized worker-thread budgets per upstream.
+
+Sync endpoints all share anyio's default thread limiter (40 threads), so a
+flood of slow MetaCat aggregates can take every thread and leave cheap ConDB
+or replica lookups, and every other sync handler, queuing behind them. Work
+bound for an upstream runs in that upstream's bulkhead instead:
+
+    result = await bulkheads.CONDB.run(condb_api.get_run_conditions, folder, run)
+    result = await run_cancellable(request, work, timeout_s=..., bulkhead=bulkheads.METACAT_QUERY)
+
+    METACAT_QUERY      dataset/file searches and file details
+    METACAT_AGGREGATE  size summaries and run -> file resolution
+    CONDB              conditions lookups and run searches
+    RUCIO              replica lookups and vault logins
+
+A slot is held until the worker thread actually finishes, including work
+abandoned by a cancelled request that is still winding down, so a bulkhead
+never runs more than its size at once. Work abandoned before it got a slot
+is skipped altogether. Sizes are set with BULKHEAD_<NAME>_SIZE (e.g.
+BULKHEAD_METACAT_AGGREGATE_SIZE=6); usage is exported as dunecat_bulkhead*
+metrics.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+
+import anyio
+
+from src.lib import metrics, timing
+
+logger = logging.getLogger(__name__)
+
+WAIT_SECONDS = metrics.histogram(
+    "dunecat_bulkhead_wait_seconds",
+    "Time work waited for a slot in its bulkhead.", ("bulkhead",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+SKIPPED = metrics.counter(
+    "dunecat_bulkhead_skipped_total",
+    "Work abandoned (request cancelled) before its thread started.", ("bulkhead",))
+
+# The bulkheads do the limiting; their threads are dispatched through this
+# unbounded limiter so none of them take tokens from anyio's default one.
+_DISPATCH = anyio.CapacityLimiter(math.inf)
+
+_PENDING, _RUNNING, _ABANDONED = "pending", "running", "abandoned"
+
+
+class Bulkhead:
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = int(os.getenv(f"BULKHEAD_{name.upper()}_SIZE", size))
+        self.limiter = anyio.CapacityLimiter(self.size)
+        self.completed = 0
+
+    async def run(self, func, *args, abandon_on_cancel: bool = False):
+        """Run func(*args) in a worker thread once a slot is free."""
+        borrower = object()
+        start = time.perf_counter()
+        await self.limiter.acquire_on_behalf_of(borrower)
+        waited = time.perf_counter() - start
+        WAIT_SECONDS.observe(waited, self.name)
+        timing.add("queue", waited, start)
+
+        loop = asyncio.get_running_loop()
+        state = [_PENDING]
+        state_lock = threading.Lock()
+
+        def release(completed=True):
+            self.completed += completed
+            self.limiter.release_on_behalf_of(borrower)
+
+        def call():
+            with state_lock:
+                if state[0] == _ABANDONED:
+                    return None
+                state[0] = _RUNNING
+            try:
+                return func(*args)
+            finally:
+                if not loop.is_closed():
+                    try:
+                        loop.call_soon_threadsafe(release)
+                    except RuntimeError:  # closed meanwhile (shutdown)
+                        pass
+
+        try:
+            return await anyio.to_thread.run_sync(
+                call, abandon_on_cancel=abandon_on_cancel, limiter=_DISPATCH)
+        except BaseException:
+            with state_lock:
+                never_ran = state[0] == _PENDING
+                if never_ran:
+                    state[0] = _ABANDONED
+            if never_ran:
+                SKIPPED.inc(1, self.name)
+                release(completed=False)
+            raise
+
+    async def iterate(self, iterator, cancel=None):
+        """Async generator pulling each item of a blocking iterator (e.g. a
+        streamed response body) in this bulkhead; the iterator is closed in
+        the bulkhead too, even when the consumer goes away.
+
+        `cancel`, if given, is called as soon as the consumer goes away
+        (e.g. the set() of an Event the iterator polls), so an item being
+        read at that moment stops early instead of holding the slot until
+        it completes; closing then waits for that read to unwind.
+        """
+        done = object()
+        busy = threading.Lock()
+
+        def step():
+            with busy:
+                return next(iterator, done)
+
+        def close():
+            with busy:
+                close_iterator = getattr(iterator, "close", None)
+                if close_iterator is not None:
+                    close_iterator()
+
+        try:
+            while True:
+                item = await self.run(step, abandon_on_cancel=cancel is not None)
+                if item is done:
+                    return
+                yield item
+        finally:
+            if cancel is not None:
+                cancel()
+            with anyio.CancelScope(shield=True):
+                await self.run(close)
+
+    def stats(self) -> dict:
+        statistics = self.limiter.statistics()
+        return {"in_use": statistics.borrowed_tokens, "size": self.size,
+                "waiting": statistics.tasks_waiting, "completed": self.completed}
+
+
+METACAT_QUERY = Bulkhead("metacat_query", 16)
+METACAT_AGGREGATE = Bulkhead("metacat_aggregate", 6)
+CONDB = Bulkhead("condb", 12)
+RUCIO = Bulkhead("rucio", 12)
+
+ALL = (METACAT_QUERY, METACAT_AGGREGATE, CONDB, RUCIO)
+
+
+def all_stats() -> dict:
+    return {b.name: b.stats() for b in ALL}
+
+
+def _gauge_values():
+    return {(name, key): value
+            for name, stats in all_stats().items()
+            for key, value in stats.items()}
+
+
+metrics.gauge("dunecat_bulkhead", "Bulkhead threads in use, size, waiters and completed work.",
+              _gauge_values, ("bulkhead", "stat"))
@@ -43,6 +43,8 @@ from typing import Callable, TypeVar
 import anyio
 from fastapi import HTTPException, Request
 
+from src.lib import metrics
+
 logger = logging.getLogger(__name__)
 
 T = TypeVar("T")
@@ -72,6 +74,7 @@ async def run_cancellable(
     work: Callable[[Callable[[], bool]], T],
     *,
     timeout_s: float,
+    bulkhead=None,
 ) -> T:
     """Run ``work`` in a worker thread, cancelling it if the client
     disconnects or ``timeout_s`` elapses.
@@ -82,6 +85,9 @@ async def run_cancellable(
             returning the result. It should poll the predicate during any
             long streaming loop and stop when it returns True.
         timeout_s: hard upper bound on how long to wait before giving up.
+        bulkhead: the bulkheads.Bulkhead to run ``work`` in (default: anyio's
+            shared worker threads). Time spent waiting for a slot counts
+            towards ``timeout_s``.
 
     Returns:
         Whatever ``work`` returns.
@@ -91,9 +97,11 @@ async def run_cancellable(
         HTTPException(499): the client disconnected before the work finished.
             (499 is nginx's "client closed request"; the response is discarded
             since the client is already gone.)
+        Any exception raised by ``work`` itself, unchanged.
     """
     cancel_event = threading.Event()
     value: object = _UNSET
+    error: Exception | None = None
 
     try:
         with anyio.fail_after(timeout_s):
@@ -108,19 +116,30 @@ async def run_cancellable(
                                 "Client disconnected; cancelling in-flight query."
                             )
                             cancel_event.set()
+                            metrics.CANCELLATIONS.inc(1, "disconnect")
                             tg.cancel_scope.cancel()
                             return
                         await anyio.sleep(_DISCONNECT_POLL_S)
 
                 async def run_work() -> None:
-                    nonlocal value
+                    nonlocal value, error
                     # abandon_on_cancel=True: if the scope is cancelled
                     # (disconnect or timeout) the loop stops waiting on the
                     # thread immediately. The thread is not killed, but it
                     # observes cancel_event and winds down on its own.
-                    value = await anyio.to_thread.run_sync(
-                        work, cancel_event.is_set, abandon_on_cancel=True
-                    )
+                    try:
+                        if bulkhead is not None:
+                            value = await bulkhead.run(
+                                work, cancel_event.is_set, abandon_on_cancel=True
+                            )
+                        else:
+                            value = await anyio.to_thread.run_sync(
+                                work, cancel_event.is_set, abandon_on_cancel=True
+                            )
+                    except Exception as e:
+                        # Re-raised below as itself, not wrapped in the task
+                        # group's ExceptionGroup, so FastAPI's handlers apply.
+                        error = e
                     # Work is done — stop the monitor and leave the group.
                     tg.cancel_scope.cancel()
 
@@ -128,6 +147,7 @@ async def run_cancellable(
                 tg.start_soon(run_work)
     except TimeoutError:
         cancel_event.set()
+        metrics.CANCELLATIONS.inc(1, "timeout")
         logger.warning("Upstream query exceeded %.0fs budget; cancelled.", timeout_s)
         raise HTTPException(status_code=504, detail="Upstream query timed out")
     finally:
@@ -135,6 +155,9 @@ async def run_cancellable(
         # thread is told to stop (harmless if it already finished).
         cancel_event.set()
 
+    if error is not None:
+        raise error
+
     if value is _UNSET:
         # The group unwound without the work producing a value: the client
         # disconnected. Nothing is listening, so this response is discarded.
@@ -1,20 +1,44 @@
 """
 condb_router.py — FastAPI router for looking up a run's conditions record
-Endpoint:
-  POST /runConditions  {folder?, run}  -> {success, results: {...}}
+Endpoints:
+  POST /searchRuns           {folder?|all_folders, conditions} -> {success, runs: [...]}
+  POST /runConditions        {folder?, run}            -> {success, results: {...}}
+  POST /runConditions/batch  {folder?, runs?, ranges?} -> {success, runs: {run: {...}}, errors}
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 
-from src.backend import auth
+from src.backend import admission, auth, bulkheads
 from src.lib.condb_api import (
     ConditionsDBAPI, KNOWN_FOLDERS, DEFAULT_FOLDER, FIELD_METADATA, CANONICAL_FIELDS,
 )
+from src.lib.condb_mirror import CONDB_MIRROR_PATH, ConDBMirror
+from src.lib import timing
 
 router = APIRouter(tags=["conditions-db"])
 condb_api = ConditionsDBAPI()
 
+# Local copy of the known folders for /searchRuns; None when not configured.
+condb_mirror = (
+    ConDBMirror(condb_api, CONDB_MIRROR_PATH, KNOWN_FOLDERS)
+    if CONDB_MIRROR_PATH and condb_api.base_url else None
+)
+
+# Admission control (see src/backend/admission.py). Single-run lookups are
+# mostly cache hits, so they get the most slots.
+_admit_search = admission.controller("searchRuns", concurrency=4, queue=8)
+_admit_conditions = admission.controller("runConditions", concurrency=8, queue=16)
+_admit_batch = admission.controller("runConditionsBatch", concurrency=3, queue=6)
+
+
+@router.on_event("startup")
+def start_condb_mirror():
+    if condb_mirror is not None:
+        condb_mirror.start()
+
 
 def _build_preview(folder: str, results: dict) -> dict:
     """
@@ -49,13 +73,82 @@ class RunSearchCondition(BaseModel):
 class RunSearchRequest(BaseModel):
     folder: str | None = None
     conditions: list[RunSearchCondition]
+    # Search every folder in KNOWN_FOLDERS at once (folder is ignored).
+    all_folders: bool = False
+    # Cross-folder results are merged, sorted on this canonical field and
+    # paginated; single-folder searches keep the folder's own order.
+    sort_field: str = "run_number"
+    descending: bool = False
+    offset: int = 0
+    page_size: int = 200
 
 
 ALLOWED_OPS = {"<", "<=", "=", "!=", ">=", ">"}
 
+# Cross-folder paging reaches at most this many rows deep (offset +
+# page_size). ConDB's /search can't sort, so a folder not yet mirrored is
+# fetched up to this many rows and sorted here; past that, the order (and
+# "total") can no longer be exact.
+MAX_ALL_FOLDERS_ROWS = 5000
+
+# Folders of an all-folder search are searched concurrently on this shared
+# pool, so concurrent searches can't multiply the threads hitting ConDB.
+_FOLDER_SEARCH_WORKERS = 4
+_folder_search_pool = ThreadPoolExecutor(max_workers=_FOLDER_SEARCH_WORKERS,
+                                         thread_name_prefix="condb-search")
+
 
-@router.post("/searchRuns")
-def search_runs(
+def _resolve_conditions(folder: str, conditions: list[RunSearchCondition]
+                        ) -> list[tuple[str, str, object]] | str:
+    """Map canonical conditions onto `folder`'s raw columns.
+
+    Returns the resolved (raw_column, op, value) list, or an error message
+    naming the first field this folder doesn't have.
+    """
+    resolved: list[tuple[str, str, object]] = []
+    for cond in conditions:
+        raw_col = CANONICAL_FIELDS.get(cond.field, {}).get(folder)
+        if raw_col is None:
+            return f"Field '{cond.field}' is not available for this folder"
+        resolved.append((raw_col, cond.op, cond.value))
+    return resolved
+
+
+def _search_folder(folder: str, resolved: list[tuple[str, str, object]],
+                   limit: int = 200, order_by: str | None = None,
+                   descending: bool = False) -> tuple[dict, str]:
+    """Run one folder's search on the mirror if it's ready, else on ConDB.
+
+    With `order_by`, the mirror returns the first `limit` rows in that
+    order; ConDB can't sort, so it is asked for up to MAX_ALL_FOLDERS_ROWS
+    rows instead and the caller sorts them.
+
+    Returns (search_runs-style result, "mirror" | "condb").
+    """
+    if condb_mirror is not None and condb_mirror.is_ready(folder):
+        return condb_mirror.search_runs(folder, resolved, limit=limit, order_by=order_by,
+                                        descending=descending), "mirror"
+    if order_by is not None:
+        limit = MAX_ALL_FOLDERS_ROWS
+    return condb_api.search_runs(folder, resolved, limit=limit), "condb"
+
+
+def _sort_rows(rows: list[tuple], descending: bool) -> list[tuple]:
+    """Sort (value, folder, row) tuples on value, then folder. Rows without
+    a value go last in either direction; mixed value types (e.g. a
+    numeric-looking string) compare by their string form. The sort is
+    stable, so equal values keep each folder's run order."""
+    present = [m for m in rows if m[0] is not None]
+    missing = [m for m in rows if m[0] is None]
+    try:
+        present.sort(key=lambda m: (m[0], m[1]), reverse=descending)
+    except TypeError:
+        present.sort(key=lambda m: (str(m[0]), m[1]), reverse=descending)
+    return present + missing
+
+
+@router.post("/searchRuns", dependencies=[Depends(_admit_search)])
+async def search_runs(
     request: RunSearchRequest,
     user: auth.UserInfo = Depends(auth.get_current_user),
 ):
@@ -65,25 +158,28 @@ def search_runs(
     resolved to the folder's actual column name via CANONICAL_FIELDS, so
     the same request shape works for HD and VD despite their differing
     column names.
+
+    Answered from the local folder mirror (see condb_mirror) once it has
+    synced this folder, otherwise by ConDB's /search. With all_folders set,
+    see _search_all_folders.
     """
-    folder = request.folder or DEFAULT_FOLDER
-    resolved: list[tuple[str, str, object]] = []
     for cond in request.conditions:
         if cond.op not in ALLOWED_OPS:
             raise HTTPException(400, f"Invalid operator: {cond.op}")
-        raw_col = CANONICAL_FIELDS.get(cond.field, {}).get(folder)
-        if raw_col is None:
-            raise HTTPException(
-                400, f"Field '{cond.field}' is not available for this folder"
-            )
-        resolved.append((raw_col, cond.op, cond.value))
+    if request.all_folders:
+        return await bulkheads.CONDB.run(_search_all_folders, request)
+
+    folder = request.folder or DEFAULT_FOLDER
+    resolved = _resolve_conditions(folder, request.conditions)
+    if isinstance(resolved, str):
+        raise HTTPException(400, resolved)
 
-    result = condb_api.search_runs(folder, resolved)
+    result, source = await bulkheads.CONDB.run(_search_folder, folder, resolved)
     if not result["success"]:
         raise HTTPException(502, result.get("message", "Conditions DB search failed"))
 
     runs = [
-        {"results": row, "preview": _build_preview(folder, row)}
+        {"folder": folder, "results": row, "preview": _build_preview(folder, row)}
         for row in result["results"]
     ]
     return {
@@ -92,6 +188,94 @@ def search_runs(
         "truncated": result.get("truncated", False),
         "folder": folder,
         "field_metadata": FIELD_METADATA.get(folder, {}),
+        "source": source,
+    }
+
+
+def _search_all_folders(request: RunSearchRequest) -> dict:
+    """
+    Folder-agnostic search: resolve the conditions for every known folder,
+    query all of them concurrently (so the latency is the slowest folder's,
+    not the sum), then merge, sort on request.sort_field and return one page.
+    Each folder is searched in the requested order (see _search_folder), so
+    the rows it contributes are the ones that can land on the page.
+    Folders lacking one of the fields are skipped; a folder whose search
+    fails is reported in "errors" unless every folder failed. "total" is
+    the number of matching runs, or None when it isn't known exactly.
+    """
+    if request.sort_field not in CANONICAL_FIELDS:
+        raise HTTPException(400, f"Unknown sort field: {request.sort_field}")
+    if request.offset < 0 or not 0 < request.page_size <= 1000:
+        raise HTTPException(400, "offset must be >= 0 and page_size in 1..1000")
+    if request.offset + request.page_size > MAX_ALL_FOLDERS_ROWS:
+        raise HTTPException(400, f"Cannot page past {MAX_ALL_FOLDERS_ROWS} runs; "
+                                 "narrow the conditions instead")
+
+    skipped: dict[str, str] = {}
+    plans: dict[str, list[tuple[str, str, object]]] = {}
+    for folder in KNOWN_FOLDERS:
+        resolved = _resolve_conditions(folder, request.conditions)
+        if isinstance(resolved, str):
+            skipped[folder] = resolved
+        else:
+            plans[folder] = resolved
+    if not plans:
+        raise HTTPException(400, "No folder has all of the requested fields")
+
+    # Every folder must return enough rows to fill this page on its own.
+    end = request.offset + request.page_size
+
+    def search(folder: str) -> tuple[dict, str | None]:
+        # Any failure (open circuit, mirror error, ...) is this folder's
+        # alone; it is reported in "errors" rather than failing the merge.
+        try:
+            return _search_folder(folder, plans[folder], limit=end,
+                                  order_by=CANONICAL_FIELDS[request.sort_field].get(folder),
+                                  descending=request.descending)
+        except Exception as e:
+            return {"success": False, "message": str(e) or type(e).__name__}, None
+
+    outcomes = dict(zip(plans, _folder_search_pool.map(search, plans)))
+
+    errors: dict[str, str] = {}
+    merged = []
+    total: int | None = 0
+    for folder, (result, source) in outcomes.items():
+        if not result["success"]:
+            errors[folder] = result.get("message", "Conditions DB search failed")
+            total = None
+            continue
+        if total is not None:
+            if "total" in result:
+                total += result["total"]
+            elif not result.get("truncated", False):
+                total += len(result["results"])
+            else:
+                total = None
+        sort_key = CANONICAL_FIELDS[request.sort_field].get(folder)
+        rows = _sort_rows([(row.get(sort_key), folder, row) for row in result["results"]],
+                          request.descending)
+        merged.extend(rows[:end])
+    if errors and len(errors) == len(outcomes):
+        raise HTTPException(502, "; ".join(f"{f}: {m}" for f, m in errors.items()))
+
+    merged = _sort_rows(merged, request.descending)
+    page = merged[request.offset:end]
+    runs = [
+        {"folder": folder, "results": row, "preview": _build_preview(folder, row)}
+        for _value, folder, row in page
+    ]
+    return {
+        "success": True,
+        "runs": runs,
+        "total": total,
+        "offset": request.offset,
+        "truncated": total is None or total > end,
+        "folders": list(plans),
+        "skipped_folders": skipped,
+        "errors": errors,
+        "field_metadata": {folder: FIELD_METADATA.get(folder, {}) for folder in plans},
+        "sources": {folder: source for folder, (_result, source) in outcomes.items()},
     }
 
 
@@ -111,8 +295,70 @@ def list_condb_folders(user: auth.UserInfo = Depends(auth.get_current_user)):
     }
 
 
-@router.post("/runConditions")
-def get_run_conditions(
+# Upper bound on how many run numbers one batch request may cover (individual
+# runs plus the full width of every range).
+MAX_BATCH_RUNS = 1000
+
+
+class RunRange(BaseModel):
+    start: int
+    end: int   # inclusive
+
+
+class RunConditionsBatchRequest(BaseModel):
+    folder: str | None = None
+    runs: list[int] = []
+    ranges: list[RunRange] = []
+
+
+@router.post("/runConditions/batch", dependencies=[Depends(_admit_batch)])
+async def get_run_conditions_batch(
+    request: RunConditionsBatchRequest,
+    user: auth.UserInfo = Depends(auth.get_current_user),
+):
+    """
+    Fetch conditions records for a list of runs and/or inclusive run ranges
+    in one request (e.g. for comparing runs side by side). Ranges -- and
+    stretches of consecutive runs -- are fetched with a single ConDB search;
+    scattered runs are fetched concurrently.
+
+    Returns:
+        {"success": True, "runs": {"<run>": {"results", "preview"}, ...},
+         "errors": {"<run>" or "<start>-<end>": message, ...}, ...}
+        A run that can't be fetched is reported in "errors" rather than
+        failing the whole batch.
+    Raises:
+        HTTPException 400 for an inverted range, 413 if the batch is too big.
+    """
+    folder = request.folder or DEFAULT_FOLDER
+    for r in request.ranges:
+        if r.end < r.start:
+            raise HTTPException(400, f"Invalid run range {r.start}-{r.end}")
+    width = len(request.runs) + sum(r.end - r.start + 1 for r in request.ranges)
+    if width > MAX_BATCH_RUNS:
+        raise HTTPException(413, f"Max {MAX_BATCH_RUNS} runs per request")
+
+    result = await bulkheads.CONDB.run(
+        condb_api.get_runs_batch,
+        folder, request.runs, [(r.start, r.end) for r in request.ranges],
+    )
+    runs = {
+        str(run): {"results": row, "preview": _build_preview(folder, row)}
+        for run, row in sorted(result["results"].items())
+    }
+    return {
+        "success": True,
+        "runs": runs,
+        "errors": result["errors"],
+        "field_metadata": FIELD_METADATA.get(folder, {}),
+        "folder": folder,
+        "namespace": KNOWN_FOLDERS.get(folder, {}).get("namespace"),
+    }
+
+
+@router.post("/runConditions", dependencies=[Depends(_admit_conditions)])
+@timing.timed_handler
+async def get_run_conditions(
     request: RunConditionsRequest,
     user: auth.UserInfo = Depends(auth.get_current_user),
 ):
@@ -125,14 +371,16 @@ def get_run_conditions(
         HTTPException 404 if the run has no conditions record, 500 on error.
     """
     folder = request.folder or DEFAULT_FOLDER
-    result = condb_api.get_run_conditions(folder, request.run)
+    result = await bulkheads.CONDB.run(condb_api.get_run_conditions, folder, request.run)
     if not result["success"]:
         raise HTTPException(status_code=404, detail=result.get("message", "Run not found"))
 
+    with timing.phase("format"):
+        preview = _build_preview(folder, result["results"])
     return {
         "success": True,
         "results": result["results"],
-        "preview": _build_preview(folder, result["results"]),
+        "preview": preview,
         "field_metadata": FIELD_METADATA.get(folder, {}),
         "folder": folder,
         "namespace": KNOWN_FOLDERS.get(folder, {}).get("namespace"),
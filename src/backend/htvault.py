@@ -19,7 +19,7 @@ server-side (see token_store.py) and mint short-lived access tokens per request.
 
 import secrets
 
-import httpx
+from src.lib import http_pool
 
 
 class HTVaultError(Exception):
@@ -37,7 +37,7 @@ class HTVaultClient:
         self.issuer = issuer
         self.role = role
         self.oidc_path = "auth/oidc-%s/oidc" % issuer
-        self._http = httpx.Client(verify=verify, timeout=timeout)
+        self._http = http_pool.get_client("vault", verify=verify, timeout=timeout)
 
     def _url(self, path):
         return "%s/v1/%s" % (self.vault_url, path.lstrip("/"))
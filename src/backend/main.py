@@ -4,13 +4,22 @@ from datetime import datetime
 from typing import Dict, List, Optional, Any
 from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 import logging
 import tempfile
 import shutil
+import threading
+import time
+import anyio
+from src.lib import mcatapi
 from src.lib.mcatapi import MetaCatAPI
-from src.backend import auth
-from src.backend import rucio_router
+from src.lib import breaker, http_pool, memory, metrics, query_log, timing
+from src.lib.condb_api import KNOWN_FOLDERS, DEFAULT_FOLDER
+from src.backend import admission, auth, bulkheads
+from src.backend.cancellable import run_cancellable
+from src.backend import profiler, rucio_router, rse_ranking
 from src.backend import condb_router
 
 # Configure logging
@@ -35,6 +44,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+class InstrumentationMiddleware:
+    """Per request: binds a timing.RequestTiming (Server-Timing header and
+    sampled traces, see src/lib/timing.py) and records the latency (until
+    the last body chunk is sent, so streamed responses count in full) by
+    route template and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = [500]
+        request_timing, token = timing.begin()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                server_timing = timing.response_started(request_timing)
+                if server_timing:
+                    message["headers"] = [*message.get("headers", []),
+                                          (b"server-timing", server_timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            timing.end(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.REQUEST_SECONDS.observe(
+                time.perf_counter() - start, scope["method"], route, str(status[0]))
+            timing.finish(request_timing, scope["method"], route, status[0])
+
+
+app.add_middleware(InstrumentationMiddleware)
+
+
+@app.exception_handler(breaker.CircuitOpen)
+async def circuit_open_handler(request: Request, exc: breaker.CircuitOpen):
+    """An upstream's circuit breaker is open (src/lib/breaker.py): fail fast."""
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
 # Initialize MetaCat API
 metacat_api = MetaCatAPI()
 
@@ -44,6 +98,13 @@ async def startup_event():
     global admin_usernames
     admin_usernames = get_admin_usernames()
     auth.set_admin_emails(admin_usernames)
+    # Warm the OIDC discovery cache so the first login doesn't wait on it.
+    auth.start_discovery_refresh()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await http_pool.aclose_all()
 
 
 # Get the absolute path to the project root directory
@@ -86,6 +147,16 @@ async def auth_me(request: Request):
     return await auth.check_auth(request)
 
 
+# Admission control (see src/backend/admission.py): per-endpoint concurrency
+# and wait-queue limits, checked before a worker thread is taken. MetaCat
+# aggregates (sizes, run resolution) get fewer slots than plain searches.
+_admit_datasets = admission.controller("queryDatasets", concurrency=6, queue=12)
+_admit_files = admission.controller("queryFiles", concurrency=6, queue=12)
+_admit_file_details = admission.controller("fileDetails", concurrency=6, queue=12)
+_admit_sizes = admission.controller("datasetSizes", concurrency=3, queue=6)
+_admit_run_files = admission.controller("runFiles", concurrency=2, queue=4)
+
+
 class DatasetRequest(BaseModel):
     query: str
     category: str
@@ -94,9 +165,11 @@ class DatasetRequest(BaseModel):
     customMql: Optional[str] = None
 
 
-@app.post("/queryDatasets")
-def get_datasets(
+@app.post("/queryDatasets", dependencies=[Depends(_admit_datasets)])
+@timing.timed_handler
+async def get_datasets(
     request: DatasetRequest,
+    http_request: Request,
     user: auth.UserInfo = Depends(auth.get_current_user),
 ) -> dict:
     """
@@ -107,7 +180,9 @@ def get_datasets(
 
     Returns:
         A dictionary with a "success" key and value True if the query succeeds,
-        and a "results" key with the query results.
+        and a "results" key with the query results. "truncated" is true when
+        the search hit its time/row/byte budget and "results" holds only the
+        datasets found until then.
     Raises:
         HTTPException: If the query fails.
     """
@@ -115,12 +190,22 @@ def get_datasets(
     if request.customMql:
         print('Using custom MQL:', request.customMql)
     
-    result = metacat_api.get_datasets(
-        request.query, 
-        request.category, 
-        request.tab, 
-        request.officialOnly,
-        request.customMql
+    # Reaching the soft budget returns the datasets found so far (truncated)
+    # well before the hard timeout below would answer 504.
+    budget = mcatapi.QueryBudget.default()
+    result = await run_cancellable(
+        http_request,
+        lambda is_cancelled: metacat_api.get_datasets(
+            request.query,
+            request.category,
+            request.tab,
+            request.officialOnly,
+            request.customMql,
+            is_cancelled=is_cancelled,
+            budget=budget,
+        ),
+        timeout_s=mcatapi.METACAT_TIMEOUT_S,
+        bulkhead=bulkheads.METACAT_QUERY,
     )
     
     if not result["success"]:
@@ -128,6 +213,67 @@ def get_datasets(
     return result
 
 
+# Optional bearer token for /metrics; unset means the endpoint is open (it
+# exposes only counters, no user data).
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or None
+
+
+def _thread_pool_usage():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return {("in_use",): limiter.borrowed_tokens, ("limit",): limiter.total_tokens}
+
+
+def _cache_stats():
+    out = {}
+    for name, cache in (("rucio_replicas", rucio_router.reader.cache),
+                        ("rucio_coverage", rucio_router.reader.coverage_cache)):
+        stats = cache.stats()
+        for key in ("entries", "approx_bytes", "hits", "misses", "evictions", "expirations"):
+            out[(name, key)] = stats[key]
+    out[("condb_run_conditions", "entries")] = len(condb_router.condb_api.cache)
+    out[("auth_sessions", "entries")] = len(auth._session_cache)
+    return out
+
+
+def _http_pool_usage():
+    return {(pool, key): value
+            for pool, stats in http_pool.pool_stats().items()
+            for key, value in stats.items()}
+
+
+metrics.gauge("dunecat_threadpool_tokens",
+              "Worker threads running sync endpoints (in_use) and the pool size (limit).",
+              _thread_pool_usage, ("state",))
+metrics.gauge("dunecat_cache", "In-process cache sizes and counters.",
+              _cache_stats, ("cache", "stat"))
+metrics.gauge("dunecat_http_pool", "Outbound HTTP connection pool usage and counters.",
+              _http_pool_usage, ("pool", "stat"))
+
+
+# Long-lived in-process structures, for GET /admin/memory.
+memory.register("metacat_dataset_sizes", lambda: mcatapi._dataset_size_cache)
+memory.register("metacat_run_datasets", lambda: mcatapi._run_datasets_cache)
+memory.register("metacat_inflight_results", lambda: mcatapi._inflight_results)
+memory.register_stats("rucio_replicas", lambda: rucio_router.reader.cache.stats())
+memory.register_stats("rucio_coverage", lambda: rucio_router.reader.coverage_cache.stats())
+memory.register("rucio_pending_logins", lambda: rucio_router._PENDING)
+memory.register("vault_tokens", lambda: rucio_router.tokens._d)
+memory.register("condb_run_conditions", lambda: condb_router.condb_api.cache._d)
+memory.register("auth_sessions", lambda: auth._session_cache)
+memory.register("rse_user_locations", lambda: rse_ranking._user_locations)
+memory.register("query_log", lambda: query_log._entries)
+memory.register("request_traces", lambda: timing._traces)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Prometheus text-format metrics (see src/lib/metrics.py)."""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return PlainTextResponse(metrics.render(),
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/health")
 async def health_check() -> dict:
     """
@@ -150,9 +296,11 @@ class FileRequest(BaseModel):
     name: str
 
 
-@app.post("/queryFiles")
-def get_files(
+@app.post("/queryFiles", dependencies=[Depends(_admit_files)])
+@timing.timed_handler
+async def get_files(
     request: FileRequest,
+    http_request: Request,
     user: auth.UserInfo = Depends(auth.get_current_user),
 ):
     """
@@ -166,7 +314,14 @@ def get_files(
         HTTPException if a server error occurs
     """
     try:
-        result = metacat_api.get_files(request.namespace, request.name)
+        budget = mcatapi.QueryBudget.default()
+        result = await run_cancellable(
+            http_request,
+            lambda is_cancelled: metacat_api.get_files(
+                request.namespace, request.name, is_cancelled=is_cancelled, budget=budget),
+            timeout_s=mcatapi.METACAT_TIMEOUT_S,
+            bulkhead=bulkheads.METACAT_QUERY,
+        )
         if not result["success"]:
             # If the API call was successful but returned an error
             raise HTTPException(
@@ -175,6 +330,8 @@ def get_files(
             )
             
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         print('Error in get_files:', str(e))
         raise HTTPException(status_code=500, detail=str(e))
@@ -185,9 +342,11 @@ class FileDetailsRequest(BaseModel):
     name: str
 
 
-@app.post("/fileDetails")
-def get_file_details(
+@app.post("/fileDetails", dependencies=[Depends(_admit_file_details)])
+@timing.timed_handler
+async def get_file_details(
     request: FileDetailsRequest,
+    http_request: Request,
     user: auth.UserInfo = Depends(auth.get_current_user),
 ):
     """
@@ -202,7 +361,13 @@ def get_file_details(
         HTTPException 404 if the file is not found, 500 on server errors
     """
     try:
-        result = metacat_api.get_file_details(request.namespace, request.name)
+        result = await run_cancellable(
+            http_request,
+            lambda is_cancelled: metacat_api.get_file_details(
+                request.namespace, request.name, is_cancelled=is_cancelled),
+            timeout_s=mcatapi.METACAT_TIMEOUT_S,
+            bulkhead=bulkheads.METACAT_QUERY,
+        )
         if not result["success"]:
             raise HTTPException(
                 status_code=404,
@@ -225,9 +390,10 @@ class DatasetSizesRequest(BaseModel):
     datasets: list[DatasetKey]
 
 
-@app.post("/datasetSizes")
-def get_dataset_sizes(
+@app.post("/datasetSizes", dependencies=[Depends(_admit_sizes)])
+async def get_dataset_sizes(
     request: DatasetSizesRequest,
+    http_request: Request,
     user: auth.UserInfo = Depends(auth.get_current_user),
 ):
     """
@@ -240,8 +406,13 @@ def get_dataset_sizes(
     if len(request.datasets) > 25:
         raise HTTPException(status_code=413, detail="Max 25 datasets per request")
     try:
-        result = metacat_api.get_dataset_sizes(
-            [{"namespace": d.namespace, "name": d.name} for d in request.datasets]
+        datasets = [{"namespace": d.namespace, "name": d.name} for d in request.datasets]
+        # Each size is bounded by METACAT_SIZE_TIMEOUT_S; this is the backstop.
+        result = await run_cancellable(
+            http_request,
+            lambda is_cancelled: metacat_api.get_dataset_sizes(datasets, is_cancelled=is_cancelled),
+            timeout_s=mcatapi.METACAT_SIZE_TIMEOUT_S + 30,
+            bulkhead=bulkheads.METACAT_AGGREGATE,
         )
         if not result["success"]:
             raise HTTPException(status_code=500, detail=result.get("message", "Size lookup failed"))
@@ -253,6 +424,69 @@ def get_dataset_sizes(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class RunFilesRequest(BaseModel):
+    runs: list[int]
+    folder: Optional[str] = None     # ConDB folder the runs came from
+    namespace: Optional[str] = None  # overrides the folder's MetaCat namespace
+    filesPerRun: int = 100
+
+
+@app.post("/runFiles")
+async def get_run_files(
+    request: RunFilesRequest,
+    user: auth.UserInfo = Depends(auth.get_current_user),
+    ticket: admission.Ticket = Depends(_admit_run_files),
+):
+    """
+    Resolves run numbers (e.g. from /searchRuns) to the MetaCat files and
+    datasets holding them, using the namespace KNOWN_FOLDERS gives for the
+    ConDB folder.
+
+    Returns:
+        A newline-delimited JSON stream: one {"run", "files", "datasets",
+        "truncated", "mqlQuery"} object per run (or {"run", "error"}) as
+        each batch of runs resolves, then a final {"done": true}.
+    Raises:
+        HTTPException 400 if no namespace is known for the folder, 413 if
+        more than 500 runs are requested.
+    """
+    if len(request.runs) > 500:
+        raise HTTPException(status_code=413, detail="Max 500 runs per request")
+    if not 0 < request.filesPerRun <= 1000:
+        raise HTTPException(status_code=400, detail="filesPerRun must be between 1 and 1000")
+    folder = request.folder or DEFAULT_FOLDER
+    namespace = request.namespace or KNOWN_FOLDERS.get(folder, {}).get("namespace")
+    if not namespace or '"' in namespace:
+        raise HTTPException(status_code=400, detail=f"No MetaCat namespace known for folder {folder}")
+
+    # Set when the client goes away, so the run batch in flight and the
+    # remaining ones stop issuing MetaCat queries.
+    cancelled = threading.Event()
+
+    def lines():
+        try:
+            for group in metacat_api.iter_run_files(
+                request.runs, namespace, request.filesPerRun, is_cancelled=cancelled.is_set,
+            ):
+                yield json.dumps(group) + "\n"
+            yield json.dumps({"done": True, "namespace": namespace, "folder": folder}) + "\n"
+        finally:
+            cancelled.set()
+
+    async def stream():
+        try:
+            async for line in bulkheads.METACAT_AGGREGATE.iterate(lines(), cancel=cancelled.set):
+                yield line
+        finally:
+            ticket.release()
+
+    # The admission slot is held until the stream ends, not just until the
+    # response starts; the background task covers a stream that never ran.
+    ticket.keep()
+    return StreamingResponse(stream(), media_type="application/x-ndjson",
+                             background=BackgroundTask(ticket.release))
+
+
 class DatasetStatsRequest(BaseModel):
     namespace: str
     name: str
@@ -272,6 +506,8 @@ def record_dataset_access(
     Returns:
         dict: Updated dataset access statistics
     """
+    # Also used to rank Rucio replica sites for this user.
+    rse_ranking.remember_location(user.sub, request.location)
     try:
         # logger.info(f"Received dataset access request for: {request.namespace}/{request.name}")
         # Load existing stats
@@ -406,6 +642,142 @@ def verify_admin_route(admin_user: str = Depends(verify_admin)) -> str:
     return admin_user
 
 
+@app.get("/admin/traces")
+def recent_traces(limit: int = 50, path: Optional[str] = None, min_ms: float = 0,
+                  admin_user: str = Depends(verify_admin)) -> dict:
+    """Most recent sampled request traces (see src/lib/timing.py), newest first."""
+    return {"success": True, "traces": timing.recent_traces(limit, path, min_ms)}
+
+
+@app.get("/admin/queryLog")
+def query_log_entries(limit: int = 100, min_ms: float = 0, user: Optional[str] = None,
+                      admin_user: str = Depends(verify_admin)) -> dict:
+    """Recent MetaCat queries (see src/lib/query_log.py), newest first."""
+    return {"success": True, "queries": query_log.recent(limit, min_ms, user)}
+
+
+@app.get("/admin/queryStats")
+def query_stats(sort: str = "total", limit: int = 20, since_s: Optional[float] = None,
+                admin_user: str = Depends(verify_admin)) -> dict:
+    """
+    MetaCat queries grouped by normalized shape, most expensive first.
+
+    Args:
+        sort: "total" (summed duration), "p95", "max" or "count"
+        limit: number of shapes to return
+        since_s: only consider queries from the last `since_s` seconds
+    """
+    if sort not in ("total", "p95", "max", "count"):
+        raise HTTPException(status_code=400, detail="sort must be total, p95, max or count")
+    return {"success": True, "shapes": query_log.top_shapes(limit, sort, since_s)}
+
+
+@app.get("/admin/profile")
+async def profile_backend(seconds: float = 10, interval_ms: float = 10, format: str = "speedscope",
+                          admin_user: str = Depends(verify_admin)):
+    """
+    Sample every thread of this process for `seconds` (max 60) and return
+    the profile, as a speedscope JSON document or collapsed stacks
+    (format=collapsed). See src/backend/profiler.py.
+    """
+    if format not in ("speedscope", "collapsed"):
+        raise HTTPException(status_code=400, detail="format must be speedscope or collapsed")
+    logger.info(f"Profiling backend for {seconds}s at {interval_ms}ms (requested by {admin_user})")
+    try:
+        # A limiter of its own per call: the sampler must not wait behind
+        # (or take a slot from) the worker threads it is meant to observe,
+        # and a concurrent request must reach sample()'s busy check at once
+        # rather than queue for the running profile's whole window.
+        result = await anyio.to_thread.run_sync(
+            profiler.sample, seconds, interval_ms / 1000, limiter=anyio.CapacityLimiter(1))
+    except profiler.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already being taken")
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed(result))
+    return profiler.speedscope(result)
+
+
+@app.get("/admin/memory")
+def memory_report(admin_user: str = Depends(verify_admin)) -> dict:
+    """Process RSS, entries and approximate size of each registered cache or
+    registry, and the tracemalloc state (see src/lib/memory.py)."""
+    return {"success": True, "rss_bytes": memory.rss_bytes(),
+            "structures": memory.report(), "tracemalloc": memory.tracemalloc_status()}
+
+
+@app.post("/admin/memory/tracemalloc")
+def memory_tracing(enable: bool, frames: int = 1,
+                   admin_user: str = Depends(verify_admin)) -> dict:
+    """Switch allocation tracing on (with `frames` of traceback) or off.
+    Turning it off discards the snapshots taken so far."""
+    logger.info(f"tracemalloc {'on' if enable else 'off'} (requested by {admin_user})")
+    if enable:
+        memory.start_tracing(frames)
+    else:
+        memory.stop_tracing()
+    return {"success": True, "tracemalloc": memory.tracemalloc_status()}
+
+
+_MEMORY_GROUPINGS = ("subsystem", "filename", "lineno")
+
+
+@app.post("/admin/memory/snapshot")
+def memory_snapshot(group_by: str = "subsystem", limit: int = 25,
+                    admin_user: str = Depends(verify_admin)) -> dict:
+    """Take a tracemalloc snapshot; returns its id and largest allocation sites."""
+    if group_by not in _MEMORY_GROUPINGS:
+        raise HTTPException(status_code=400, detail="group_by must be subsystem, filename or lineno")
+    try:
+        snapshot_id = memory.take_snapshot()
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"success": True, "id": snapshot_id, "top": memory.top(snapshot_id, group_by, limit)}
+
+
+@app.get("/admin/memory/diff")
+def memory_diff(since: int, until: Optional[int] = None, group_by: str = "subsystem",
+                limit: int = 25, admin_user: str = Depends(verify_admin)) -> dict:
+    """
+    Allocation growth between snapshot `since` and snapshot `until` (default:
+    a new snapshot taken now), largest growth first.
+    """
+    if group_by not in _MEMORY_GROUPINGS:
+        raise HTTPException(status_code=400, detail="group_by must be subsystem, filename or lineno")
+    try:
+        if until is None:
+            until = memory.take_snapshot()
+        return {"success": True, "since": since, "until": until,
+                "diff": memory.diff(since, until, group_by, limit)}
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"No snapshot {e.args[0]}")
+
+
+@app.get("/admin/admission")
+def admission_stats(admin_user: str = Depends(verify_admin)) -> dict:
+    """Admission slots in use and queue lengths per endpoint."""
+    return {"success": True, "endpoints": admission.all_stats()}
+
+
+@app.get("/admin/bulkheads")
+def bulkhead_stats(admin_user: str = Depends(verify_admin)) -> dict:
+    """Worker threads in use and waiting work per upstream bulkhead."""
+    return {"success": True, "bulkheads": bulkheads.all_stats()}
+
+
+@app.get("/admin/breakers")
+def breaker_stats(admin_user: str = Depends(verify_admin)) -> dict:
+    """Circuit breaker state and current adaptive timeout per upstream."""
+    return {"success": True, "breakers": breaker.all_stats()}
+
+
+@app.get("/admin/httpPools")
+def http_pool_stats(admin_user: str = Depends(verify_admin)) -> dict:
+    """Connection pool usage of the outbound HTTP clients (see src/lib/http_pool.py)."""
+    return {"success": True, "pools": http_pool.pool_stats()}
+
+
 class ConfigRequest(BaseModel):
     file: str
 
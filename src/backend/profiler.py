@@ -0,0 +1,130 @@
+"""
+profiler.py — on-demand sampling profiler for the running backend
+(GET /admin/profile in main.py).
+
+Samples the stack of every thread via sys._current_frames() at a fixed
+interval for a few seconds, from a thread of its own, so nothing has to be
+restarted or pre-instrumented. The cost is one stack walk per thread per
+sample (~100 Hz by default) and only while a profile is being taken.
+
+Output is either collapsed stacks ("thread;outer;...;inner count" lines, for
+flamegraph.pl / speedscope's import) or a speedscope JSON document with one
+sampled profile per thread.
+"""
+
+import os
+import sys
+import threading
+import time
+
+MAX_SECONDS = 60
+MIN_INTERVAL_S = 0.001
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """A profile is already being taken."""
+
+
+def _frame_label(code) -> tuple[str, str, int]:
+    """(function, short file path, first line) for a code object."""
+    filename = code.co_filename
+    i = filename.rfind("site-packages" + os.sep)
+    if i >= 0:
+        filename = filename[i + len("site-packages" + os.sep):]
+    else:
+        i = filename.rfind(os.sep + "src" + os.sep)
+        if i >= 0:
+            filename = filename[i + 1:]
+    return code.co_name, filename, code.co_firstlineno
+
+
+def sample(seconds: float, interval_s: float = 0.01) -> dict:
+    """
+    Sample all threads for `seconds`. Returns
+    {"duration_s", "interval_s", "samples", "stacks": {thread: {stack: count}}}
+    where each stack is a tuple of (function, file, line), outermost first.
+
+    Raises:
+        ProfilerBusy: another profile is in progress.
+    """
+    seconds = min(max(seconds, 0.0), MAX_SECONDS)
+    interval_s = max(interval_s, MIN_INTERVAL_S)
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        me = threading.get_ident()
+        stacks: dict[str, dict[tuple, int]] = {}
+        labels: dict = {}
+        taken = 0
+        start = time.perf_counter()
+        deadline = start + seconds
+        while True:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = _frame_label(code)
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.reverse()
+                per_thread = stacks.setdefault(names.get(ident, str(ident)), {})
+                key = tuple(stack)
+                per_thread[key] = per_thread.get(key, 0) + 1
+            taken += 1
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            time.sleep(min(interval_s, deadline - now))
+        return {"duration_s": time.perf_counter() - start, "interval_s": interval_s,
+                "samples": taken, "stacks": stacks}
+    finally:
+        _running.release()
+
+
+def collapsed(profile: dict) -> str:
+    """Brendan Gregg's collapsed-stack format, one line per distinct stack."""
+    lines = []
+    for thread, per_thread in profile["stacks"].items():
+        for stack, count in per_thread.items():
+            frames = [thread.replace(";", ":")]
+            frames += ["%s (%s:%d)" % f for f in stack]
+            lines.append("%s %d" % (";".join(frames), count))
+    lines.sort()
+    return "\n".join(lines) + "\n"
+
+
+def speedscope(profile: dict, name: str = "dunecatalog backend") -> dict:
+    """A speedscope (https://www.speedscope.app) file: one sampled profile per thread."""
+    frames, index = [], {}
+    profiles = []
+    for thread, per_thread in sorted(profile["stacks"].items()):
+        samples, weights = [], []
+        for stack, count in per_thread.items():
+            ids = []
+            for f in stack:
+                i = index.get(f)
+                if i is None:
+                    i = index[f] = len(frames)
+                    frames.append({"name": f[0], "file": f[1], "line": f[2]})
+                ids.append(i)
+            samples.append(ids)
+            weights.append(count * profile["interval_s"])
+        profiles.append({
+            "type": "sampled", "name": thread, "unit": "seconds",
+            "startValue": 0, "endValue": sum(weights),
+            "samples": samples, "weights": weights,
+        })
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "dunecatalog",
+        "shared": {"frames": frames},
+        "profiles": profiles,
+    }
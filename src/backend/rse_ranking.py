@@ -0,0 +1,161 @@
+"""
+rse_ranking.py — order replica sites by expected transfer performance for
+the user asking.
+
+Replica lists come back from Rucio in no useful order (parse_replica_sites
+sorts them by RSE name). This module ranks them so that the first site is
+the one a user should copy from: disk before tape, then by expected
+throughput from the user's region.
+
+Two tables drive the ranking, both in src/config and editable from the
+admin config page:
+
+  rse_regions.json     (required for proximity ranking)
+      {"rses":      {"FNAL_DCACHE": "north_america", ...},
+       "locations": {"Illinois": "north_america", "England": "europe", ...},
+       "estimates": {"same_region": 100, "other_region": 10}}
+
+      `locations` maps the parts of the free-text location the frontend
+      records ("City, State", see getUserLocation in src/lib/api.ts) to a
+      region; `estimates` are the MB/s assumed where nothing was measured.
+
+  rse_throughput.json  (optional, measured MB/s per site and client region)
+      {"FNAL_DCACHE": {"north_america": 450, "europe": 60, "default": 120}}
+
+Both are held in memory and re-read when their mtime changes, so edits
+take effect on the next request without a restart; reload() forces it.
+"""
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config'))
+REGIONS_FILE = os.path.join(CONFIG_PATH, 'rse_regions.json')
+THROUGHPUT_FILE = os.path.join(CONFIG_PATH, 'rse_throughput.json')
+
+_TYPE_ORDER = {"disk": 0, "unknown": 1, "tape": 2}
+_DEFAULT_ESTIMATES = {"same_region": 100.0, "other_region": 10.0}
+
+# Last location each user reported, so calls that don't carry one (e.g.
+# the batch endpoint) still rank for where the user is. Bounded: oldest
+# users are dropped first.
+_MAX_REMEMBERED_USERS = 10_000
+
+
+class _JsonTable:
+    """A JSON config file cached in memory, re-read when it changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._data = self._read() if mtime is not None else {}
+                    self._mtime = mtime
+        return self._data
+
+    def invalidate(self):
+        with self._lock:
+            self._mtime = None
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load %s: %s", self.path, e)
+            return {}
+
+
+_regions = _JsonTable(REGIONS_FILE)
+_throughput = _JsonTable(THROUGHPUT_FILE)
+_user_locations = {}
+_user_locations_lock = threading.Lock()
+
+
+def reload():
+    """Re-read both tables on next use."""
+    _regions.invalidate()
+    _throughput.invalidate()
+
+
+def remember_location(user, location):
+    """Record `location` as `user`'s current location (ignored if unknown)."""
+    if not location or location == "Unknown Location":
+        return
+    with _user_locations_lock:
+        _user_locations.pop(user, None)
+        _user_locations[user] = location
+        while len(_user_locations) > _MAX_REMEMBERED_USERS:
+            _user_locations.pop(next(iter(_user_locations)))
+
+
+def location_of(user):
+    with _user_locations_lock:
+        return _user_locations.get(user)
+
+
+def region_of(location):
+    """Region for a "City, State" style location, or None if unknown.
+
+    The most specific match wins: the whole string, then each
+    comma-separated part from the last (state/country) to the first.
+    """
+    if not location:
+        return None
+    table = {k.lower(): v for k, v in (_regions.get().get("locations") or {}).items()}
+    parts = [p.strip().lower() for p in location.split(",") if p.strip()]
+    for key in [location.strip().lower(), *reversed(parts)]:
+        if key in table:
+            return table[key]
+    return None
+
+
+def _expected_throughput(rse, region, rse_regions, measured, estimates):
+    per_region = measured.get(rse)
+    if isinstance(per_region, dict):
+        value = per_region.get(region) if region else None
+        if value is None:
+            value = per_region.get("default")
+        if isinstance(value, (int, float)):
+            return float(value)
+    if region is None or rse not in rse_regions:
+        return 0.0
+    key = "same_region" if rse_regions[rse] == region else "other_region"
+    return float(estimates.get(key, _DEFAULT_ESTIMATES[key]))
+
+
+def rank_sites(sites, location=None):
+    """Return `sites` (parse_replica_sites output) best-first for `location`.
+
+    Disk before tape; then highest expected MB/s (measured if known,
+    otherwise the same/other-region estimate); then RSE name. The site
+    dicts are not modified (they may be shared through the replica cache).
+    """
+    config = _regions.get()
+    rse_regions = config.get("rses") or {}
+    estimates = {**_DEFAULT_ESTIMATES, **(config.get("estimates") or {})}
+    measured = _throughput.get()
+    region = region_of(location)
+
+    def key(site):
+        rse = site.get("rse")
+        return (_TYPE_ORDER.get(site.get("type"), 1),
+                -_expected_throughput(rse, region, rse_regions, measured, estimates),
+                rse or "")
+
+    return sorted(sites, key=key)
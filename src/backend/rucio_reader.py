@@ -12,28 +12,66 @@ result BY SITE (RSE) for display:
       ...
     ]
 
-Cached in-process for one hour, so most requests never touch Rucio or mint a
-token. If the vault token has expired, get_replicas raises NeedReLogin.
+Cached in-process for one hour (in a bounded LRU shared by all users), so
+most requests never touch Rucio or mint a token. Minted access tokens are
+cached per user until shortly before they expire (and refreshed in the
+background as that approaches), so a cache miss costs one Rucio call rather
+than a vault round trip plus a Rucio call.
+If the vault token has expired, get_replicas raises NeedReLogin.
 """
 
 import json
+import logging
 import threading
 import time
+from collections import OrderedDict
 
 import httpx
+import jwt
 
+from src.backend.cancellable import QueryCancelled
 from src.backend.htvault import HTVaultError
+from src.lib import http_pool, metrics
+
+try:  # optional: a faster JSON decoder for large replica listings
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 
 DEFAULT_RUCIO_HOST = "https://dune-rucio.fnal.gov"
 DEFAULT_SCHEMES = ("root",)   # protocols shown to users
 CACHE_TTL_SECONDS = 3600             # 1 hour
 MINT_MIN_SECONDS = 600               # ask vault for >=10 min of validity
+BATCH_CHUNK = 500                    # DIDs per replicas/list call in batch lookups
+COVERAGE_PROGRESS_EVERY = 1000       # files between coverage progress events
+TOKEN_REFRESH_MARGIN_S = 180         # re-mint in the background below this
+TOKEN_MIN_USABLE_S = 30              # never hand out a token closer to expiry
+
+logger = logging.getLogger(__name__)
 
 
 class NeedReLogin(Exception):
     """The user's vault token is missing/expired; they must re-run begin_auth."""
 
 
+class _TokenRejected(NeedReLogin):
+    """Rucio refused an access token (it may only be that token, not the
+    user's vault session, that is no longer good)."""
+
+
+def _token_expiry(token):
+    """Unix expiry of an access token, read from its (unverified) JWT exp
+    claim; vault guarantees at least MINT_MIN_SECONDS if it isn't readable."""
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+        if exp:
+            return float(exp)
+    except (jwt.PyJWTError, TypeError, ValueError):
+        pass
+    return time.time() + MINT_MIN_SECONDS
+
+
 _TYPE_LABEL = {"DISK": "disk", "TAPE": "tape"}
 _PROTO_ORDER = {"root": 0, "davs": 1, "https": 2, "gsiftp": 3, "srm": 4}
 
@@ -46,107 +84,507 @@ def _scheme_of(pfn):
 def parse_replica_sites(lines):
     """x-json-stream body -> list of per-RSE sites, each with its protocols.
 
-    Every RSE is returned (no priority ranking); storage type (disk/tape) is a
-    field, not folded into the name.
+    Every RSE is returned, by name (rse_ranking.rank_sites orders them per
+    user); storage type (disk/tape) is a field, not folded into the name.
+    `lines` may be any iterable (e.g. a streaming response's iter_lines());
+    it is consumed one line at a time.
+    """
+    sites = _SiteAccumulator()
+    for line in lines:
+        if line and line.strip():
+            sites.add(_loads(line))
+    return sites.result()
+
+
+def parse_replica_sites_by_did(lines):
+    """x-json-stream body for many DIDs -> {"scope:name": [sites...]}.
+
+    Each line of a multi-DID replicas/list response is one file replica
+    record carrying its own scope/name; records are regrouped per file and
+    each group goes through the same per-RSE grouping as parse_replica_sites.
     """
-    sites = {}   # rse -> {"rse", "type", "pfns": [...]}
+    by_did = {}
     for line in lines:
         if not line or not line.strip():
             continue
-        rep = json.loads(line)
+        rep = _loads(line)
+        did = "%s:%s" % (rep.get("scope"), rep.get("name"))
+        acc = by_did.get(did)
+        if acc is None:
+            acc = by_did[did] = _SiteAccumulator()
+        acc.add(rep)
+    return {did: acc.result() for did, acc in by_did.items()}
+
+
+class _SiteAccumulator:
+    """Folds replica records into per-RSE sites as they arrive."""
+
+    def __init__(self):
+        self.sites = {}   # rse -> {"rse", "type", "pfns": [...]}
+
+    def add(self, rep):
         for pfn, meta in (rep.get("pfns") or {}).items():
             meta = meta or {}
             rse = meta.get("rse") or "UNKNOWN"
             stype = _TYPE_LABEL.get((meta.get("type") or "").upper(), "unknown")
-            site = sites.setdefault(rse, {"rse": rse, "type": stype, "pfns": []})
+            site = self.sites.setdefault(rse, {"rse": rse, "type": stype, "pfns": []})
             if site["type"] == "unknown" and stype != "unknown":
                 site["type"] = stype
             site["pfns"].append({"protocol": _scheme_of(pfn), "pfn": pfn})
 
-    out = []
-    for rse in sorted(sites):
-        s = sites[rse]
-        s["pfns"].sort(key=lambda p: (_PROTO_ORDER.get(p["protocol"], 99), p["pfn"]))
-        out.append(s)
-    return out
+    def result(self):
+        out = []
+        for rse in sorted(self.sites):
+            s = self.sites[rse]
+            s["pfns"].sort(key=lambda p: (_PROTO_ORDER.get(p["protocol"], 99), p["pfn"]))
+            out.append(s)
+        return out
+
+
+def _coverage_summary(dataset, per_site, files, total_bytes, disk_files):
+    """Aggregates from RucioReader._stream_coverage -> report dict, with
+    sites ordered by bytes held (largest first)."""
+    sites = [
+        {"rse": rse, "type": stype, "files": agg["files"], "bytes": agg["bytes"],
+         "file_fraction": agg["files"] / files if files else 0.0,
+         "byte_fraction": agg["bytes"] / total_bytes if total_bytes else 0.0}
+        for (rse, stype), agg in per_site.items()
+    ]
+    sites.sort(key=lambda s: (-s["bytes"], -s["files"], s["rse"]))
+    return {
+        "dataset": dataset,
+        "files": files,
+        "bytes": total_bytes,
+        "disk_files": disk_files,
+        "tape_only_files": files - disk_files,
+        "sites": sites,
+    }
+
+
+def _until_cancelled(lines, is_cancelled, check_every=100):
+    """Pass lines through, raising QueryCancelled once is_cancelled()."""
+    for i, line in enumerate(lines):
+        if i % check_every == 0 and is_cancelled():
+            raise QueryCancelled()
+        yield line
+
+
+def _counted(lines, call):
+    """Pass lines through, counting them as rows of the metrics `call`."""
+    for line in lines:
+        call.rows += 1
+        yield line
+
+
+def _split_did(did):
+    scope, sep, name = did.partition(":")
+    if not sep or not scope or not name:
+        raise ValueError("invalid DID %r (expected scope:name)" % did)
+    return scope, name
+
+
+def _approx_size(value):
+    """Rough in-memory footprint of a cached value (str/list/dict/scalars),
+    used for the cache's byte budget. Cheaper than sys.getsizeof recursion
+    and close enough for budgeting."""
+    if isinstance(value, str):
+        return 50 + len(value)
+    if isinstance(value, dict):
+        return 64 + sum(_approx_size(k) + _approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(_approx_size(v) for v in value)
+    return 32
 
 
 class _TTLCache:
-    def __init__(self, ttl):
+    """Thread-safe TTL cache bounded by entry count and an approximate byte
+    budget, evicting least-recently-used entries first.
+
+    Empty values ([] / None / {}: e.g. a DID with no replicas) are kept for
+    the shorter `negative_ttl`, so they are retried sooner. Expired entries
+    are swept out every `sweep_interval` seconds (opportunistically, on
+    writes) rather than lingering until the same key is read again.
+    """
+
+    def __init__(self, ttl, max_entries=50_000, max_bytes=64 * 2**20,
+                 negative_ttl=300, sweep_interval=60):
         self.ttl = ttl
-        self._d = {}
+        self.negative_ttl = min(negative_ttl, ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._d = OrderedDict()   # key -> (expires, size, value), LRU first
+        self._bytes = 0
         self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self.hits = self.misses = self.evictions = self.expirations = 0
 
     def get(self, key):
         with self._lock:
             item = self._d.get(key)
             if not item:
+                self.misses += 1
                 return None
-            expires, value = item
+            expires, size, value = item
             if time.time() >= expires:
-                self._d.pop(key, None)
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
                 return None
+            self._d.move_to_end(key)
+            self.hits += 1
             return value
 
     def set(self, key, value):
+        now = time.time()
+        size = _approx_size(key) + _approx_size(value)
+        ttl = self.ttl if value else self.negative_ttl
         with self._lock:
-            self._d[key] = (time.time() + self.ttl, value)
+            if key in self._d:
+                self._drop(key)
+            self._d[key] = (now + ttl, size, value)
+            self._bytes += size
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+            while self._d and (len(self._d) > self.max_entries
+                               or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._d)))
+                self.evictions += 1
 
     def clear(self):
         with self._lock:
             self._d.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._d),
+                "approx_bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _drop(self, key):
+        _expires, size, _value = self._d.pop(key)
+        self._bytes -= size
+
+    def _sweep(self, now):
+        expired = [k for k, (expires, _s, _v) in self._d.items() if now >= expires]
+        for key in expired:
+            self._drop(key)
+        self.expirations += len(expired)
+        self._last_sweep = now
+
+
+# Replica data doesn't depend on who asked, so every RucioReader (and every
+# user) shares these unless given its own.
+shared_replica_cache = _TTLCache(CACHE_TTL_SECONDS)
+shared_coverage_cache = _TTLCache(CACHE_TTL_SECONDS, max_entries=2_000)
 
 
 class RucioReader:
     def __init__(self, vault, token_store,
                  rucio_host=DEFAULT_RUCIO_HOST, domain="wan",
-                 verify=True, timeout=30, cache_ttl=CACHE_TTL_SECONDS):
+                 verify=True, timeout=30, cache=None, coverage_cache=None):
         self.vault = vault
         self.token_store = token_store          # callable(user)->{vault_token,credkey}|None
         self.rucio_host = rucio_host.rstrip("/")
         self.domain = domain
-        self._http = httpx.Client(verify=verify, timeout=timeout)
-        self.cache = _TTLCache(cache_ttl)
+        self._http = http_pool.get_client("rucio", verify=verify, timeout=timeout)
+        self.cache = cache if cache is not None else shared_replica_cache
+        self.coverage_cache = (coverage_cache if coverage_cache is not None
+                               else shared_coverage_cache)
+        # user -> {"token", "expires", "vault_token"}; minted access tokens.
+        self._tokens = {}
+        self._tokens_lock = threading.Lock()
+        self._mint_locks = {}      # user -> Lock, so one user mints at a time
+        self._refreshing = set()   # users with a background re-mint running
 
     def _access_token(self, user):
+        """A valid Rucio access token for `user`, minted only when needed."""
         creds = self.token_store(user)
         if not creds:
             raise NeedReLogin("no stored vault token for user")
+        token = self._cached_token(user, creds)
+        if token is not None:
+            return token
+        # Only one mint per user at a time: a burst of lookups waits here
+        # for the first one's token instead of each minting its own.
+        with self._mint_lock(user):
+            token = self._cached_token(user, creds)
+            if token is not None:
+                return token
+            return self._mint(user, creds)
+
+    def _cached_token(self, user, creds):
+        with self._tokens_lock:
+            entry = self._tokens.get(user)
+        # A new vault token (the user reconnected) invalidates the cache.
+        if not entry or entry["vault_token"] != creds["vault_token"]:
+            return None
+        remaining = entry["expires"] - time.time()
+        if remaining <= TOKEN_MIN_USABLE_S:
+            return None
+        if remaining < TOKEN_REFRESH_MARGIN_S:
+            self._refresh_in_background(user, creds)
+        return entry["token"]
+
+    def _mint_lock(self, user):
+        with self._tokens_lock:
+            return self._mint_locks.setdefault(user, threading.Lock())
+
+    def _mint(self, user, creds):
         try:
-            return self.vault.mint_access_token(
-                creds["vault_token"], creds["credkey"],
-                minimum_seconds=MINT_MIN_SECONDS)
+            with metrics.upstream("vault", "mint"):
+                token = self.vault.mint_access_token(
+                    creds["vault_token"], creds["credkey"],
+                    minimum_seconds=MINT_MIN_SECONDS)
         except httpx.HTTPStatusError as e:
             if e.response is not None and e.response.status_code in (401, 403):
+                self.forget_token(user)
                 raise NeedReLogin("vault token expired") from e
             raise
         except HTVaultError as e:
             raise NeedReLogin(str(e)) from e
+        with self._tokens_lock:
+            self._prune_tokens(time.time())
+            self._tokens[user] = {"token": token, "expires": _token_expiry(token),
+                                  "vault_token": creds["vault_token"]}
+        return token
+
+    def _prune_tokens(self, now):
+        """Drop expired access tokens, and the mint locks of users left
+        without one (unless in use); call with _tokens_lock held."""
+        for user in [u for u, e in self._tokens.items() if e["expires"] <= now]:
+            del self._tokens[user]
+        for user in [u for u, lock in self._mint_locks.items()
+                     if u not in self._tokens and u not in self._refreshing
+                     and not lock.locked()]:
+            del self._mint_locks[user]
+
+    def _refresh_in_background(self, user, creds):
+        with self._tokens_lock:
+            if user in self._refreshing:
+                return
+            self._refreshing.add(user)
+
+        def refresh():
+            try:
+                with self._mint_lock(user):
+                    self._mint(user, creds)
+            except Exception as e:
+                # The current token is still usable; the next lookup after
+                # it expires will mint synchronously and surface any error.
+                logger.warning("Background access-token refresh failed: %s", e)
+            finally:
+                with self._tokens_lock:
+                    self._refreshing.discard(user)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def forget_token(self, user, token=None):
+        """Drop `user`'s cached access token (only if it is `token`, if given)."""
+        with self._tokens_lock:
+            entry = self._tokens.get(user)
+            if entry and (token is None or entry["token"] == token):
+                del self._tokens[user]
+
+    def _with_token(self, user, call):
+        """Run call(token); if Rucio rejects a cached token, mint a fresh one
+        and retry once before concluding the user must log in again."""
+        token = self._access_token(user)
+        try:
+            return call(token)
+        except _TokenRejected:
+            self.forget_token(user, token)
+        token = self._access_token(user)
+        try:
+            return call(token)
+        except _TokenRejected:
+            self.forget_token(user, token)
+            raise
 
-    def get_replicas(self, user, scope, name, schemes=DEFAULT_SCHEMES):
-        """Cached-or-fresh per-site replica records for a file DID."""
-        key = "%s:%s|%s|%s" % (scope, name, ",".join(schemes), self.domain)
+    def _cache_key(self, did, schemes):
+        return "%s|%s|%s" % (did, ",".join(schemes), self.domain)
+
+    def get_replicas(self, user, scope, name, schemes=DEFAULT_SCHEMES,
+                     is_cancelled=None):
+        """Cached-or-fresh per-site replica records for a file DID.
+
+        `is_cancelled`, if given, is polled while the response streams in;
+        when it returns True the Rucio connection is closed and
+        QueryCancelled raised.
+        """
+        key = self._cache_key("%s:%s" % (scope, name), schemes)
         cached = self.cache.get(key)
         if cached is not None:
             return cached
-        token = self._access_token(user)
-        sites = self._list_replicas(token, scope, name, list(schemes))
+        sites = self._with_token(
+            user, lambda token: self._list_replicas(
+                token, [(scope, name)], list(schemes), parse_replica_sites, is_cancelled))
         self.cache.set(key, sites)
         return sites
 
-    def _list_replicas(self, token, scope, name, schemes):
+    def get_replicas_batch(self, user, dids, schemes=DEFAULT_SCHEMES,
+                           is_cancelled=None):
+        """Per-site replica records for many file DIDs ("scope:name").
+
+        Cached DIDs are answered from the cache; the rest go to Rucio in
+        replicas/list calls of up to BATCH_CHUNK DIDs each, and every DID is
+        cached individually (a DID with no replicas gets an empty list).
+        Returns {did: sites}.
+        """
+        out, missing = {}, []
+        for did in dict.fromkeys(dids):
+            cached = self.cache.get(self._cache_key(did, schemes))
+            if cached is not None:
+                out[did] = cached
+            else:
+                missing.append(did)
+        if not missing:
+            return out
+
+        for i in range(0, len(missing), BATCH_CHUNK):
+            chunk = missing[i:i + BATCH_CHUNK]
+            pairs = [_split_did(did) for did in chunk]
+            found = self._with_token(
+                user, lambda token: self._list_replicas(
+                    token, pairs, list(schemes), parse_replica_sites_by_did, is_cancelled))
+            for did in chunk:
+                sites = found.get(did, [])
+                self.cache.set(self._cache_key(did, schemes), sites)
+                out[did] = sites
+        return out
+
+    def get_dataset_replicas(self, user, scope, name, schemes=DEFAULT_SCHEMES,
+                             is_cancelled=None):
+        """Per-site replica records for every file of a dataset/container.
+
+        One replicas/list call on the collection DID; Rucio expands it to its
+        files. Each file's sites are cached as if looked up individually.
+        Returns {file_did: sites}.
+        """
+        found = self._with_token(
+            user, lambda token: self._list_replicas(
+                token, [(scope, name)], list(schemes), parse_replica_sites_by_did, is_cancelled))
+        for did, sites in found.items():
+            self.cache.set(self._cache_key(did, schemes), sites)
+        return found
+
+    def dataset_coverage(self, user, scope, name, is_cancelled=None):
+        """Stream a per-RSE coverage report for a dataset.
+
+        Returns an iterator of events: {"progress": {"files", "bytes"}}
+        every COVERAGE_PROGRESS_EVERY files while Rucio's replica listing
+        streams in, then {"summary": {...}} (see _coverage_summary). The
+        access token is obtained before this returns, so NeedReLogin is
+        raised here rather than mid-stream; a cached token Rucio rejects is
+        re-minted once (see _with_token) before the first event. A finished
+        summary is cached like replica records. `is_cancelled`, if given, is polled while the
+        listing streams in; once True the connection is closed and
+        QueryCancelled raised.
+        """
+        key = "%s:%s|coverage|%s" % (scope, name, self.domain)
+        cached = self.coverage_cache.get(key)
+        if cached is not None:
+            return iter([{"summary": cached, "cached": True}])
+        self._access_token(user)   # NeedReLogin now; the stream reuses it
+        return self._stream_coverage(user, scope, name, key, is_cancelled)
+
+    def _open_replicas_list(self, token, body):
+        """Send POST replicas/list and return the streaming response, which
+        the caller must close; raises _TokenRejected on 401/403."""
+        request = self._http.build_request(
+            "POST", self.rucio_host + "/replicas/list",
+            headers={"X-Rucio-Auth-Token": token, "Content-Type": "application/json"},
+            json=body)
+        r = self._http.send(request, stream=True)
+        if r.status_code in (401, 403):
+            r.close()
+            raise _TokenRejected("Rucio rejected the access token")
+        return r
+
+    def _stream_coverage(self, user, scope, name, key, is_cancelled=None):
+        per_site = {}   # (rse, type) -> {"files", "bytes"}
+        files = total_bytes = disk_files = 0
         body = {
             "dids": [{"scope": scope, "name": name}],
+            "domain": self.domain,
+            "ignore_availability": True,
+            "all_states": False,
+        }
+        with metrics.upstream("rucio", "replicas_list") as call:
+            r = self._with_token(user, lambda token: self._open_replicas_list(token, body))
+            try:
+                r.raise_for_status()
+                lines = r.iter_lines()
+                if is_cancelled is not None:
+                    lines = _until_cancelled(lines, is_cancelled)
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    rep = _loads(line)
+                    nbytes = int(rep.get("bytes") or 0)
+                    # One file can list several PFNs per RSE; count the RSE once.
+                    where = {}
+                    for meta in (rep.get("pfns") or {}).values():
+                        meta = meta or {}
+                        rse = meta.get("rse") or "UNKNOWN"
+                        stype = _TYPE_LABEL.get((meta.get("type") or "").upper(), "unknown")
+                        if where.get(rse, "unknown") == "unknown":
+                            where[rse] = stype
+                    for rse in rep.get("rses") or {}:
+                        where.setdefault(rse, "unknown")
+                    for rse, stype in where.items():
+                        agg = per_site.setdefault((rse, stype), {"files": 0, "bytes": 0})
+                        agg["files"] += 1
+                        agg["bytes"] += nbytes
+                    files += 1
+                    total_bytes += nbytes
+                    call.rows += 1
+                    call.nbytes = r.num_bytes_downloaded
+                    if "disk" in where.values():
+                        disk_files += 1
+                    if files % COVERAGE_PROGRESS_EVERY == 0:
+                        yield {"progress": {"files": files, "bytes": total_bytes}}
+            finally:
+                # Closing drops the connection if Rucio is still sending.
+                r.close()
+
+        summary = _coverage_summary("%s:%s" % (scope, name), per_site,
+                                    files, total_bytes, disk_files)
+        self.coverage_cache.set(key, summary)
+        yield {"summary": summary}
+
+    def _list_replicas(self, token, dids, schemes, parse, is_cancelled=None):
+        """POST replicas/list and feed the streamed x-json-stream lines to
+        `parse` as they arrive; the body is never buffered whole."""
+        body = {
+            "dids": [{"scope": scope, "name": name} for scope, name in dids],
             "schemes": schemes,
             "domain": self.domain,
             "ignore_availability": True,
             "all_states": False,
         }
-        r = self._http.post(self.rucio_host + "/replicas/list",
-                            headers={"X-Rucio-Auth-Token": token,
-                                     "Content-Type": "application/json"},
-                            json=body)
-        if r.status_code in (401, 403):
-            raise NeedReLogin("Rucio rejected the access token")
-        r.raise_for_status()
-        return parse_replica_sites(r.text.splitlines())
+        with metrics.upstream("rucio", "replicas_list") as call, \
+                self._http.stream("POST", self.rucio_host + "/replicas/list",
+                                  headers={"X-Rucio-Auth-Token": token,
+                                           "Content-Type": "application/json"},
+                                  json=body) as r:
+            if r.status_code in (401, 403):
+                raise _TokenRejected("Rucio rejected the access token")
+            r.raise_for_status()
+            lines = _counted(r.iter_lines(), call)
+            if is_cancelled is not None:
+                lines = _until_cancelled(lines, is_cancelled)
+            # Leaving the with-block (normally or via QueryCancelled) closes
+            # the response, dropping the connection if Rucio is still sending.
+            try:
+                return parse(lines)
+            finally:
+                call.nbytes = r.num_bytes_downloaded
@@ -7,18 +7,38 @@ Place in src/backend/ and include it from src/backend/main.py:
 
 Endpoints (under the same base as the other backend routes):
   POST /rucio/login/start  -> {login_id, auth_url}
-  GET  /rucio/login/poll   -> {status: pending|complete}
+  GET  /rucio/login/wait   -> {status: pending|complete}, held open (up to
+                              ?timeout= seconds) until the login completes
+  GET  /rucio/login/poll   -> {status: pending|complete}  (one-shot variant)
   GET  /rucio/replicas     -> {replicas:[{rse, pfn}, ...]}  (401 reauth_required)
+  POST /rucio/replicas/batch {dids:[scope:name,...]} | {dataset: scope:name}
+                           -> {replicas: {did: [sites...]}}    (401 reauth_required)
+  GET  /rucio/coverage     ?dataset=scope:name -> NDJSON progress events, then
+                           {summary: {files, bytes, sites:[{rse, type, files, bytes}]}}
+  GET  /rucio/cache/stats  -> replica/coverage cache counters (admins only)
+
+Replica sites are ranked best-first for the caller's `location` (the same
+"City, State" string sent to /recordDatasetAccess; the last one seen for the
+user if omitted), see rse_ranking.py.
 """
 
+import json
+import threading
+import time
 import uuid
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+import anyio
+import httpx
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 
-from src.backend import auth
+from src.backend import auth, bulkheads, rse_ranking
+from src.backend.cancellable import QueryCancelled, run_cancellable
 from src.backend.htvault import HTVaultClient, HTVaultError
 from src.backend.rucio_reader import RucioReader, NeedReLogin, DEFAULT_SCHEMES
 from src.backend.token_store import InMemoryVaultTokenStore
+from src.lib import timing
 
 router = APIRouter(prefix="/rucio", tags=["rucio"])
 
@@ -27,44 +47,223 @@ tokens = InMemoryVaultTokenStore()
 reader = RucioReader(vault, token_store=tokens.get,
                      rucio_host="https://dune-rucio.fnal.gov", domain="wan")
 
-_PENDING = {}  # login_id -> {"user", "session"}
+# login_id -> {"user", "session", "created", "next_poll", "lock", "done"}.
+# Logins that are never finished (popup closed, tab gone) are dropped after
+# LOGIN_TTL_S; vault's own device code has expired by then anyway.
+_PENDING = {}
+_PENDING_LOCK = threading.Lock()
+LOGIN_TTL_S = 600
+LOGIN_WAIT_MAX_S = 25   # stay under typical proxy idle timeouts
+
+
+def _drop_expired(now):
+    """Drop logins older than LOGIN_TTL_S; call with _PENDING_LOCK held."""
+    for stale in [k for k, e in _PENDING.items() if now - e["created"] > LOGIN_TTL_S]:
+        del _PENDING[stale]
+
+
+def _pending_entry(login_id, user):
+    with _PENDING_LOCK:
+        _drop_expired(time.monotonic())
+        entry = _PENDING.get(login_id)
+    if not entry or entry["user"] != user.sub:
+        raise HTTPException(404, "unknown login_id")
+    return entry
+
+
+def _poll_vault(login_id, entry):
+    """Poll vault for `entry` unless its poll_interval hasn't elapsed since
+    the last poll (slow_down doubles it). True once the login is complete."""
+    with entry["lock"]:
+        if entry["done"]:
+            return True
+        if time.monotonic() < entry["next_poll"]:
+            return False
+        try:
+            result = vault.poll_once(entry["session"])
+        except HTVaultError:
+            with _PENDING_LOCK:
+                _PENDING.pop(login_id, None)
+            raise
+        finally:
+            entry["next_poll"] = time.monotonic() + entry["session"].get("poll_interval", 5)
+        if result is None:
+            return False
+        tokens.put(entry["user"], result["vault_token"], result["credkey"])
+        entry["done"] = True
+        with _PENDING_LOCK:
+            _PENDING.pop(login_id, None)
+        return True
 
 
 @router.post("/login/start")
-def login_start(user: auth.UserInfo = Depends(auth.get_current_user)):
-    started = vault.begin_auth()
+async def login_start(user: auth.UserInfo = Depends(auth.get_current_user)):
+    started = await bulkheads.RUCIO.run(vault.begin_auth)
     login_id = uuid.uuid4().hex
-    _PENDING[login_id] = {"user": user.sub, "session": started["session"]}
+    now = time.monotonic()
+    with _PENDING_LOCK:
+        # Abandoned logins are otherwise only dropped when someone polls.
+        _drop_expired(now)
+        _PENDING[login_id] = {
+            "user": user.sub, "session": started["session"], "created": now,
+            # The user can't have finished in the popup yet.
+            "next_poll": now + started["session"]["poll_interval"],
+            "lock": threading.Lock(), "done": False,
+        }
     return {"login_id": login_id, "auth_url": started["auth_url"]}
 
 
 @router.get("/login/poll")
-def login_poll(login_id: str,
-               user: auth.UserInfo = Depends(auth.get_current_user)):
-    entry = _PENDING.get(login_id)
-    if not entry or entry["user"] != user.sub:
-        raise HTTPException(404, "unknown login_id")
+async def login_poll(login_id: str,
+                     user: auth.UserInfo = Depends(auth.get_current_user)):
+    entry = _pending_entry(login_id, user)
     try:
-        result = vault.poll_once(entry["session"])
+        done = await bulkheads.RUCIO.run(_poll_vault, login_id, entry)
     except HTVaultError as e:
-        _PENDING.pop(login_id, None)
         raise HTTPException(400, str(e))
-    if result is None:
-        return {"status": "pending"}
-    tokens.put(user.sub, result["vault_token"], result["credkey"])
-    _PENDING.pop(login_id, None)
-    return {"status": "complete"}
+    return {"status": "complete" if done else "pending"}
+
+
+@router.get("/login/wait")
+async def login_wait(request: Request,
+                     login_id: str,
+                     timeout: float = Query(LOGIN_WAIT_MAX_S, gt=0, le=LOGIN_WAIT_MAX_S),
+                     user: auth.UserInfo = Depends(auth.get_current_user)):
+    """Long-poll: polls vault server-side at its poll_interval and answers as
+    soon as the login completes, or "pending" after `timeout` seconds (the
+    client then simply calls again)."""
+    entry = _pending_entry(login_id, user)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if await bulkheads.RUCIO.run(_poll_vault, login_id, entry):
+                return {"status": "complete"}
+        except HTVaultError as e:
+            raise HTTPException(400, str(e))
+        now = time.monotonic()
+        if now >= deadline or await request.is_disconnected():
+            return {"status": "pending"}
+        with _PENDING_LOCK:
+            expired = _PENDING.get(login_id) is not entry
+        if expired and not entry["done"]:
+            raise HTTPException(404, "unknown login_id")
+        await anyio.sleep(max(0.1, min(entry["next_poll"], deadline) - now))
+
+
+MAX_BATCH_DIDS = 5000
+# Replica lookups are abandoned (and the Rucio stream closed) after this
+# long, or as soon as the client disconnects.
+REPLICAS_TIMEOUT_S = 120
+
+
+def _user_location(user, location):
+    """`location` if given (and remembered for later calls), else the last
+    location this user reported."""
+    if location:
+        rse_ranking.remember_location(user.sub, location)
+        return location
+    return rse_ranking.location_of(user.sub)
+
+
+def _reauth_required():
+    return HTTPException(
+        status_code=401,
+        detail={"error": "reauth_required",
+                "message": "Your FNAL session has expired — please reconnect "
+                           "to FNAL to refresh access."})
+
 
 @router.get("/replicas")
-def replicas(scope: str = Query(...),
-             name: str = Query(...),
-             user: auth.UserInfo = Depends(auth.get_current_user)):
+@timing.timed_handler
+async def replicas(http_request: Request,
+                   scope: str = Query(...),
+                   name: str = Query(...),
+                   location: str | None = Query(None),
+                   user: auth.UserInfo = Depends(auth.get_current_user)):
+    location = _user_location(user, location)
     try:
-        sites = reader.get_replicas(user.sub, scope, name, schemes=DEFAULT_SCHEMES)
+        sites = await run_cancellable(
+            http_request,
+            lambda is_cancelled: reader.get_replicas(
+                user.sub, scope, name, schemes=DEFAULT_SCHEMES, is_cancelled=is_cancelled),
+            timeout_s=REPLICAS_TIMEOUT_S,
+            bulkhead=bulkheads.RUCIO,
+        )
     except NeedReLogin:
-        raise HTTPException(
-            status_code=401,
-            detail={"error": "reauth_required",
-                    "message": "Your FNAL session has expired — please reconnect "
-                               "to FNAL to refresh access."})
+        raise _reauth_required()
+    with timing.phase("format"):
+        sites = rse_ranking.rank_sites(sites, location)
     return {"scope": scope, "name": name, "sites": sites}
+
+
+class ReplicasBatchRequest(BaseModel):
+    dids: list[str] = []          # file DIDs, "scope:name"
+    dataset: str | None = None    # or every file of one dataset/container
+    location: str | None = None   # caller's "City, State", for site ranking
+
+
+@router.post("/replicas/batch")
+async def replicas_batch(request: ReplicasBatchRequest,
+                         http_request: Request,
+                         user: auth.UserInfo = Depends(auth.get_current_user)):
+    if bool(request.dids) == bool(request.dataset):
+        raise HTTPException(400, "give either dids or dataset")
+    if len(request.dids) > MAX_BATCH_DIDS:
+        raise HTTPException(413, "Max %d DIDs per request" % MAX_BATCH_DIDS)
+    location = _user_location(user, request.location)
+    try:
+        if request.dataset:
+            scope, _, name = request.dataset.partition(":")
+            if not scope or not name:
+                raise ValueError("invalid DID %r (expected scope:name)" % request.dataset)
+            work = lambda is_cancelled: reader.get_dataset_replicas(
+                user.sub, scope, name, schemes=DEFAULT_SCHEMES, is_cancelled=is_cancelled)
+        else:
+            work = lambda is_cancelled: reader.get_replicas_batch(
+                user.sub, request.dids, schemes=DEFAULT_SCHEMES, is_cancelled=is_cancelled)
+        found = await run_cancellable(http_request, work, timeout_s=REPLICAS_TIMEOUT_S,
+                                      bulkhead=bulkheads.RUCIO)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except NeedReLogin:
+        raise _reauth_required()
+    ranked = {did: rse_ranking.rank_sites(sites, location) for did, sites in found.items()}
+    return {"dataset": request.dataset, "replicas": ranked}
+
+
+@router.get("/coverage")
+async def coverage(dataset: str = Query(...),
+                   user: auth.UserInfo = Depends(auth.get_current_user)):
+    scope, _, name = dataset.partition(":")
+    if not scope or not name:
+        raise HTTPException(400, "dataset must be scope:name")
+    # Set when the client goes away; the listing stops at its next line.
+    cancelled = threading.Event()
+    try:
+        events = await bulkheads.RUCIO.run(
+            reader.dataset_coverage, user.sub, scope, name, cancelled.is_set)
+    except NeedReLogin:
+        raise _reauth_required()
+
+    def lines():
+        try:
+            for event in events:
+                yield json.dumps(event) + "\n"
+        except QueryCancelled:
+            return
+        except NeedReLogin:
+            yield json.dumps({"error": "reauth_required"}) + "\n"
+        except httpx.HTTPError as e:
+            yield json.dumps({"error": "Rucio request failed: %s" % e}) + "\n"
+
+    async def stream():
+        async for line in bulkheads.RUCIO.iterate(lines(), cancel=cancelled.set):
+            yield line
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.get("/cache/stats")
+def cache_stats(user: auth.UserInfo = Depends(auth.require_admin)):
+    return {"replicas": reader.cache.stats(),
+            "coverage": reader.coverage_cache.stats()}
@@ -29,7 +29,8 @@ export function isAbortError(error: unknown): boolean {
 
 /**
  * True if an error is a timeout: either the client-side request timeout fired
- * (axios ECONNABORTED / ETIMEDOUT) or the backend gave up and returned 504.
+ * (axios ECONNABORTED / ETIMEDOUT), the backend gave up and returned 504, or
+ * it was too busy to take the request and shed it with 503.
  * Distinct from isAbortError, which is a deliberate cancellation.
  */
 export function isTimeoutError(error: unknown): boolean {
@@ -37,7 +38,8 @@ export function isTimeoutError(error: unknown): boolean {
   return (
     error.code === 'ECONNABORTED' ||
     error.code === 'ETIMEDOUT' ||
-    error.response?.status === 504
+    error.response?.status === 504 ||
+    error.response?.status === 503
   );
 }
 
@@ -46,6 +48,8 @@ interface ApiResponse<T> {
   message?: string;
   results?: T[] | T;  // Allow either an array or a single item
   mqlQuery?: string;
+  // Set when the search hit its time/row budget and results are partial.
+  truncated?: boolean;
 }
 
 // Helper function to ensure results are always an array
@@ -132,9 +136,9 @@ function sanitizeMQLQuery(query: string): string {
  * @param {boolean} officialOnly Whether to search for official datasets only.
  * @param {string} customMql Optional custom MQL query to use directly.
  *
- * @returns {Promise<{ results: Dataset[], mqlQuery: string }>} A promise that resolves with an array of datasets and the MQL query.
+ * @returns {Promise<{ results: Dataset[], mqlQuery: string, truncated: boolean }>} A promise that resolves with an array of datasets, the MQL query, and whether the results are partial (the search ran out of time).
  */
-export async function searchDataSets(query: string, category: string, tab: string, officialOnly: boolean, customMql?: string, signal?: AbortSignal): Promise<{ results: Dataset[], mqlQuery: string }> {
+export async function searchDataSets(query: string, category: string, tab: string, officialOnly: boolean, customMql?: string, signal?: AbortSignal): Promise<{ results: Dataset[], mqlQuery: string, truncated: boolean }> {
   try {
     const sanitizedQuery = sanitizeMQLQuery(query);
     // Don't sanitize custom MQL queries to preserve quotes and syntax
@@ -155,7 +159,8 @@ export async function searchDataSets(query: string, category: string, tab: strin
 
     return {
       results: normalizeResults(response.data.results),
-      mqlQuery: response.data.mqlQuery || ''
+      mqlQuery: response.data.mqlQuery || '',
+      truncated: !!response.data.truncated
     };
   } catch (error) {
     // Aborted (superseded search / navigation) and timeouts must reach the
@@ -164,7 +169,8 @@ export async function searchDataSets(query: string, category: string, tab: strin
     if (isAbortError(error) || isTimeoutError(error)) throw error;
     return {
       results: [],
-      mqlQuery: ''
+      mqlQuery: '',
+      truncated: false
     };
   }
 }
@@ -0,0 +1,244 @@
+"""
+breaker.py — circuit breakers and adaptive timeouts for upstream services.
+
+When MetaCat or ConDB is degraded, every request would otherwise wait out
+the full fixed timeout (150 s / 300 s for MetaCat, 20 s for ConDB) before
+failing, pinning a worker thread each. A Breaker per upstream watches the
+outcome of recent calls:
+
+  closed     calls go through; once at least BREAKER_MIN_CALLS calls in the
+             last BREAKER_WINDOW seconds have a failure ratio of at least
+             BREAKER_FAILURE_RATIO, the breaker opens
+  open       calls fail at once with CircuitOpen (callers answer from stale
+             cache where they have one, else 503 + Retry-After) for
+             BREAKER_OPEN_SECONDS
+  half-open  then one probe call is let through; success closes the
+             breaker, failure opens it again
+
+Only upstream failures count (timeouts, connection errors, 5xx); a bad
+query, a cancelled request or a consumer that stopped reading does not.
+
+timeout() is the per-call timeout to use: a multiple of the recent p99
+latency of successful calls (time to first byte), kept between the
+breaker's floor and its configured ceiling. Calls that time out feed the
+timeout back in as a sample, so a genuine slowdown raises it again instead
+of tripping the breaker on every call.
+
+Where a timeout is an expected answer rather than a symptom (MetaCat size
+aggregates: "too large to summarise"), the breaker is made with
+adaptive=False and timeouts_are_failures=False: the timeout stays at the
+ceiling and only connection errors and 5xx count.
+
+    with CONDB.guard() as call:
+        resp = client.get(url, timeout=CONDB.timeout())
+        call.first_byte()
+
+Pass the timeout with each call (or set it on a client used only by that
+breaker); a client shared between breakers would take whichever timeout
+was set last.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import httpx
+
+from src.lib import metrics
+
+logger = logging.getLogger(__name__)
+
+BREAKER_ENABLED = os.environ.get("BREAKER_ENABLED", "1") != "0"
+BREAKER_FAILURE_RATIO = float(os.environ.get("BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", "10"))
+BREAKER_WINDOW_S = float(os.environ.get("BREAKER_WINDOW", "60"))
+BREAKER_OPEN_S = float(os.environ.get("BREAKER_OPEN_SECONDS", "30"))
+ADAPTIVE_TIMEOUTS = os.environ.get("ADAPTIVE_TIMEOUTS", "1") != "0"
+
+# Adaptive timeout = multiplier x p99, once this many samples are in.
+_TIMEOUT_MULTIPLIER = 4.0
+_MIN_SAMPLES = 20
+_SAMPLES = 200
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+TRANSITIONS = metrics.counter(
+    "dunecat_breaker_transitions_total",
+    "Circuit breaker state changes.", ("upstream", "state"))
+REJECTED = metrics.counter(
+    "dunecat_breaker_rejected_total",
+    "Calls failed fast because the circuit was open.", ("upstream",))
+
+
+class CircuitOpen(Exception):
+    """The upstream's breaker is open; retry after `retry_after` seconds."""
+
+    def __init__(self, upstream: str, retry_after: int):
+        super().__init__(f"{upstream} is temporarily unavailable; retry in {retry_after}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def _is_timeout(exc: BaseException) -> bool:
+    return isinstance(exc, (TimeoutError, httpx.TimeoutException)) or \
+        "Timeout" in type(exc).__name__
+
+
+def is_failure(exc: BaseException) -> bool:
+    """True for errors that say the upstream is unhealthy, as opposed to
+    errors in the request itself."""
+    if _is_timeout(exc) or isinstance(exc, (ConnectionError, httpx.TransportError)):
+        return True
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None) or getattr(response, "status_code", None)
+    if isinstance(status, int):
+        return status >= 500
+    # Clients built on requests (MetaCat's) raise their own classes.
+    name = type(exc).__name__
+    return "Connection" in name or "ServerError" in name
+
+
+class _Guard:
+    __slots__ = ("breaker", "_start", "_latency")
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self._latency = None
+
+    def first_byte(self) -> None:
+        """Mark the upstream as having answered; the latency sample is the
+        time up to here rather than until the body was consumed."""
+        if self._latency is None:
+            self._latency = time.perf_counter() - self._start
+
+    def exclude(self, seconds: float) -> None:
+        """Leave time the upstream wasn't being waited on (a streaming
+        caller's consumer, between rows) out of a timeout sample."""
+        self._start += seconds
+
+    def __enter__(self):
+        self.breaker.before()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        if exc_type is None:
+            self.breaker.record(False, self._latency if self._latency is not None else elapsed)
+        elif _is_timeout(exc) and not self.breaker.timeouts_are_failures:
+            self.breaker.record(None, None)
+        elif is_failure(exc):
+            # A timeout is a (censored) latency sample too; see module doc.
+            self.breaker.record(True, elapsed if _is_timeout(exc) else None)
+        else:
+            self.breaker.record(None, self._latency)
+        return False
+
+
+class Breaker:
+    def __init__(self, name: str, *, timeout_ceiling: float, timeout_floor: float = 0.0,
+                 adaptive: bool = True, timeouts_are_failures: bool = True):
+        self.name = name
+        self.timeout_ceiling = timeout_ceiling
+        self.timeout_floor = min(timeout_floor, timeout_ceiling)
+        self.adaptive = adaptive
+        self.timeouts_are_failures = timeouts_are_failures
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._outcomes: deque = deque()          # (time, failed)
+        self._latencies: deque = deque(maxlen=_SAMPLES)
+        self._timeout = timeout_ceiling
+        self._lock = threading.Lock()
+        _breakers[name] = self
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+            self.state = state
+            TRANSITIONS.inc(1, self.name, state)
+
+    def before(self) -> None:
+        """Raise CircuitOpen unless a call may go ahead now."""
+        if not BREAKER_ENABLED:
+            return
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self._opened_at + BREAKER_OPEN_S - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            retry_after = max(1, math.ceil(remaining))
+        REJECTED.inc(1, self.name)
+        raise CircuitOpen(self.name, retry_after)
+
+    def record(self, failed: bool | None, latency: float | None) -> None:
+        """failed: True/False, or None for a call that says nothing about
+        the upstream's health (cancelled, bad request)."""
+        now = time.monotonic()
+        with self._lock:
+            if latency is not None:
+                self._latencies.append(latency)
+                if len(self._latencies) >= _MIN_SAMPLES and len(self._latencies) % 10 == 0:
+                    self._timeout = self._adapted_timeout()
+            if self.state == HALF_OPEN and self._probing:
+                self._probing = False
+                if failed is True:
+                    self._opened_at = now
+                    self._set_state(OPEN)
+                elif failed is False:
+                    self._outcomes.clear()
+                    self._set_state(CLOSED)
+                return
+            if failed is None:
+                return
+            self._outcomes.append((now, failed))
+            while self._outcomes and self._outcomes[0][0] < now - BREAKER_WINDOW_S:
+                self._outcomes.popleft()
+            if self.state == CLOSED and failed and len(self._outcomes) >= BREAKER_MIN_CALLS:
+                failures = sum(1 for _, f in self._outcomes if f)
+                if failures / len(self._outcomes) >= BREAKER_FAILURE_RATIO:
+                    self._opened_at = now
+                    self._set_state(OPEN)
+
+    def _adapted_timeout(self) -> float:
+        samples = sorted(self._latencies)
+        p99 = samples[max(0, math.ceil(0.99 * len(samples)) - 1)]
+        return min(self.timeout_ceiling, max(self.timeout_floor, _TIMEOUT_MULTIPLIER * p99))
+
+    def timeout(self) -> float:
+        """Timeout to use for the next call, in seconds."""
+        return self._timeout if ADAPTIVE_TIMEOUTS and self.adaptive else self.timeout_ceiling
+
+    def guard(self) -> _Guard:
+        return _Guard(self)
+
+    def stats(self) -> dict:
+        with self._lock:
+            failures = sum(1 for _, f in self._outcomes if f)
+            return {"state": self.state, "calls": len(self._outcomes), "failures": failures,
+                    "timeout_s": round(self.timeout(), 2),
+                    "timeout_ceiling_s": self.timeout_ceiling}
+
+
+_breakers: dict[str, Breaker] = {}
+
+
+def all_stats() -> dict:
+    return {name: b.stats() for name, b in list(_breakers.items())}
+
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+metrics.gauge("dunecat_breaker_state", "Circuit state per upstream (0 closed, 1 half-open, 2 open).",
+              lambda: {(n,): _STATE_VALUES[s["state"]] for n, s in all_stats().items()},
+              ("upstream",))
+metrics.gauge("dunecat_upstream_timeout_seconds", "Current (adaptive) per-call upstream timeout.",
+              lambda: {(n,): s["timeout_s"] for n, s in all_stats().items()},
+              ("upstream",))
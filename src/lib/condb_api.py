@@ -1,17 +1,63 @@
 """
 condb_api.py — thin wrapper around the DUNE Conditions DB REST 'get' endpoint.
+
+Single-run lookups are cached in-process (optionally persisted to disk): a
+finished run's conditions record almost never changes, so paging back and
+forth between runs in the UI should not go back to ConDB each time.
 """
 
 import ast
+import atexit
+import functools
+import json
 import logging
 import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import httpx
 
+from src.lib import breaker, http_pool, metrics
+
 logger = logging.getLogger(__name__)
 
 CONDB_BASE_URL = os.environ.get("CONDB_BASE_URL")  # required -- see .env.example
 
+# Run-conditions cache. Entries are served straight from memory; once an
+# entry is older than its freshness window it is still served, but a
+# background re-fetch checks whether ConDB holds a newer version of the row
+# (by its "tr"/"upload_time" versioning) and swaps it in if so. Runs without
+# a stop_time are still in progress, so they get a much shorter window.
+# "No conditions found" is cached too, briefly, so repeated typos or
+# not-yet-uploaded runs don't hammer ConDB. CONDB_CACHE_PATH, if set, is a
+# JSON file the cache is loaded from at startup and saved to periodically.
+CONDB_CACHE_MAX_ENTRIES = int(os.environ.get("CONDB_CACHE_MAX_ENTRIES", "2048"))
+CONDB_CACHE_FRESH_S = float(os.environ.get("CONDB_CACHE_FRESH", "3600"))
+CONDB_CACHE_OPEN_RUN_FRESH_S = 60.0
+CONDB_CACHE_NEGATIVE_TTL_S = float(os.environ.get("CONDB_CACHE_NEGATIVE_TTL", "60"))
+CONDB_CACHE_PATH = os.environ.get("CONDB_CACHE_PATH") or None
+_CACHE_SAVE_INTERVAL_S = 30.0
+# A revalidation that fails (ConDB down, or the row gone) keeps serving the
+# cached entry and isn't retried for this long. Revalidations run on a small
+# shared pool, never more than _REVALIDATE_WORKERS at once.
+_REVALIDATE_BACKOFF_S = 60.0
+_REVALIDATE_WORKERS = 4
+
+# Send the row limit to ConDB's /search as a "limit" parameter. Off by
+# default: older ConDB servers reject unknown parameters. Results are
+# streamed and cut off client-side at the limit either way.
+CONDB_SEARCH_PUSHDOWN = os.environ.get("CONDB_SEARCH_PUSHDOWN", "").lower() in ("1", "true", "yes")
+
+# Batch lookups (get_runs_batch): how many ConDB requests may be in flight at
+# once, and how long a run of consecutive run numbers must be before it is
+# fetched with one /search on tv instead of one /get per run.
+CONDB_BATCH_CONCURRENCY = int(os.environ.get("CONDB_BATCH_CONCURRENCY", "8"))
+_MIN_COALESCED_RANGE = 3
+
 # Known folder -> {label, namespace} pairs. "namespace" is used only to
 # prefill the suggested combined query -- confirm it before trusting it,
 # and add more folders here as other detectors' folders are identified.
@@ -28,14 +74,300 @@ KNOWN_FOLDERS = {
 DEFAULT_FOLDER = "pdunesp.run_conditionstest"
 
 
+def _row_version(row: dict) -> tuple:
+    """ConDB's versioning for a row: (tr, upload_time), None-safe for sorting."""
+    return (row.get("tr") or 0, row.get("upload_time") or 0)
+
+
+def _consecutive_spans(sorted_runs: list[int]):
+    """Yield inclusive (start, end) spans of consecutive integers."""
+    start = prev = None
+    for run in sorted_runs:
+        if start is None:
+            start = prev = run
+        elif run == prev + 1:
+            prev = run
+        else:
+            yield start, prev
+            start = prev = run
+    if start is not None:
+        yield start, prev
+
+
+class _FrozenDict(dict):
+    """A dict that refuses to be modified. Still a dict to json and FastAPI;
+    copy()/copy.deepcopy() give a plain, writable dict."""
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("config_files values are shared between rows; copy before modifying")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def copy(self) -> dict:
+        return dict(self)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+def _freeze(value):
+    """Read-only form of a parsed literal: dicts -> _FrozenDict, lists ->
+    tuples (both still serialise as JSON objects/arrays)."""
+    if isinstance(value, dict):
+        return _FrozenDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+@functools.lru_cache(maxsize=512)
+def _parse_literal(value: str):
+    """ast.literal_eval, memoized: most rows of a search repeat the same
+    config_files string. Returns `value` itself if it doesn't parse.
+
+    The returned object is shared between every row with that string (and
+    between cached rows), so it is returned frozen (see _freeze).
+    """
+    try:
+        return _freeze(ast.literal_eval(value))
+    except (ValueError, SyntaxError):
+        return value
+
+
+# Characters a value can start with and still parse under int()/float().
+_NUMERIC_START = frozenset("0123456789+-. \t")
+
+# A column is treated as text (numeric coercion skipped unless a value looks
+# numeric) once this many rows have produced no number for it.
+_INFER_ROWS = 16
+
+# Distinct values remembered per column, for decoding/interning repeats.
+_MEMO_PER_COLUMN = 1024
+
+
+class _RowDecoder:
+    """
+    Column-aware equivalent of ConditionsDBAPI._clean_row for decoding many
+    rows with the same header (a /search response).
+
+    Each column's handling is decided once -- from FIELD_METADATA where it
+    says enough (Unix timestamps and the run number are numeric and nearly
+    unique), else from the first _INFER_ROWS rows -- instead of trying
+    int()/float() on every value. Repeated values (run_type, data_stream,
+    detector_id, config_files, ...) are decoded once per column and the
+    resulting strings interned. For ConDB's plain-ASCII CSV the output is
+    the same as _clean_row's.
+    """
+
+    def __init__(self, folder: str, columns: list[str]):
+        meta = FIELD_METADATA.get(folder, {})
+        self.columns = columns
+        self._unique = [
+            c == "tv" or (meta.get(c) or {}).get("unit") == "Unix" for c in columns
+        ]
+        self._memo: list[dict] = [{} for _ in columns]
+        self._numeric_seen = [False] * len(columns)
+        self._text = [False] * len(columns)
+        self._rows = 0
+
+    def decode(self, values: list[str]) -> dict:
+        row = {}
+        inferring = self._rows < _INFER_ROWS
+        for i, (key, value) in enumerate(zip(self.columns, values)):
+            if not self._unique[i]:
+                memo = self._memo[i]
+                hit = memo.get(value, memo)
+                if hit is not memo:
+                    row[key] = hit
+                    continue
+            decoded = self._decode_value(i, key, value)
+            if inferring and isinstance(decoded, (int, float)):
+                self._numeric_seen[i] = True
+            if not self._unique[i]:
+                memo = self._memo[i]
+                if len(memo) < _MEMO_PER_COLUMN:
+                    if type(decoded) is str:
+                        decoded = sys.intern(decoded)
+                    memo[value] = decoded
+            row[key] = decoded
+        self._rows += 1
+        if self._rows == _INFER_ROWS:
+            self._text = [not seen for seen in self._numeric_seen]
+        return row
+
+    def _decode_value(self, i: int, key: str, value: str):
+        if value is None or value in ("", "None"):
+            return None
+        if key == "config_files":
+            return _parse_literal(value)
+        if self._text[i] and value[0] not in _NUMERIC_START:
+            return value
+        try:
+            return float(value) if "." in value else int(value)
+        except ValueError:
+            return value
+
+
+class _RunConditionsCache:
+    """
+    Bounded LRU of cleaned run-conditions rows keyed by (folder, run).
+
+    Each entry is {"row": <cleaned row or None>, "checked": <unix time>}; a
+    None row records a "not found" answer. After a failed revalidation the
+    entry also has "retry_after" (unix time), before which it isn't
+    revalidated again. Thread-safe: lookups come from FastAPI worker threads
+    and revalidation runs on a worker pool.
+    """
+
+    def __init__(self, max_entries: int, path: str | None = None):
+        self.max_entries = max_entries
+        self.path = path
+        self._d: OrderedDict[tuple[str, int], dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.time()
+        if path:
+            self._load()
+            atexit.register(self.save)
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+    def get(self, folder: str, run: int) -> dict | None:
+        """Return the entry for (folder, run), or None if absent/expired."""
+        key = (folder, run)
+        with self._lock:
+            entry = self._d.get(key)
+            if entry is None:
+                return None
+            if entry["row"] is None and \
+                    time.time() - entry["checked"] >= CONDB_CACHE_NEGATIVE_TTL_S:
+                del self._d[key]
+                return None
+            self._d.move_to_end(key)
+            return entry
+
+    def put(self, folder: str, run: int, row: dict | None) -> None:
+        with self._lock:
+            self._d[(folder, run)] = {"row": row, "checked": time.time()}
+            self._d.move_to_end((folder, run))
+            while len(self._d) > self.max_entries:
+                self._d.popitem(last=False)
+            if row is not None:
+                self._dirty = True
+        self._maybe_save()
+
+    def touch(self, folder: str, run: int) -> None:
+        """Mark an entry as revalidated (unchanged upstream)."""
+        with self._lock:
+            entry = self._d.get((folder, run))
+            if entry is not None:
+                entry["checked"] = time.time()
+                entry.pop("retry_after", None)
+
+    def back_off(self, folder: str, run: int, seconds: float) -> None:
+        """Hold off revalidating an entry for `seconds` (it stays stale)."""
+        with self._lock:
+            entry = self._d.get((folder, run))
+            if entry is not None:
+                entry["retry_after"] = time.time() + seconds
+
+    def clear(self) -> None:
+        with self._lock:
+            self._d.clear()
+            self._dirty = True
+
+    @staticmethod
+    def is_fresh(entry: dict) -> bool:
+        row = entry["row"]
+        window = CONDB_CACHE_FRESH_S
+        if row is not None and row.get("stop_time") is None:
+            window = CONDB_CACHE_OPEN_RUN_FRESH_S
+        return time.time() - entry["checked"] < window
+
+    @classmethod
+    def needs_revalidation(cls, entry: dict) -> bool:
+        """Stale, and not backing off after a failed revalidation."""
+        return not cls.is_fresh(entry) and time.time() >= entry.get("retry_after", 0)
+
+    # -- optional on-disk persistence -------------------------------------- #
+
+    def _load(self) -> None:
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable ConDB cache file {self.path}: {e}")
+            return
+        # Only positive entries are persisted; keep their original "checked"
+        # time so anything stale is revalidated on first use.
+        for item in data.get("entries", [])[-self.max_entries:]:
+            try:
+                key = (item["folder"], int(item["run"]))
+                self._d[key] = {"row": item["row"], "checked": float(item["checked"])}
+            except (KeyError, TypeError, ValueError):
+                continue
+        logger.info(f"Loaded {len(self._d)} cached ConDB rows from {self.path}")
+
+    def _maybe_save(self) -> None:
+        if self.path and self._dirty and \
+                time.time() - self._last_save >= _CACHE_SAVE_INTERVAL_S:
+            self.save()
+
+    def save(self) -> None:
+        """Write positive entries to `path` atomically (temp file + rename)."""
+        if not self.path:
+            return
+        with self._lock:
+            entries = [
+                {"folder": folder, "run": run, "row": e["row"], "checked": e["checked"]}
+                for (folder, run), e in self._d.items() if e["row"] is not None
+            ]
+            self._dirty = False
+            self._last_save = time.time()
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile(mode="w", dir=directory, delete=False) as f:
+                json.dump({"entries": entries}, f)
+            os.replace(f.name, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save ConDB cache to {self.path}: {e}")
+
+
 class ConditionsDBAPI:
-    def __init__(self, base_url: str = CONDB_BASE_URL, timeout: float = 20.0):
-        self.base_url = base_url.rstrip("/")
+    def __init__(self, base_url: str = CONDB_BASE_URL, timeout: float = 20.0,
+                 cache_max_entries: int = CONDB_CACHE_MAX_ENTRIES,
+                 cache_path: str | None = CONDB_CACHE_PATH):
+        self.base_url = (base_url or "").rstrip("/")
         self.timeout = timeout
+        # Fails fast while ConDB is down and adapts the per-call timeout to
+        # observed latency, with `timeout` as the ceiling (src/lib/breaker.py).
+        self.breaker = breaker.Breaker("condb", timeout_ceiling=timeout, timeout_floor=2.0)
+        self.cache = _RunConditionsCache(cache_max_entries, cache_path)
+        self._revalidating: set[tuple[str, int]] = set()
+        self._revalidating_lock = threading.Lock()
+        self._revalidator = ThreadPoolExecutor(max_workers=_REVALIDATE_WORKERS,
+                                               thread_name_prefix="condb-revalidate")
+        # Concurrent misses for the same (folder, run) share one request.
+        self._inflight: dict[tuple[str, int], Future] = {}
+        self._inflight_lock = threading.Lock()
+        # Shared keep-alive client, so consecutive lookups reuse the TLS
+        # connection instead of handshaking for every run.
+        self._http = http_pool.get_client(
+            "condb", timeout=timeout,
+            max_connections=CONDB_BATCH_CONCURRENCY * 2,
+            max_keepalive=CONDB_BATCH_CONCURRENCY,
+        )
 
     def get_run_conditions(self, folder: str, run: int) -> dict:
         """
-        Fetch the conditions record for a single run number.
+        Fetch the conditions record for a single run number, from the cache
+        when possible (see _RunConditionsCache). A stale cached row is still
+        returned immediately; it is revalidated against ConDB in the
+        background.
 
         Args:
             folder: ConDB folder name, e.g. "pdunesp.run_conditionstest"
@@ -43,7 +375,187 @@ class ConditionsDBAPI:
 
         Returns:
             {"success": True, "results": {<column>: <value>, ...}}
-            or {"success": False, "message": ...}
+            or {"success": False, "message": ...}. "results" is the caller's
+            own copy of the cached row.
+        """
+        entry = self.cache.get(folder, run)
+        if entry is not None:
+            if entry["row"] is None:
+                return {"success": False, "message": f"No conditions found for run {run}"}
+            if self.cache.needs_revalidation(entry):
+                self._revalidate_in_background(folder, run)
+            return {"success": True, "results": dict(entry["row"])}
+
+        key = (folder, run)
+        with self._inflight_lock:
+            pending = self._inflight.get(key)
+            if pending is None:
+                self._inflight[key] = future = Future()
+        if pending is not None:
+            return self._for_caller(pending.result())
+
+        try:
+            result = self._fetch_run_conditions(folder, run)
+            if result["success"]:
+                self.cache.put(folder, run, result["results"])
+            elif result.get("not_found"):
+                self.cache.put(folder, run, None)
+            future.set_result(result)
+            return self._for_caller(result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    @staticmethod
+    def _for_caller(result: dict) -> dict:
+        """A _fetch_run_conditions result as returned to callers: without
+        the internal "not_found" flag, and with a copy of the row, which is
+        also held in the cache."""
+        out = {k: v for k, v in result.items() if k != "not_found"}
+        if out.get("success"):
+            out["results"] = dict(out["results"])
+        return out
+
+    def get_runs_batch(self, folder: str, runs: list[int] = (),
+                       ranges: list[tuple[int, int]] = ()) -> dict:
+        """
+        Fetch conditions for many runs at once.
+
+        Cached runs are answered from memory. Each requested (start, end)
+        range -- and each stretch of at least _MIN_COALESCED_RANGE
+        consecutive uncached run numbers -- becomes a single /search on tv;
+        the remaining scattered runs are fetched with get_run_conditions,
+        at most CONDB_BATCH_CONCURRENCY at a time. A coalesced run that the
+        range search didn't return falls back to its own /get, since /get
+        can answer with the record in force at that run even when no row has
+        exactly that tv.
+
+        Args:
+            folder: ConDB folder name
+            runs: individual run numbers
+            ranges: inclusive (start, end) run-number ranges; only runs that
+                    actually have a row are reported for these
+
+        Returns:
+            {"results": {run: row, ...}, "errors": {key: message, ...}} where
+            an error key is a run number, or "start-end" for a failed range.
+        """
+        if not self.base_url:
+            message = "Conditions DB is not configured on this server (set CONDB_BASE_URL in .env)"
+            return {"results": {}, "errors": {"*": message}}
+        results: dict[int, dict] = {}
+        errors: dict[str, str] = {}
+
+        wanted = []
+        for run in dict.fromkeys(runs):
+            entry = self.cache.get(folder, run)
+            if entry is None:
+                wanted.append(run)
+            elif entry["row"] is None:
+                errors[str(run)] = f"No conditions found for run {run}"
+            else:
+                if self.cache.needs_revalidation(entry):
+                    self._revalidate_in_background(folder, run)
+                results[run] = dict(entry["row"])
+
+        scattered, coalesced = [], []
+        for lo, hi in _consecutive_spans(sorted(wanted)):
+            if hi - lo + 1 >= _MIN_COALESCED_RANGE:
+                coalesced.append((lo, hi))
+            else:
+                scattered.extend(range(lo, hi + 1))
+        explicit = set(wanted)
+
+        def one_range(span):
+            lo, hi = span
+            try:
+                return span, self._search_range(folder, lo, hi), None
+            except (ValueError, httpx.HTTPError, breaker.CircuitOpen) as e:
+                logger.error(f"ConDB range search failed for {folder} {lo}-{hi}: {e}")
+                return span, None, f"Conditions DB search failed: {e}"
+
+        def single(run):
+            try:
+                return run, self.get_run_conditions(folder, run)
+            except breaker.CircuitOpen as e:
+                return run, {"success": False, "message": str(e)}
+
+        fallback = []
+        with ThreadPoolExecutor(max_workers=CONDB_BATCH_CONCURRENCY) as pool:
+            singles = pool.map(single, scattered)
+            for (lo, hi), rows, error in pool.map(one_range, list(ranges) + coalesced):
+                if rows is None:
+                    span = [r for r in explicit if lo <= r <= hi]
+                    if span:
+                        fallback.extend(span)
+                    else:
+                        errors[f"{lo}-{hi}"] = error
+                    continue
+                for run, row in rows.items():
+                    results[run] = dict(row)
+                fallback.extend(r for r in explicit if lo <= r <= hi and r not in rows)
+            fallback = [r for r in dict.fromkeys(fallback) if r not in results]
+            singles = list(singles) + list(pool.map(single, fallback))
+
+        for run, result in singles:
+            if result["success"]:
+                results[run] = result["results"]
+            else:
+                errors[str(run)] = result.get("message", "Run not found")
+        return {"results": results, "errors": errors}
+
+    def _search_range(self, folder: str, lo: int, hi: int) -> dict[int, dict]:
+        """One /search for lo <= tv <= hi, newest version per run, cached."""
+        rows: dict[int, dict] = {}
+        for row in self.iter_search(folder, [("tv", ">=", lo), ("tv", "<=", hi)]):
+            run = row.get("tv")
+            if not isinstance(run, int):
+                continue
+            if run not in rows or _row_version(row) > _row_version(rows[run]):
+                rows[run] = row
+        for run, row in rows.items():
+            self.cache.put(folder, run, row)
+        return rows
+
+    def _revalidate_in_background(self, folder: str, run: int) -> None:
+        key = (folder, run)
+        with self._revalidating_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+        self._revalidator.submit(self._revalidate, folder, run)
+
+    def _revalidate(self, folder: str, run: int) -> None:
+        """Re-fetch a stale row; replace it only if ConDB has a newer version."""
+        try:
+            entry = self.cache.get(folder, run)
+            try:
+                result = self._fetch_run_conditions(folder, run)
+            except breaker.CircuitOpen as e:
+                result = {"success": False, "message": str(e)}
+            if result["success"]:
+                new_row = result["results"]
+                if entry is None or entry["row"] is None or \
+                        _row_version(new_row) != _row_version(entry["row"]):
+                    self.cache.put(folder, run, new_row)
+                else:
+                    self.cache.touch(folder, run)
+            else:
+                # Upstream error, or the row has gone: keep serving the stale
+                # row, and back off before the next revalidation attempt.
+                self.cache.back_off(folder, run, _REVALIDATE_BACKOFF_S)
+        finally:
+            with self._revalidating_lock:
+                self._revalidating.discard((folder, run))
+
+    def _fetch_run_conditions(self, folder: str, run: int) -> dict:
+        """Uncached single-run lookup against ConDB's /get endpoint.
+
+        A "no such run" answer carries "not_found": True so the caller can
+        tell it apart from a transport/parse failure (which is never cached).
         """
         if not self.base_url:
             return {
@@ -52,23 +564,27 @@ class ConditionsDBAPI:
                            "(set CONDB_BASE_URL in .env)",
             }
         try:
-            resp = httpx.get(
-                f"{self.base_url}/get",
-                params={"folder": folder, "t": run},
-                timeout=self.timeout,
-            )
-            resp.raise_for_status()
+            with self.breaker.guard(), metrics.upstream("condb", "get") as call:
+                resp = self._http.get(
+                    f"{self.base_url}/get",
+                    params={"folder": folder, "t": run},
+                    timeout=self.breaker.timeout(),
+                )
+                resp.raise_for_status()
+                call.add(rows=1, nbytes=len(resp.content))
         except httpx.HTTPError as e:
             logger.error(f"ConDB request failed for {folder} t={run}: {e}")
             return {"success": False, "message": f"Conditions DB request failed: {e}"}
 
         text = resp.text.strip()
         if not text:
-            return {"success": False, "message": f"No conditions found for run {run}"}
+            return {"success": False, "message": f"No conditions found for run {run}",
+                    "not_found": True}
 
         lines = text.splitlines()
         if len(lines) < 2:
-            return {"success": False, "message": f"No conditions found for run {run}"}
+            return {"success": False, "message": f"No conditions found for run {run}",
+                    "not_found": True}
 
         columns = lines[0].split(",")
         data_line = lines[1]
@@ -113,6 +629,11 @@ class ConditionsDBAPI:
         (same URL shape, same condition-encoding), just without going
         through the buggy code path.
 
+        The response body is streamed and parsed row by row (see
+        iter_search), and the connection is closed as soon as one row past
+        `limit` has been seen, so a broad condition costs `limit` rows of
+        work rather than the whole matching set.
+
         Args:
             folder: ConDB folder name
             conditions: list of (raw_column, op, value) tuples;
@@ -123,59 +644,108 @@ class ConditionsDBAPI:
             {"success": True, "results": [{col: val, ...}, ...], "truncated": bool}
             or {"success": False, "message": ...}
         """
-        params: list[tuple[str, str]] = [("folder", folder)]
         if not self.base_url:
             return {
                 "success": False,
                 "message": "Conditions DB is not configured on this server "
                            "(set CONDB_BASE_URL in .env)",
             }
+        results = []
+        truncated = False
+        try:
+            # Ask for one row more than we return, so "truncated" still
+            # means "there was at least one more match".
+            for row in self.iter_search(folder, conditions, limit=limit + 1):
+                if len(results) >= limit:
+                    truncated = True
+                    break
+                results.append(row)
+        except ValueError as e:
+            return {"success": False, "message": str(e)}
+        except httpx.HTTPError as e:
+            logger.error(f"ConDB search failed for {folder}: {e}")
+            return {"success": False, "message": f"Conditions DB search failed: {e}"}
+
+        return {"success": True, "results": results, "truncated": truncated}
+
+    def iter_search(self, folder: str, conditions: list[tuple[str, str, object]],
+                    limit: int | None = None):
+        """
+        Generator over cleaned rows of a ConDB /search, streamed from the
+        response body. Rows are parsed lazily as the caller iterates; closing
+        the generator (or breaking out of the loop) closes the connection,
+        so ConDB stops sending the remainder.
+
+        `limit`, if given, is a hint: it is sent to ConDB when
+        CONDB_SEARCH_PUSHDOWN is enabled and the generator never yields more
+        than `limit` rows either way.
+
+        Raises:
+            ValueError: a condition can't be safely encoded.
+            httpx.HTTPError: the request or the stream failed.
+        """
+        params = self._search_params(folder, conditions)
+        if limit is not None and CONDB_SEARCH_PUSHDOWN:
+            params.append(("limit", str(limit)))
+
+        with self.breaker.guard() as guard, metrics.upstream("condb", "search") as call, \
+                self._http.stream("GET", f"{self.base_url}/search", params=params,
+                                  timeout=self.breaker.timeout()) as resp:
+            resp.raise_for_status()
+            guard.first_byte()
+            columns = None
+            decoder = None
+            yielded = 0
+            for line in resp.iter_lines():
+                if not line.strip():
+                    continue
+                if columns is None:
+                    columns = line.strip().split(",")
+                    decoder = _RowDecoder(folder, columns)
+                    continue
+                if limit is not None and yielded >= limit:
+                    return
+                # Same fix as get_run_conditions(): config_files (last column)
+                # is a Python dict literal with unquoted commas, so split only
+                # on the first len(columns)-1 commas.
+                values = line.split(",", len(columns) - 1)
+                if len(values) != len(columns):
+                    logger.warning(
+                        f"Skipping malformed search row for {folder}: "
+                        f"{len(values)} fields, expected {len(columns)}"
+                    )
+                    continue
+                yielded += 1
+                call.rows += 1
+                call.nbytes = resp.num_bytes_downloaded
+                # Only time spent reading from ConDB counts towards the
+                # breaker and the upstream metrics, not the consumer's (e.g.
+                # the mirror's SQLite writes, or sending the rows on).
+                paused = time.perf_counter()
+                yield decoder.decode(values)
+                paused = time.perf_counter() - paused
+                guard.exclude(paused)
+                call.exclude(paused)
+
+    @staticmethod
+    def _search_params(folder: str, conditions: list[tuple[str, str, object]]
+                       ) -> list[tuple[str, str]]:
+        """Encode (column, op, value) conditions as /search query params."""
+        params: list[tuple[str, str]] = [("folder", folder)]
         for column, op, value in conditions:
             if op not in ("<", "<=", "=", "!=", ">=", ">"):
-                return {"success": False, "message": f"Invalid operator: {op}"}
+                raise ValueError(f"Invalid operator: {op}")
             if value is None:
                 if op not in ("=", "!="):
-                    return {"success": False, "message": f"Unsupported operator {op} for NULL"}
+                    raise ValueError(f"Unsupported operator {op} for NULL")
                 params.append(("cond", f"{column} {op} null"))
             elif isinstance(value, str):
                 if "'" in value:
-                    return {"success": False, "message": f"Unsafe string value: {value}"}
+                    raise ValueError(f"Unsafe string value: {value}")
                 params.append(("cond", f"{column} {op} '{value}'"))
             else:
                 params.append(("cond", f"{column} {op} {value}"))
-
-        try:
-            resp = httpx.get(f"{self.base_url}/search", params=params, timeout=self.timeout)
-            resp.raise_for_status()
-        except httpx.HTTPError as e:
-            logger.error(f"ConDB search failed for {folder}: {e}")
-            return {"success": False, "message": f"Conditions DB search failed: {e}"}
-
-        text = resp.text.strip()
-        if not text:
-            return {"success": True, "results": [], "truncated": False}
-
-        lines = text.splitlines()
-        columns = lines[0].split(",")
-        results = []
-        truncated = False
-        for line in lines[1:]:
-            if len(results) >= limit:
-                truncated = True
-                break
-            # Same fix as get_run_conditions(): config_files (last column)
-            # is a Python dict literal with unquoted commas, so split only
-            # on the first len(columns)-1 commas.
-            values = line.split(",", len(columns) - 1)
-            if len(values) != len(columns):
-                logger.warning(
-                    f"Skipping malformed search row for {folder}: "
-                    f"{len(values)} fields, expected {len(columns)}"
-                )
-                continue
-            results.append(self._clean_row(dict(zip(columns, values))))
-
-        return {"success": True, "results": results, "truncated": truncated}
+        return params
 
     @staticmethod
     def _clean_row(row: dict) -> dict:
@@ -188,10 +758,7 @@ class ConditionsDBAPI:
                 # Single-quoted Python dict literal, not JSON -- literal_eval
                 # only, never eval(), and fall back to the raw string on
                 # anything that doesn't parse cleanly.
-                try:
-                    cleaned[key] = ast.literal_eval(value)
-                except (ValueError, SyntaxError):
-                    cleaned[key] = value
+                cleaned[key] = _parse_literal(value)
                 continue
             # Best-effort numeric coercion so the frontend can format/sort;
             # anything that doesn't parse as a number stays a string.
@@ -0,0 +1,280 @@
+"""
+condb_mirror.py — local SQLite mirror of the ConDB run-conditions folders.
+
+The folders in KNOWN_FOLDERS are append-mostly and small (tens of thousands
+of rows), so instead of sending every /searchRuns query to ConDB's /search
+(which scans the remote folder each time) we keep a copy of each folder in a
+local SQLite file, indexed on the columns behind CANONICAL_FIELDS, and
+answer searches from it.
+
+A background thread syncs every known folder: the first pass pulls the whole
+folder, later passes only rows with an upload_time newer than the newest one
+already mirrored. Until a folder's first sync has finished, is_ready() is
+False and callers should keep using ConDB directly.
+
+Enabled by setting CONDB_MIRROR_PATH (see .env.example).
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import httpx
+
+from src.lib import breaker
+from src.lib.condb_api import CANONICAL_FIELDS, ConditionsDBAPI
+
+logger = logging.getLogger(__name__)
+
+CONDB_MIRROR_PATH = os.environ.get("CONDB_MIRROR_PATH") or None
+CONDB_MIRROR_INTERVAL_S = float(os.environ.get("CONDB_MIRROR_INTERVAL", "300"))
+
+# Rows are written in batches of this many per transaction while syncing.
+_INSERT_BATCH = 1000
+
+_SQL_OPS = {"<": "<", "<=": "<=", "=": "=", "!=": "!=", ">=": ">=", ">": ">"}
+
+# config_files is the one column _clean_row turns into a dict; it is stored as
+# JSON text and decoded again on the way out.
+_JSON_COLUMNS = {"config_files"}
+
+
+def _table(folder: str) -> str:
+    """Quoted table name for a folder (folder names contain dots)."""
+    return '"rows:%s"' % folder.replace('"', "")
+
+
+def _col(name: str) -> str:
+    return '"%s"' % name.replace('"', "")
+
+
+class ConDBMirror:
+    def __init__(self, api: ConditionsDBAPI, path: str, folders):
+        self.api = api
+        self.path = path
+        self.folders = list(folders)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._columns: dict[str, list[str]] = {}
+        self._ready: set[str] = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state ("
+            " folder TEXT PRIMARY KEY, columns TEXT,"
+            " max_upload_time REAL, synced_at REAL)"
+        )
+        conn.commit()
+        for folder, columns, synced_at in conn.execute(
+                "SELECT folder, columns, synced_at FROM sync_state"):
+            # A folder that was still empty at its last sync has no table.
+            if json.loads(columns):
+                self._columns[folder] = json.loads(columns)
+            if synced_at:
+                self._ready.add(folder)
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; SQLite connections aren't shareable."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def is_ready(self, folder: str) -> bool:
+        """True once `folder` has been mirrored at least once."""
+        return folder in self._ready
+
+    # A run re-uploaded to ConDB keeps every version as its own (tv, tr)
+    # row; like ConDB's own search, only the newest one (highest tr) counts.
+    _NEWEST_VERSION = ("cur.tr = (SELECT MAX(newer.tr) FROM {table} AS newer"
+                       " WHERE newer.tv = cur.tv)")
+
+    # -- syncing ------------------------------------------------------------ #
+
+    def start(self, interval_s: float = CONDB_MIRROR_INTERVAL_S) -> None:
+        """Sync all folders now, then every `interval_s`, on a daemon thread."""
+        if self._thread is not None:
+            return
+
+        def loop():
+            while not self._stop.is_set():
+                self.sync_all()
+                self._stop.wait(interval_s)
+
+        self._thread = threading.Thread(target=loop, name="condb-mirror", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def sync_all(self) -> None:
+        for folder in self.folders:
+            try:
+                added = self.sync_folder(folder)
+                if added:
+                    logger.info(f"ConDB mirror: {added} new row(s) for {folder}")
+            except (ValueError, httpx.HTTPError, sqlite3.Error, breaker.CircuitOpen) as e:
+                logger.warning(f"ConDB mirror sync failed for {folder}: {e}")
+
+    def sync_folder(self, folder: str) -> int:
+        """Pull rows uploaded since the last sync. Returns rows written."""
+        conn = self._conn()
+        state = conn.execute(
+            "SELECT max_upload_time FROM sync_state WHERE folder = ?", (folder,)
+        ).fetchone()
+        since = state[0] if state and state[0] is not None else None
+        conditions = [("upload_time", ">", since)] if since is not None else [("tv", ">=", 0)]
+
+        written = 0
+        max_upload = since
+        batch = []
+        for row in self.api.iter_search(folder, conditions):
+            upload = row.get("upload_time")
+            if isinstance(upload, (int, float)) and (max_upload is None or upload > max_upload):
+                max_upload = upload
+            batch.append(row)
+            if len(batch) >= _INSERT_BATCH:
+                written += self._write(folder, batch)
+                batch = []
+        if batch:
+            written += self._write(folder, batch)
+
+        with self._write_lock:
+            conn.execute(
+                "INSERT INTO sync_state (folder, columns, max_upload_time, synced_at)"
+                " VALUES (?, ?, ?, ?) ON CONFLICT(folder) DO UPDATE SET"
+                " columns = excluded.columns, max_upload_time = excluded.max_upload_time,"
+                " synced_at = excluded.synced_at",
+                (folder, json.dumps(self._columns.get(folder, [])), max_upload, time.time()),
+            )
+            conn.commit()
+        self._ready.add(folder)
+        return written
+
+    def _ensure_schema(self, folder: str, row_columns) -> list[str]:
+        """Create the folder's table/indexes, adding any new columns."""
+        conn = self._conn()
+        known = self._columns.get(folder)
+        if known is None:
+            # Keep ConDB's column order; no declared types, so values keep
+            # the int/float/str type _clean_row gave them.
+            known = list(dict.fromkeys(["tv", "tr", *row_columns]))
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {_table(folder)} ("
+                f"{', '.join(_col(c) for c in known)}, UNIQUE (tv, tr))"
+            )
+        for column in row_columns:
+            if column not in known:
+                conn.execute(f"ALTER TABLE {_table(folder)} ADD COLUMN {_col(column)}")
+                known.append(column)
+        for per_folder in CANONICAL_FIELDS.values():
+            column = per_folder.get(folder)
+            if column in known:
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "idx:{folder}:{column}"'
+                    f" ON {_table(folder)} ({_col(column)})"
+                )
+        self._columns[folder] = known
+        return known
+
+    def _write(self, folder: str, rows: list[dict]) -> int:
+        conn = self._conn()
+        with self._write_lock:
+            columns = self._ensure_schema(folder, rows[0].keys())
+            for row in rows[1:]:
+                if any(k not in columns for k in row):
+                    columns = self._ensure_schema(folder, row.keys())
+            placeholders = ", ".join("?" for _ in columns)
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {_table(folder)}"
+                f" ({', '.join(_col(c) for c in columns)}) VALUES ({placeholders})",
+                [
+                    [json.dumps(row.get(c)) if c in _JSON_COLUMNS and row.get(c) is not None
+                     else row.get(c) for c in columns]
+                    for row in rows
+                ],
+            )
+            conn.commit()
+        return len(rows)
+
+    # -- searching ---------------------------------------------------------- #
+
+    def search_runs(self, folder: str, conditions: list[tuple[str, str, object]],
+                    limit: int = 200, order_by: str | None = None,
+                    descending: bool = False) -> dict:
+        """
+        Local equivalent of ConditionsDBAPI.search_runs (same arguments and
+        return shape), ordered by run number -- or by the `order_by` column
+        (NULLs last, then run number) when given, so the first `limit` rows
+        are the first `limit` in that order. Only each run's newest version
+        is searched. The result also carries "total", the exact number of
+        matching rows.
+        """
+        if folder not in self._ready:
+            return {"success": False, "message": f"Folder {folder} is not mirrored yet"}
+        columns = self._columns.get(folder)
+        if columns is None:
+            # Synced, but the folder had no rows yet (so no table either).
+            return {"success": True, "results": [], "truncated": False, "total": 0}
+
+        where, args = [self._NEWEST_VERSION.format(table=_table(folder))], []
+        for column, op, value in conditions:
+            if op not in _SQL_OPS:
+                return {"success": False, "message": f"Invalid operator: {op}"}
+            if column not in columns:
+                # ConDB would reject an unknown column; locally it simply
+                # can't match anything.
+                return {"success": True, "results": [], "truncated": False, "total": 0}
+            if value is None:
+                if op not in ("=", "!="):
+                    return {"success": False, "message": f"Unsupported operator {op} for NULL"}
+                where.append(f"cur.{_col(column)} IS {'NOT ' if op == '!=' else ''}NULL")
+                continue
+            if isinstance(value, str):
+                # Stored values went through _clean_row, so compare against
+                # the same coercion of the condition value.
+                value = ConditionsDBAPI._clean_row({column: value})[column]
+            where.append(f"cur.{_col(column)} {_SQL_OPS[op]} ?")
+            args.append(value)
+
+        where_sql = " WHERE " + " AND ".join(where)
+        order = "cur.tv"
+        if order_by is not None and order_by in columns:
+            order = (f"cur.{_col(order_by)} IS NULL, cur.{_col(order_by)}"
+                     f" {'DESC' if descending else 'ASC'}, {order}")
+        sql = (f"SELECT {', '.join('cur.' + _col(c) for c in columns)}"
+               f" FROM {_table(folder)} AS cur{where_sql} ORDER BY {order} LIMIT ?")
+
+        try:
+            conn = self._conn()
+            fetched = conn.execute(sql, [*args, limit + 1]).fetchall()
+            if len(fetched) > limit:
+                total = conn.execute(
+                    f"SELECT COUNT(*) FROM {_table(folder)} AS cur{where_sql}",
+                    args).fetchone()[0]
+            else:
+                total = len(fetched)
+        except sqlite3.Error as e:
+            logger.error(f"ConDB mirror search failed for {folder}: {e}")
+            return {"success": False, "message": f"Local conditions search failed: {e}"}
+
+        results = []
+        for values in fetched[:limit]:
+            row = {}
+            for column, value in zip(columns, values):
+                if column in _JSON_COLUMNS and isinstance(value, str):
+                    try:
+                        value = json.loads(value)
+                    except ValueError:
+                        pass
+                row[column] = value
+            results.append(row)
+        return {"success": True, "results": results, "truncated": len(fetched) > limit,
+                "total": total}
@@ -0,0 +1,213 @@
+"""
+http_pool.py — shared, pooled outbound HTTP clients.
+
+Every outbound call (ConDB, Rucio, vault, CILogon) goes through a client
+from this registry instead of building its own, so connections are kept
+alive and reused across requests and logins rather than paying a TCP+TLS
+handshake each time. Clients are registered by service name; httpx keeps a
+separate pool per host inside each one.
+
+    from src.lib import http_pool
+    client = http_pool.get_client("condb", timeout=30)
+    client = http_pool.get_async_client("cilogon", timeout=15)
+
+Sync and async clients share the same settings:
+
+    HTTP_POOL_MAX_CONNECTIONS   max open connections per client (default 20)
+    HTTP_POOL_MAX_KEEPALIVE     idle connections kept per client (default 10)
+    HTTP_POOL_KEEPALIVE_EXPIRY  seconds an idle connection is kept (default 60)
+
+pool_stats() reports, per client: connections in use and idle, requests
+sent, connections opened (i.e. handshakes paid), and requests that found
+the pool saturated and had to wait for a connection.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+import weakref
+
+import httpx
+
+from src.lib import timing
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get("HTTP_POOL_MAX_CONNECTIONS", "20"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.environ.get("HTTP_POOL_MAX_KEEPALIVE", "10"))
+HTTP_POOL_KEEPALIVE_EXPIRY_S = float(os.environ.get("HTTP_POOL_KEEPALIVE_EXPIRY", "60"))
+
+
+class _PoolStats:
+    """Counters for one client's connection pool."""
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.requests = 0
+        self.connections_opened = 0
+        self.waits = 0
+        self._seen = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def before(self, connections) -> None:
+        busy = sum(1 for c in connections if not c.is_idle())
+        with self._lock:
+            self.requests += 1
+            if busy >= self.max_connections:
+                self.waits += 1
+
+    def after(self, connections) -> None:
+        with self._lock:
+            for c in connections:
+                if c not in self._seen:
+                    self._seen.add(c)
+                    self.connections_opened += 1
+
+    def snapshot(self, connections) -> dict:
+        in_use = sum(1 for c in connections if not c.is_idle())
+        with self._lock:
+            return {
+                "in_use": in_use,
+                "idle": len(connections) - in_use,
+                "max_connections": self.max_connections,
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "waits": self.waits,
+            }
+
+
+def _connections(transport) -> list:
+    """The transport's pooled connections. httpx keeps them in a private
+    httpcore pool, so report none rather than fail if that ever moves."""
+    return getattr(getattr(transport, "_pool", None), "connections", None) or []
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    def __init__(self, stats: _PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def handle_request(self, request):
+        self.stats.before(_connections(self))
+        start = time.perf_counter()
+        try:
+            # Returns once the response headers are in; the body is read
+            # later by the caller.
+            return super().handle_request(request)
+        finally:
+            timing.add("upstream_ttfb", time.perf_counter() - start, start)
+            self.stats.after(_connections(self))
+
+
+class _AsyncCountingTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, stats: _PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    async def handle_async_request(self, request):
+        self.stats.before(_connections(self))
+        start = time.perf_counter()
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            timing.add("upstream_ttfb", time.perf_counter() - start, start)
+            self.stats.after(_connections(self))
+
+
+_clients: dict[tuple, httpx.Client | httpx.AsyncClient] = {}
+# Same keys as _clients; kept here so stats don't need client._transport.
+_transports: dict[tuple, _CountingTransport | _AsyncCountingTransport] = {}
+_lock = threading.Lock()
+
+
+def _transport_kwargs(verify, max_connections, max_keepalive) -> dict:
+    return {
+        "verify": verify,
+        "limits": httpx.Limits(
+            max_connections=max_connections or HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=max_keepalive or HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY_S,
+        ),
+    }
+
+
+def get_client(name: str, *, verify=True, timeout: float = 30,
+               max_connections: int | None = None,
+               max_keepalive: int | None = None) -> httpx.Client:
+    """
+    The shared sync client for `name` (created on first use). Callers with
+    different `verify`/`timeout` get separate clients; the pool limits are
+    fixed by whoever creates the client first.
+    """
+    key = ("sync", name, verify, timeout)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            kwargs = _transport_kwargs(verify, max_connections, max_keepalive)
+            stats = _PoolStats(kwargs["limits"].max_connections)
+            transport = _CountingTransport(stats, **kwargs)
+            client = httpx.Client(timeout=timeout, transport=transport)
+            _clients[key] = client
+            _transports[key] = transport
+        return client
+
+
+def get_async_client(name: str, *, verify=True, timeout: float = 30,
+                     max_connections: int | None = None,
+                     max_keepalive: int | None = None) -> httpx.AsyncClient:
+    """Async counterpart of get_client (same settings, separate pool)."""
+    key = ("async", name, verify, timeout)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            kwargs = _transport_kwargs(verify, max_connections, max_keepalive)
+            stats = _PoolStats(kwargs["limits"].max_connections)
+            transport = _AsyncCountingTransport(stats, **kwargs)
+            client = httpx.AsyncClient(timeout=timeout, transport=transport)
+            _clients[key] = client
+            _transports[key] = transport
+        return client
+
+
+def pool_stats() -> dict:
+    """{"<name>[ (async)]": {in_use, idle, requests, connections_opened, waits, ...}}"""
+    out = {}
+    with _lock:
+        items = list(_transports.items())
+    for (kind, name, _verify, _timeout), transport in items:
+        label = name if kind == "sync" else "%s (async)" % name
+        stats = transport.stats.snapshot(_connections(transport))
+        if label in out:
+            # Same service with another verify/timeout: report combined.
+            for k, v in stats.items():
+                out[label][k] += v
+        else:
+            out[label] = stats
+    return out
+
+
+def close_all() -> None:
+    """Close the sync clients (atexit). Async ones close with the loop."""
+    with _lock:
+        clients = [c for c in _clients.values() if isinstance(c, httpx.Client)]
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:  # pragma: no cover - best effort at exit
+            logger.debug("Error closing HTTP client: %s", e)
+
+
+async def aclose_all() -> None:
+    """Close the async clients; call from the app's shutdown hook."""
+    with _lock:
+        keys = [k for k, c in _clients.items() if isinstance(c, httpx.AsyncClient)]
+        clients = [_clients.pop(k) for k in keys]
+        for k in keys:
+            _transports.pop(k, None)
+    for client in clients:
+        await client.aclose()
+
+
+atexit.register(close_all)
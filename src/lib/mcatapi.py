@@ -4,7 +4,12 @@ import os
 import json
 import re
 import logging
+import threading
+import time
+from collections import OrderedDict
 from typing import Callable
+
+from src.lib import breaker, metrics, query_log, timing
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -39,6 +44,131 @@ SIZE_UNAVAILABLE = -1
 # reason to call it for each of thousands of rows).
 _CANCEL_CHECK_EVERY = 200
 
+# Run -> file resolution (iter_run_files): run numbers go into MetaCat in
+# chunks of this many per `core.runs[any] in (...)` query, with up to
+# _RUN_QUERY_WORKERS chunks in flight at once.
+_RUN_CHUNK = 50
+_RUN_QUERY_WORKERS = 4
+
+# The datasets holding a run's files are found from a few sample files per
+# run (one get_file lookup each, _RUN_LOOKUP_WORKERS at a time per chunk) and
+# cached, keyed by "namespace:run" -> (timestamp, [{"namespace", "name"}, ...]),
+# least recently used first out past _RUN_DATASETS_CACHE_MAX entries.
+_run_datasets_cache: "OrderedDict[str, tuple[float, list[dict]]]" = OrderedDict()
+_run_datasets_cache_lock = threading.Lock()
+_RUN_DATASETS_CACHE_TTL_S = 900  # 15 minutes
+_RUN_DATASETS_CACHE_MAX = 20000
+_RUN_DATASET_SAMPLE_FILES = 2
+_RUN_LOOKUP_WORKERS = 8
+
+# Partial results: a dataset/file search that reaches its soft budget stops
+# reading, closes the MetaCat stream and returns the rows it has, marked
+# truncated, instead of running on into the hard timeout (a 504 that throws
+# them all away). The time budget sits below the frontend's 2-minute timeout;
+# row and byte budgets are off (0) unless set. Budgets are checked as rows
+# arrive, so a stream that stalls outright still ends at the hard timeout.
+# PARTIAL_RESULTS=0 restores all-or-nothing.
+PARTIAL_RESULTS = os.getenv("PARTIAL_RESULTS", "1") != "0"
+QUERY_TIME_BUDGET_S = float(os.getenv("QUERY_TIME_BUDGET", "100"))
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "0"))
+QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", "0"))
+
+# Result lists being filled by _consume_query right now, by id(), so the
+# memory report (src/lib/memory.py) can show what in-flight queries hold.
+_inflight_results: dict[int, list] = {}
+
+
+# Circuit breakers (see src/lib/breaker.py), one per MetaCat client. MQL
+# queries, user-supplied ones included, vary too much in cost to be timed
+# out against recent traffic, so they keep the fixed METACAT_TIMEOUT. Only
+# single-file lookups (get_file), whose latency is stable, get an adaptive
+# timeout, on a client of their own. Size aggregates get their own breaker
+# with a fixed timeout too: one timing out just means the dataset is too
+# large to summarise (cached as SIZE_UNAVAILABLE), so it does not count
+# towards opening the breaker.
+METACAT_BREAKER = breaker.Breaker("metacat", timeout_ceiling=METACAT_TIMEOUT_S,
+                                  adaptive=False)
+METACAT_LOOKUP_BREAKER = breaker.Breaker("metacat_lookup", timeout_ceiling=METACAT_TIMEOUT_S,
+                                         timeout_floor=15)
+METACAT_SIZE_BREAKER = breaker.Breaker("metacat_summary", timeout_ceiling=METACAT_SIZE_TIMEOUT_S,
+                                       adaptive=False, timeouts_are_failures=False)
+
+
+def _set_timeout(client, guard_breaker) -> None:
+    """Apply the breaker's current timeout to a MetaCat client, whose
+    HTTPClient reads self.Timeout for each request it sends. Only for a
+    client used by that breaker alone, so concurrent calls all set the
+    same value."""
+    client.Timeout = guard_breaker.timeout()
+
+
+def _reraise_if_control(e: Exception) -> None:
+    """Cancellation and an open circuit must unwind to the endpoint rather
+    than be reported as a failed query."""
+    if type(e).__name__ == "QueryCancelled" or isinstance(e, breaker.CircuitOpen):
+        raise e
+
+
+class QueryBudget:
+    """
+    Soft limits for one streamed query (see PARTIAL_RESULTS above). The
+    clock starts when the budget is created, i.e. alongside the endpoint's
+    hard timeout, so time queued for a worker thread counts against both.
+    After _consume_query returns, `truncated` says which limit stopped it
+    ("time", "rows" or "bytes"), or is None if the result is complete.
+    """
+
+    def __init__(self, seconds: float = 0, max_rows: int = 0, max_bytes: int = 0):
+        self.deadline = time.monotonic() + seconds if seconds > 0 else None
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.truncated: str | None = None
+
+    @classmethod
+    def default(cls) -> "QueryBudget | None":
+        """The configured budget, or None when partial results are off."""
+        if not PARTIAL_RESULTS:
+            return None
+        return cls(QUERY_TIME_BUDGET_S, QUERY_MAX_ROWS, QUERY_MAX_BYTES)
+
+    def exhausted(self, rows: list) -> bool:
+        """Called when another row arrives, before it is kept: True (and
+        `truncated` set) if a limit was already reached, so the result is
+        cut short here. A stream that ends exactly at a limit is complete."""
+        if self.max_rows and len(rows) >= self.max_rows:
+            self.truncated = "rows"
+        elif self.max_bytes and self.bytes >= self.max_bytes:
+            self.truncated = "bytes"
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.truncated = "time"
+        return self.truncated is not None
+
+    def add(self, row) -> None:
+        """Account for a kept row's approximate wire size (only computed
+        when a byte budget is set)."""
+        if self.max_bytes:
+            self.bytes += len(json.dumps(row, default=str))
+
+    def mark(self, result: dict, continuation: dict | None = None) -> dict:
+        """Add the truncation flag (and, where the query can be resumed, a
+        continuation hint) to an API result."""
+        result["truncated"] = self.truncated is not None
+        if self.truncated is not None:
+            result["truncatedBy"] = self.truncated
+            if continuation is not None:
+                result["continuation"] = continuation
+        return result
+
+
+def _close_stream(response) -> None:
+    """Close a streaming MetaCat response so the server stops sending."""
+    try:
+        if response is not None:
+            response.close()
+    except Exception:
+        pass
+
 
 def _never_cancelled() -> bool:
     """Default cancel predicate for callers that don't pass one."""
@@ -85,8 +215,16 @@ class MetaCatAPI:
             os.getenv('METACAT_AUTH_SERVER_URL'),
             timeout=METACAT_SIZE_TIMEOUT_S,
         )
+        # Single-file lookups, with the adaptive METACAT_LOOKUP_BREAKER
+        # timeout; kept apart so it never applies to MQL queries.
+        self.lookup_client = MetaCatClient(
+            os.getenv('METACAT_SERVER_URL'),
+            os.getenv('METACAT_AUTH_SERVER_URL'),
+            timeout=METACAT_TIMEOUT_S,
+        )
 
-    def _consume_query(self, mql_query, is_cancelled, **query_kwargs):
+    def _consume_query(self, mql_query, is_cancelled, budget: "QueryBudget | None" = None,
+                       **query_kwargs):
         """
         Run an MQL query and materialise its results, honouring cancellation.
 
@@ -99,9 +237,14 @@ class MetaCatAPI:
         QueryCancelled so the partially-consumed query unwinds cleanly. No
         retry is attempted — a cancelled query must not generate more load.
 
+        With a `budget`, reaching any of its limits closes the stream the
+        same way but returns the rows read so far; `budget.truncated` then
+        says why.
+
         Args:
             mql_query: the MQL string to run.
             is_cancelled: zero-arg predicate returning True when work should stop.
+            budget: optional QueryBudget of soft limits for a row query.
             **query_kwargs: forwarded to `client.query` (e.g. summary="count").
 
         Returns:
@@ -110,32 +253,67 @@ class MetaCatAPI:
         """
         from src.backend.cancellable import QueryCancelled
 
-        result = self.client.query(mql_query, **query_kwargs)
-
-        # Summary queries return a materialised value (dict/int), not a
-        # stream, so there is nothing to iterate incrementally.
-        if query_kwargs.get("summary"):
-            return result
-
-        # The streaming response object lives on the client after the call;
-        # closing it is how we stop MetaCat mid-stream on cancellation.
-        response = getattr(self.client, "LastResponse", None)
-
-        rows = []
-        for i, row in enumerate(result):
-            if i % _CANCEL_CHECK_EVERY == 0 and is_cancelled():
-                logger.info(
-                    "Query cancelled after %d rows; closing MetaCat stream: %s",
-                    i, mql_query,
-                )
-                try:
-                    if response is not None:
-                        response.close()
-                except Exception:
-                    pass
-                raise QueryCancelled()
-            rows.append(row)
-        return rows
+        op = "summary" if query_kwargs.get("summary") else "query"
+        with METACAT_BREAKER.guard() as guard, metrics.upstream("metacat", op) as call, \
+                query_log.timed(mql_query, op) as logged:
+            start = time.perf_counter()
+            result = self.client.query(mql_query, **query_kwargs)
+
+            # Summary queries return a materialised value (dict/int), not a
+            # stream, so there is nothing to iterate incrementally.
+            if query_kwargs.get("summary"):
+                timing.add("upstream_ttfb", time.perf_counter() - start, start)
+                logged.first_row()
+                return result
+
+            # The streaming response object lives on the client after the call;
+            # closing it is how we stop MetaCat mid-stream on cancellation.
+            response = getattr(self.client, "LastResponse", None)
+
+            rows = []
+            _inflight_results[id(rows)] = rows
+            try:
+                for i, row in enumerate(result):
+                    if i == 0:
+                        timing.add("upstream_ttfb", time.perf_counter() - start, start)
+                        logged.first_row()
+                        guard.first_byte()
+                    if i % _CANCEL_CHECK_EVERY == 0 and is_cancelled():
+                        logger.info(
+                            "Query cancelled after %d rows; closing MetaCat stream: %s",
+                            i, mql_query,
+                        )
+                        _close_stream(response)
+                        call.add(rows=len(rows))
+                        logged.rows = len(rows)
+                        raise QueryCancelled()
+                    if budget is not None:
+                        if budget.exhausted(rows):
+                            logger.info(
+                                "Query reached its %s budget after %d rows; returning partial results: %s",
+                                budget.truncated, len(rows), mql_query,
+                            )
+                            _close_stream(response)
+                            break
+                        budget.add(row)
+                    rows.append(row)
+            finally:
+                _inflight_results.pop(id(rows), None)
+            call.add(rows=len(rows))
+            logged.rows = len(rows)
+            return rows
+
+    @staticmethod
+    def _format_file(result):
+        """A MetaCat file record -> the file row shape the frontend lists."""
+        return {
+            "fid": str(result.get("fid", "")),  # Ensure fid is a string
+            "name": str(result.get("name", "")),  # Ensure name is a string
+            "namespace": str(result.get("namespace", "")),  # Needed for file detail links
+            "updated": format_timestamp(result.get("updated_timestamp", 0)),  # Use 0 as default
+            "created": format_timestamp(result.get("created_timestamp", 0)),  # Use 0 as default
+            "size": int(result.get("size", 0)),  # Ensure size is an integer
+        }
 
     def login(self, username, password):
         try:
@@ -154,7 +332,8 @@ class MetaCatAPI:
             return {"success": False, "message": str(e)}
 
     def get_datasets(self, query_text, category, tab, official_only, custom_mql=None,
-                     is_cancelled: Callable[[], bool] = _never_cancelled):
+                     is_cancelled: Callable[[], bool] = _never_cancelled,
+                     budget: QueryBudget | None = None):
         """
         Get datasets matching the given query parameters
 
@@ -167,10 +346,13 @@ class MetaCatAPI:
             is_cancelled (callable, optional): predicate polled while streaming
                 results; when it returns True the query is aborted and the
                 MetaCat connection is closed.
+            budget (QueryBudget, optional): soft limits; when one is reached
+                the datasets found so far are returned with "truncated": true.
 
         Returns:
             A dictionary with a boolean "success" key and a list "results" key,
-            or a string "message" key if the query fails.
+            or a string "message" key if the query fails. With a budget, also
+            "truncated" and, if true, "truncatedBy".
         """
         try:
             # If custom MQL is provided, use it directly
@@ -214,29 +396,34 @@ class MetaCatAPI:
             
             print(f"Executing MQL query: {mql_query}")
             # Execute the MQL query, streaming results and honouring cancellation
-            raw_results = self._consume_query(mql_query, is_cancelled)
+            raw_results = self._consume_query(mql_query, is_cancelled, budget)
 
             # Format the results
-            formatted_results = [
-                {
-                    "name": result.get("name", ""),
-                    "creator": result.get("creator", ""),
-                    "created": format_timestamp(result.get("created_timestamp", "")),
-                    "files": result.get("file_count", 0),
-                    "size": int(result.get("total_size", 0) or 0),  # total bytes
-                    "namespace": result.get("namespace", "")
-                }
-                for result in raw_results
-            ]
-            return {
+            with timing.phase("format"):
+                formatted_results = [
+                    {
+                        "name": result.get("name", ""),
+                        "creator": result.get("creator", ""),
+                        "created": format_timestamp(result.get("created_timestamp", "")),
+                        "files": result.get("file_count", 0),
+                        "size": int(result.get("total_size", 0) or 0),  # total bytes
+                        "namespace": result.get("namespace", "")
+                    }
+                    for result in raw_results
+                ]
+            result = {
                 "success": True, 
                 "results": formatted_results,
                 "mqlQuery": mql_query  # Include the MQL query in the response
             }
+            if budget is not None:
+                # Dataset queries have no stable order to resume from, so
+                # there is no continuation, just the flag.
+                budget.mark(result)
+            return result
         except Exception as e:
             # A cancelled query must unwind, not be reported as a failure.
-            if type(e).__name__ == "QueryCancelled":
-                raise
+            _reraise_if_control(e)
             return {"success": False, "message": str(e)}
 
     def list_datasets(self):
@@ -259,7 +446,8 @@ class MetaCatAPI:
             return {"success": False, "message": str(e)}
 
     def get_files(self, namespace: str, name: str,
-                  is_cancelled: Callable[[], bool] = _never_cancelled):
+                  is_cancelled: Callable[[], bool] = _never_cancelled,
+                  budget: QueryBudget | None = None):
         """
         Get a list of files in MetaCat matching the given namespace and name
 
@@ -269,6 +457,9 @@ class MetaCatAPI:
             is_cancelled (callable, optional): predicate polled while streaming
                 results; when True the query is aborted and the MetaCat
                 connection closed.
+            budget (QueryBudget, optional): soft limits; when one is reached
+                the files read so far are returned with "truncated": true and
+                a continuation query for the rest.
 
         Returns:
             A dictionary with a boolean "success" key and a list "files" key,
@@ -283,30 +474,28 @@ class MetaCatAPI:
             print(f"  MQL query: {mql_query}")
 
             # Execute the MQL query, streaming results and honouring cancellation
-            raw_results = self._consume_query(mql_query, is_cancelled)
+            raw_results = self._consume_query(mql_query, is_cancelled, budget)
 
             # Format the results
-            files = [
-                {
-                    "fid": str(result.get("fid", "")),  # Ensure fid is a string
-                    "name": str(result.get("name", "")),  # Ensure name is a string
-                    "namespace": str(result.get("namespace", "")),  # Needed for file detail links
-                    "updated": format_timestamp(result.get("updated_timestamp", 0)),  # Use 0 as default
-                    "created": format_timestamp(result.get("created_timestamp", 0)),  # Use 0 as default
-                    "size": int(result.get("size", 0)),  # Ensure size is an integer
-                }
-                for result in raw_results
-            ]
+            with timing.phase("format"):
+                files = [self._format_file(result) for result in raw_results]
 
             # Always return a dictionary with files, even if empty
-            return {
+            result = {
                 "success": True,
                 "results": files,
                 "mqlQuery": mql_query
             }
+            if budget is not None:
+                # The query is ordered, so the rest is a skip away.
+                skip = len(raw_results)
+                budget.mark(result, {
+                    "skip": skip,
+                    "mqlQuery": f"files from {namespace}:{name} ordered skip {skip} limit {max_files - skip}",
+                })
+            return result
         except Exception as e:
-            if type(e).__name__ == "QueryCancelled":
-                raise
+            _reraise_if_control(e)
             return {
                 "success": False,
                 "message": str(e)
@@ -331,12 +520,17 @@ class MetaCatAPI:
         """
         MAX_RELATIVES = 50  # cap parents/children returned; raw files can have thousands
         try:
-            f = self.client.get_file(
-                did=f"{namespace}:{name}",
-                with_metadata=True,
-                with_provenance=True,
-                with_datasets=True,
-            )
+            with METACAT_LOOKUP_BREAKER.guard(), metrics.upstream("metacat", "get_file"):
+                _set_timeout(self.lookup_client, METACAT_LOOKUP_BREAKER)
+                start = time.perf_counter()
+                f = self.lookup_client.get_file(
+                    did=f"{namespace}:{name}",
+                    with_metadata=True,
+                    with_provenance=True,
+                    with_datasets=True,
+                )
+                # One non-streamed response: all of it is time to first byte.
+                timing.add("upstream_ttfb", time.perf_counter() - start, start)
             if f is None:
                 return {"success": False, "message": "File not found"}
 
@@ -393,6 +587,7 @@ class MetaCatAPI:
             }
             return {"success": True, "results": details}
         except Exception as e:
+            _reraise_if_control(e)
             logger.error(f"get_file_details failed for {namespace}:{name}: {str(e)}")
             return {"success": False, "message": str(e)}
 
@@ -413,19 +608,24 @@ class MetaCatAPI:
             A dictionary with a boolean "success" key and a "results" dict
             mapping "namespace:name" -> total size in bytes.
         """
-        import time
         from concurrent.futures import ThreadPoolExecutor
 
+        # The pool's threads don't see the request context; capture the user.
+        user = query_log.current_user()
+
         def one(ds):
             did = f"{ds['namespace']}:{ds['name']}"
             cached = _dataset_size_cache.get(did)
             if cached and time.time() - cached[0] < _DATASET_SIZE_CACHE_TTL_S:
+                query_log.record(f"files from {did}", "summary", 0.0, cached=True, user=user)
                 return did, cached[1]
             # Don't start a fresh MetaCat query if the request was abandoned.
             if is_cancelled():
                 return did, None
             try:
-                res = self.size_client.query(f"files from {did}", summary="count")
+                with METACAT_SIZE_BREAKER.guard(), metrics.upstream("metacat", "summary"), \
+                        query_log.timed(f"files from {did}", "summary", user):
+                    res = self.size_client.query(f"files from {did}", summary="count")
                 # Depending on client version this is a dict or a 1-element list
                 if not isinstance(res, dict):
                     res = list(res)
@@ -433,6 +633,10 @@ class MetaCatAPI:
                 size = int((res or {}).get("total_size", 0) or 0)
                 _dataset_size_cache[did] = (time.time(), size)
                 return did, size
+            except breaker.CircuitOpen:
+                # MetaCat is failing: answer from the expired cache entry if
+                # there is one, else "n/a" without caching that verdict.
+                return did, cached[1] if cached else SIZE_UNAVAILABLE
             except Exception as e:
                 # Usually a read timeout: the aggregate is too large to
                 # summarize within METACAT_SIZE_TIMEOUT. Mark it unavailable
@@ -440,6 +644,7 @@ class MetaCatAPI:
                 # that verdict so the same doomed query isn't re-issued on
                 # every page view.
                 logger.warning(f"Size summary query failed for {did}: {e}")
+                metrics.SIZE_UNAVAILABLE.inc()
                 _dataset_size_cache[did] = (time.time(), SIZE_UNAVAILABLE)
                 return did, SIZE_UNAVAILABLE
 
@@ -454,6 +659,159 @@ class MetaCatAPI:
             logger.error(f"get_dataset_sizes failed: {str(e)}")
             return {"success": False, "message": str(e)}
 
+    def iter_run_files(self, runs, namespace: str, files_per_run: int = 100,
+                       is_cancelled: Callable[[], bool] = _never_cancelled):
+        """
+        Resolve run numbers to the MetaCat files (and datasets) holding them.
+
+        Runs are queried in chunks of _RUN_CHUNK with one MQL query each,
+        `files where namespace="<ns>" and core.runs[any] in (...)`, with up
+        to _RUN_QUERY_WORKERS chunks running in parallel. Results are yielded
+        per run as soon as that run's chunk finishes, so callers can stream
+        them. The datasets for each run come from a few sample files' dataset
+        memberships (looked up in parallel by the chunk's worker, and cached
+        per run), not from an exhaustive scan. A chunk's query shares one
+        limit between its runs; when it is reached, every run short of
+        files_per_run is reported as truncated.
+
+        Args:
+            runs: run numbers to resolve
+            namespace: MetaCat file namespace to search (e.g. "hd-protodune")
+            files_per_run: cap on files listed per run
+            is_cancelled (callable, optional): predicate polled while
+                streaming; once True no further MetaCat queries are issued.
+
+        Yields:
+            {"run", "files": [...], "datasets": [...], "truncated": bool,
+             "mqlQuery"} for every requested run (an empty "files" list when
+            nothing matched), or {"run", "error"} if its chunk failed.
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        from src.backend.cancellable import QueryCancelled
+
+        runs = sorted(set(int(r) for r in runs))
+        chunks = [runs[i:i + _RUN_CHUNK] for i in range(0, len(runs), _RUN_CHUNK)]
+
+        def datasets_for(chunk_files: dict) -> dict:
+            """{run: [dataset, ...]} for the runs of one chunk, from the cache
+            or from parallel get_file lookups of a few sample files per run."""
+            now = time.time()
+            datasets, todo = {}, {}
+            with _run_datasets_cache_lock:
+                for run, files in chunk_files.items():
+                    cached = _run_datasets_cache.get(f"{namespace}:{run}")
+                    if cached and now - cached[0] < _RUN_DATASETS_CACHE_TTL_S:
+                        _run_datasets_cache.move_to_end(f"{namespace}:{run}")
+                        datasets[run] = cached[1]
+                    elif files:
+                        todo[run] = files[:_RUN_DATASET_SAMPLE_FILES]
+                    else:
+                        datasets[run] = []
+
+            def lookup(f):
+                if is_cancelled():
+                    return None
+                try:
+                    with METACAT_LOOKUP_BREAKER.guard(), metrics.upstream("metacat", "get_file"):
+                        _set_timeout(self.lookup_client, METACAT_LOOKUP_BREAKER)
+                        return self.lookup_client.get_file(
+                            did=f"{f['namespace']}:{f['name']}", with_datasets=True,
+                        ) or {}
+                except Exception as e:
+                    _reraise_if_control(e)
+                    logger.warning(f"Dataset lookup failed for {f['name']}: {e}")
+                    return None
+
+            samples = [(run, f) for run, files in todo.items() for f in files]
+            if samples:
+                with ThreadPoolExecutor(max_workers=min(_RUN_LOOKUP_WORKERS, len(samples))) as lookups:
+                    infos = list(lookups.map(lookup, [f for _, f in samples]))
+                found: dict[int, dict] = {run: {} for run in todo}
+                for (run, _f), info in zip(samples, infos):
+                    for d in (info or {}).get("datasets") or []:
+                        if isinstance(d, dict):
+                            ds = {"namespace": d.get("namespace"), "name": d.get("name")}
+                            found[run][f"{ds['namespace']}:{ds['name']}"] = ds
+                with _run_datasets_cache_lock:
+                    for run, by_did in found.items():
+                        datasets[run] = sorted(by_did.values(),
+                                               key=lambda d: (d["namespace"] or "", d["name"] or ""))
+                        if not is_cancelled():
+                            _run_datasets_cache[f"{namespace}:{run}"] = (now, datasets[run])
+                    while len(_run_datasets_cache) > _RUN_DATASETS_CACHE_MAX:
+                        _run_datasets_cache.popitem(last=False)
+            return datasets
+
+        user = query_log.current_user()
+
+        def one_chunk(chunk):
+            run_list = ", ".join(str(r) for r in chunk)
+            mql_query = (
+                f'files where namespace="{namespace}" and core.runs[any] in ({run_list})'
+                f" limit {files_per_run * len(chunk)}"
+            )
+            limit = files_per_run * len(chunk)
+            by_run = {r: [] for r in chunk}
+            truncated = set()
+            if is_cancelled():
+                return chunk, mql_query, None, truncated, None, "cancelled"
+            try:
+                with METACAT_BREAKER.guard() as guard, metrics.upstream("metacat", "query") as call, \
+                        query_log.timed(mql_query, "query", user) as logged:
+                    records = self.client.query(mql_query, with_metadata=True)
+                    response = getattr(self.client, "LastResponse", None)
+                    logged.rows = 0
+                    for i, rec in enumerate(records):
+                        if i == 0:
+                            logged.first_row()
+                            guard.first_byte()
+                        if i % _CANCEL_CHECK_EVERY == 0 and is_cancelled():
+                            # Raised inside the guards so the call counts
+                            # as cancelled, not as a successful sample.
+                            _close_stream(response)
+                            raise QueryCancelled()
+                        call.add(rows=1)
+                        logged.rows += 1
+                        file_runs = (rec.get("metadata") or {}).get("core.runs") or []
+                        for r in file_runs:
+                            if r in by_run:
+                                if len(by_run[r]) < files_per_run:
+                                    by_run[r].append(self._format_file(rec))
+                                else:
+                                    truncated.add(r)
+                if logged.rows >= limit:
+                    # The chunk's limit is shared, so a run with many files
+                    # can use it up: any run not filled to files_per_run may
+                    # be missing files (or all of them).
+                    truncated.update(r for r, files in by_run.items()
+                                     if len(files) < files_per_run)
+                datasets = datasets_for(by_run)
+            except QueryCancelled:
+                return chunk, mql_query, None, truncated, None, "cancelled"
+            except Exception as e:
+                logger.error(f"Run file query failed: {mql_query}: {e}")
+                return chunk, mql_query, None, truncated, None, str(e)
+            return chunk, mql_query, by_run, truncated, datasets, None
+
+        with ThreadPoolExecutor(max_workers=_RUN_QUERY_WORKERS) as pool:
+            futures = [pool.submit(one_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                chunk, mql_query, by_run, truncated, datasets, error = future.result()
+                if error == "cancelled":
+                    return
+                for run in chunk:
+                    if by_run is None:
+                        yield {"run": run, "error": error, "mqlQuery": mql_query}
+                        continue
+                    files = by_run[run]
+                    yield {
+                        "run": run,
+                        "files": files,
+                        "datasets": datasets[run],
+                        "truncated": run in truncated,
+                        "mqlQuery": mql_query,
+                    }
+
     def get_username(self):
         """
         Returns username and token expiration timestamp.
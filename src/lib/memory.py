@@ -0,0 +1,233 @@
+"""
+memory.py — where the backend's memory goes (GET /admin/memory and the
+/admin/memory/* tracemalloc endpoints in src/backend/main.py).
+
+Long-lived in-process structures (caches, pending logins, token stores,
+in-flight query results) are registered here by name; report() gives each
+one's entry count and approximate deep size, next to the process RSS:
+
+    memory.register("metacat_dataset_sizes", lambda: mcatapi._dataset_size_cache)
+    memory.register_stats("rucio_replicas", cache.stats)   # already measured
+
+Sizes are sys.getsizeof summed over the object graph, extrapolated from the
+first SAMPLE_ITEMS items of large containers, so a report costs milliseconds
+even for caches with tens of thousands of entries.
+
+For growth the registry doesn't explain, tracemalloc can be switched on at
+runtime (it costs CPU and memory while on, so it is off by default), and
+snapshots taken and diffed, grouped by subsystem (module), file or line.
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+
+SAMPLE_ITEMS = 200
+MAX_SNAPSHOTS = 5
+
+_registry: dict[str, tuple[str, object]] = {}
+_registry_lock = threading.Lock()
+
+
+def approx_size(obj, _depth: int = 0) -> int:
+    """Approximate deep size in bytes (shared objects may be counted twice)."""
+    size = sys.getsizeof(obj)
+    if _depth > 8 or isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        n = len(obj)
+        sized = 0
+        for i, (k, v) in enumerate(obj.items()):
+            if i >= SAMPLE_ITEMS:
+                break
+            sized += approx_size(k, _depth + 1) + approx_size(v, _depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        n = len(obj)
+        sized = 0
+        for i, v in enumerate(obj):
+            if i >= SAMPLE_ITEMS:
+                break
+            sized += approx_size(v, _depth + 1)
+    else:
+        slots = getattr(type(obj), "__slots__", ())
+        fields = [getattr(obj, s) for s in slots if hasattr(obj, s)]
+        fields += list(getattr(obj, "__dict__", {}).values())
+        return size + sum(approx_size(f, _depth + 1) for f in fields)
+    if n > SAMPLE_ITEMS:
+        sized = sized * n // SAMPLE_ITEMS
+    return size + sized
+
+
+def register(name: str, get) -> None:
+    """Track the container returned by `get()` (a dict, list, deque...)."""
+    with _registry_lock:
+        _registry[name] = ("container", get)
+
+
+def register_stats(name: str, stats) -> None:
+    """Track a structure that measures itself: `stats()` returns a dict with
+    "entries" and "approx_bytes" (extra keys are passed through)."""
+    with _registry_lock:
+        _registry[name] = ("stats", stats)
+
+
+def _measure(kind: str, source) -> dict:
+    if kind == "stats":
+        return dict(source())
+    container = source()
+    # Copy first: the structure may be mutated by a worker thread meanwhile.
+    for _ in range(3):
+        try:
+            snapshot = (dict(container) if isinstance(container, dict)
+                        else list(container))
+            break
+        except RuntimeError:
+            continue
+    else:
+        raise RuntimeError("changed size while being measured")
+    return {"entries": len(snapshot), "approx_bytes": approx_size(snapshot)}
+
+
+def report() -> dict:
+    """{name: {"entries", "approx_bytes"} or {"error"}}, largest first."""
+    with _registry_lock:
+        items = list(_registry.items())
+    out = {}
+    for name, (kind, source) in items:
+        try:
+            out[name] = _measure(kind, source)
+        except Exception as e:
+            out[name] = {"error": f"{type(e).__name__}: {e}"}
+    return dict(sorted(out.items(), key=lambda kv: kv[1].get("approx_bytes", 0), reverse=True))
+
+
+def rss_bytes() -> int | None:
+    """Current resident set size (Linux), or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# -- tracemalloc ------------------------------------------------------------ #
+
+_snapshots: "OrderedDict[int, tuple[float, tracemalloc.Snapshot]]" = OrderedDict()
+_snapshot_lock = threading.Lock()
+_next_id = 1
+
+_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def tracemalloc_status() -> dict:
+    with _snapshot_lock:
+        snapshots = [{"id": i, "at": at} for i, (at, _) in _snapshots.items()]
+    status = {"tracing": tracemalloc.is_tracing(), "snapshots": snapshots}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        status.update(traced_bytes=current, peak_bytes=peak,
+                      frames=tracemalloc.get_traceback_limit(),
+                      overhead_bytes=tracemalloc.get_tracemalloc_memory())
+    return status
+
+
+def start_tracing(frames: int = 1) -> None:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(max(1, frames))
+
+
+def stop_tracing() -> None:
+    """Stop tracing and drop the snapshots (they are only comparable with
+    snapshots from the same tracing session)."""
+    tracemalloc.stop()
+    with _snapshot_lock:
+        _snapshots.clear()
+
+
+def take_snapshot() -> int:
+    """Snapshot current allocations (tracing must be on); returns its id.
+    Only the last MAX_SNAPSHOTS are kept."""
+    global _next_id
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not running")
+    snapshot = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+    with _snapshot_lock:
+        snapshot_id = _next_id
+        _next_id += 1
+        _snapshots[snapshot_id] = (time.time(), snapshot)
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    return snapshot_id
+
+
+def _subsystem(filename: str) -> str:
+    """src/lib/mcatapi.py -> "mcatapi"; .../site-packages/httpx/_x.py -> "httpx"."""
+    parts = filename.replace("\\", "/").split("/")
+    if "site-packages" in parts:
+        i = parts.index("site-packages")
+        if i + 1 < len(parts):
+            return parts[i + 1].split(".")[0]
+    if "src" in parts:
+        return os.path.splitext(parts[-1])[0]
+    return "python:" + os.path.splitext(parts[-1])[0]
+
+
+def _grouped(stats, group_by: str, diff: bool) -> list[dict]:
+    if group_by != "subsystem":
+        rows = []
+        for s in stats:
+            frame = s.traceback[0]
+            where = frame.filename if group_by == "filename" else f"{frame.filename}:{frame.lineno}"
+            row = {"where": where, "size_bytes": s.size, "count": s.count}
+            if diff:
+                row.update(size_diff_bytes=s.size_diff, count_diff=s.count_diff)
+            rows.append(row)
+        return rows
+    groups: dict[str, dict] = {}
+    for s in stats:
+        g = groups.setdefault(_subsystem(s.traceback[0].filename),
+                              {"size_bytes": 0, "count": 0, "size_diff_bytes": 0, "count_diff": 0})
+        g["size_bytes"] += s.size
+        g["count"] += s.count
+        if diff:
+            g["size_diff_bytes"] += s.size_diff
+            g["count_diff"] += s.count_diff
+    rows = []
+    for where, g in groups.items():
+        if not diff:
+            del g["size_diff_bytes"], g["count_diff"]
+        rows.append({"where": where, **g})
+    return rows
+
+
+def _snapshot(snapshot_id: int) -> tracemalloc.Snapshot:
+    with _snapshot_lock:
+        entry = _snapshots.get(snapshot_id)
+    if entry is None:
+        raise KeyError(snapshot_id)
+    return entry[1]
+
+
+def top(snapshot_id: int, group_by: str = "subsystem", limit: int = 25) -> list[dict]:
+    """Largest allocation sites in a snapshot."""
+    key = "filename" if group_by == "subsystem" else group_by
+    rows = _grouped(_snapshot(snapshot_id).statistics(key), group_by, diff=False)
+    rows.sort(key=lambda r: r["size_bytes"], reverse=True)
+    return rows[:limit]
+
+
+def diff(since_id: int, until_id: int, group_by: str = "subsystem",
+         limit: int = 25) -> list[dict]:
+    """Allocation growth between two snapshots, largest growth first."""
+    key = "filename" if group_by == "subsystem" else group_by
+    stats = _snapshot(until_id).compare_to(_snapshot(since_id), key)
+    rows = _grouped(stats, group_by, diff=True)
+    rows.sort(key=lambda r: r["size_diff_bytes"], reverse=True)
+    return rows[:limit]
@@ -0,0 +1,219 @@
+"""
+metrics.py — in-process counters and latency histograms, exposed in the
+Prometheus text format at GET /metrics (see src/backend/main.py).
+
+Deliberately tiny instead of pulling in prometheus_client: recording is a
+dict lookup, a bisect and two additions under a per-metric lock, cheap
+enough to leave on for every request and upstream call.
+
+    with metrics.upstream("condb", "get") as call:
+        resp = ...
+        call.add(rows=1, nbytes=len(resp.content))
+
+Values that already live elsewhere (cache sizes, pool occupancy) are not
+copied in here; register a callback with `gauge(...)` and it is read at
+scrape time.
+"""
+
+import bisect
+import math
+import threading
+import time
+
+from src.lib import timing
+
+# Seconds. Upstream calls range from a cached ms to multi-minute aggregates.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _number(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labelvalues) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [per-bucket counts..., +Inf count, sum]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            slot = self._values.get(labelvalues)
+            if slot is None:
+                slot = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            slot[i] += 1
+            slot[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for labelvalues, slot in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), slot):
+                cumulative += count
+                le = (("le", _number(bound)),)
+                yield (f"{self.name}_bucket"
+                       f"{_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            labels = _labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_number(slot[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """A value read at scrape time: `read()` returns a number, or a dict of
+    {labelvalues tuple: number}. Errors while reading just skip the gauge."""
+
+    def __init__(self, name: str, help: str, read, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.read = read
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        if isinstance(value, dict):
+            for labelvalues, v in value.items():
+                yield f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(v)}"
+        else:
+            yield f"{self.name} {_number(value)}"
+
+
+_registry: dict[str, object] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+
+def counter(name, help, labelnames=()) -> Counter:
+    return _register(Counter(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labelnames, buckets))
+
+
+def gauge(name, help, read, labelnames=()) -> Gauge:
+    """Register (or replace) a scrape-time gauge."""
+    metric = Gauge(name, help, read, labelnames)
+    with _registry_lock:
+        _registry[name] = metric
+    return metric
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# -- metrics shared across modules ----------------------------------------- #
+
+REQUEST_SECONDS = histogram(
+    "dunecat_http_request_duration_seconds",
+    "Backend endpoint latency.", ("method", "route", "status"))
+UPSTREAM_SECONDS = histogram(
+    "dunecat_upstream_request_duration_seconds",
+    "Latency of calls to MetaCat, ConDB, Rucio and vault.",
+    ("upstream", "op", "outcome"))
+UPSTREAM_ROWS = counter(
+    "dunecat_upstream_rows_total",
+    "Rows/records received from upstream services.", ("upstream", "op"))
+UPSTREAM_BYTES = counter(
+    "dunecat_upstream_bytes_total",
+    "Response bytes received from upstream services.", ("upstream", "op"))
+CANCELLATIONS = counter(
+    "dunecat_cancellations_total",
+    "Requests whose upstream work was abandoned.", ("reason",))
+SIZE_UNAVAILABLE = counter(
+    "dunecat_dataset_size_unavailable_total",
+    "Dataset size summaries that failed and were reported as n/a.")
+
+
+class upstream:
+    """Context manager timing one upstream call, labelled with its outcome
+    (ok / error / cancelled / closed). Rows/bytes can be added as the call
+    runs; a streaming call can exclude() the time its consumer spent
+    between rows."""
+
+    __slots__ = ("service", "op", "rows", "nbytes", "_start", "_excluded")
+
+    def __init__(self, service: str, op: str):
+        self.service, self.op = service, op
+        self.rows = self.nbytes = 0
+        self._excluded = 0.0
+
+    def add(self, rows: int = 0, nbytes: int = 0) -> None:
+        self.rows += rows
+        self.nbytes += nbytes
+
+    def exclude(self, seconds: float) -> None:
+        """Leave `seconds` (not spent waiting on the upstream) out of the
+        recorded duration."""
+        self._excluded += seconds
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            outcome = "ok"
+        elif issubclass(exc_type, GeneratorExit):
+            outcome = "closed"      # consumer stopped reading a stream early
+        elif exc_type.__name__ == "QueryCancelled":
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+        elapsed = time.perf_counter() - self._start - self._excluded
+        UPSTREAM_SECONDS.observe(elapsed, self.service, self.op, outcome)
+        timing.add("upstream", elapsed, self._start)
+        if self.rows:
+            UPSTREAM_ROWS.inc(self.rows, self.service, self.op)
+        if self.nbytes:
+            UPSTREAM_BYTES.inc(self.nbytes, self.service, self.op)
+        return False
@@ -0,0 +1,189 @@
+"""
+query_log.py — record of every MetaCat query and a workload summary for
+admins (GET /admin/queryLog and /admin/queryStats in src/backend/main.py).
+
+Each query issued by MetaCatAPI is recorded with its normalized shape
+(literals replaced by "?", so `name ~* '(?i)atmos'` and `name ~* '(?i)reco2'`
+group together), the user, total duration, time to first row, row count,
+and whether it was cancelled, failed or answered from cache. Entries are
+kept in a bounded ring buffer; with QUERY_LOG_PATH set they are also
+appended to that file as JSON lines, rotated at QUERY_LOG_MAX_BYTES with
+QUERY_LOG_BACKUPS old files kept.
+
+    QUERY_LOG_SIZE       entries kept in memory (default 5000)
+    QUERY_LOG_PATH       optional JSON-lines file
+    QUERY_LOG_MAX_BYTES  rotate the file at this size (default 10 MB)
+    QUERY_LOG_BACKUPS    rotated files kept (default 3)
+"""
+
+import json
+import logging
+import logging.handlers
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from src.lib import timing
+
+logger = logging.getLogger(__name__)
+
+QUERY_LOG_SIZE = int(os.environ.get("QUERY_LOG_SIZE", "5000"))
+QUERY_LOG_PATH = os.environ.get("QUERY_LOG_PATH") or None
+QUERY_LOG_MAX_BYTES = int(os.environ.get("QUERY_LOG_MAX_BYTES", str(10 * 2**20)))
+QUERY_LOG_BACKUPS = int(os.environ.get("QUERY_LOG_BACKUPS", "3"))
+
+_entries: deque = deque(maxlen=QUERY_LOG_SIZE)
+_lock = threading.Lock()
+
+# The file is written through its own non-propagating logger so rotation
+# comes from the stdlib handler and entries stay out of the app log.
+_file_logger = None
+if QUERY_LOG_PATH:
+    _file_logger = logging.getLogger("dunecat.query_log")
+    _file_logger.propagate = False
+    _file_logger.setLevel(logging.INFO)
+    try:
+        _handler = logging.handlers.RotatingFileHandler(
+            QUERY_LOG_PATH, maxBytes=QUERY_LOG_MAX_BYTES, backupCount=QUERY_LOG_BACKUPS)
+        _handler.setFormatter(logging.Formatter("%(message)s"))
+        _file_logger.addHandler(_handler)
+    except OSError as e:
+        logger.warning(f"Query log file {QUERY_LOG_PATH} disabled: {e}")
+        _file_logger = None
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize(mql: str) -> str:
+    """The query's shape: literals -> ?, literal lists -> (?), spacing collapsed."""
+    shape = _STRING.sub("?", mql)
+    shape = _NUMBER.sub("?", shape)
+    shape = _LIST.sub("(?)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+def current_user() -> str | None:
+    """The user of the request being served, if any (set by auth)."""
+    rt = timing.current()
+    return rt.user if rt is not None else None
+
+
+def record(mql: str, kind: str, duration_s: float, *, ttfb_s: float | None = None,
+           rows: int | None = None, cancelled: bool = False, cached: bool = False,
+           error: str | None = None, user: str | None = None) -> None:
+    entry = {
+        "at": time.time(),
+        "kind": kind,
+        "shape": normalize(mql),
+        "mql": mql,
+        "user": user if user is not None else current_user(),
+        "duration_ms": round(duration_s * 1000, 1),
+        "ttfb_ms": round(ttfb_s * 1000, 1) if ttfb_s is not None else None,
+        "rows": rows,
+        "cancelled": cancelled,
+        "cached": cached,
+        "error": error,
+    }
+    with _lock:
+        _entries.append(entry)
+    if _file_logger is not None:
+        _file_logger.info(json.dumps(entry))
+
+
+class timed:
+    """Context manager recording one query. Set `rows` (and `cancelled`, for
+    a query abandoned without raising) while it runs; QueryCancelled marks
+    the entry cancelled, other exceptions are kept as its error."""
+
+    __slots__ = ("mql", "kind", "user", "rows", "ttfb_s", "cancelled", "_start")
+
+    def __init__(self, mql: str, kind: str = "query", user: str | None = None):
+        self.mql, self.kind, self.user = mql, kind, user
+        self.rows = None
+        self.ttfb_s = None
+        self.cancelled = False
+
+    def first_row(self) -> None:
+        if self.ttfb_s is None:
+            self.ttfb_s = time.perf_counter() - self._start
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        cancelled = self.cancelled or (
+            exc_type is not None and exc_type.__name__ == "QueryCancelled")
+        error = None if exc_type is None or cancelled else f"{exc_type.__name__}: {exc}"
+        record(self.mql, self.kind, time.perf_counter() - self._start,
+               ttfb_s=self.ttfb_s, rows=self.rows, cancelled=cancelled,
+               error=error, user=self.user)
+        return False
+
+
+def recent(limit: int = 100, min_ms: float = 0, user: str | None = None) -> list[dict]:
+    """Newest entries first, optionally only those slower than `min_ms`."""
+    with _lock:
+        entries = list(_entries)
+    out = []
+    for entry in reversed(entries):
+        if entry["duration_ms"] < min_ms or (user and entry["user"] != user):
+            continue
+        out.append(entry)
+        if len(out) >= limit:
+            break
+    return out
+
+
+def _p95(values: list[float]) -> float:
+    values = sorted(values)
+    return values[max(0, math.ceil(0.95 * len(values)) - 1)]
+
+
+def top_shapes(limit: int = 20, sort: str = "total", since_s: float | None = None) -> list[dict]:
+    """
+    Queries grouped by shape, most expensive first by `sort` ("total",
+    "p95", "count" or "max" duration). Cached answers count towards
+    `count`/`cached` but not the duration statistics.
+    """
+    cutoff = time.time() - since_s if since_s else 0
+    with _lock:
+        entries = [e for e in _entries if e["at"] >= cutoff]
+
+    groups: dict[tuple, dict] = {}
+    for e in entries:
+        g = groups.get((e["kind"], e["shape"]))
+        if g is None:
+            g = groups[(e["kind"], e["shape"])] = {
+                "kind": e["kind"], "shape": e["shape"], "example": e["mql"],
+                "count": 0, "cached": 0, "cancelled": 0, "errors": 0,
+                "rows": 0, "users": set(), "durations": [],
+            }
+        g["count"] += 1
+        g["users"].add(e["user"])
+        g["cancelled"] += e["cancelled"]
+        g["errors"] += e["error"] is not None
+        g["rows"] += e["rows"] or 0
+        if e["cached"]:
+            g["cached"] += 1
+        else:
+            g["durations"].append(e["duration_ms"])
+
+    out = []
+    for g in groups.values():
+        durations = g.pop("durations")
+        g["users"] = len(g["users"] - {None})
+        g["total_ms"] = round(sum(durations), 1)
+        g["mean_ms"] = round(sum(durations) / len(durations), 1) if durations else 0.0
+        g["p95_ms"] = _p95(durations) if durations else 0.0
+        g["max_ms"] = max(durations) if durations else 0.0
+        out.append(g)
+    key = {"total": "total_ms", "p95": "p95_ms", "count": "count", "max": "max_ms"}.get(sort, "total_ms")
+    out.sort(key=lambda g: g[key], reverse=True)
+    return out[:limit]
@@ -34,7 +34,13 @@ function isReauth(e: unknown): boolean {
     );
 }
 
-/** GET /rucio/replicas — per-site PFNs for a file DID. */
+/**
+ * GET /rucio/replicas — per-site PFNs for a file DID, best site first for
+ * the user's location (disk before tape, then expected transfer speed).
+ * The backend ranks by the location it last recorded for this user (sent
+ * with dataset access records), so replica lookups never wait on the
+ * browser's geolocation prompt.
+ */
 export async function getReplicas(scope: string, name: string): Promise<ReplicasResponse> {
     try {
         const res = await apiClient.get<ReplicasResponse>('/rucio/replicas', {
@@ -48,8 +54,31 @@ export async function getReplicas(scope: string, name: string): Promise<Replicas
 }
 
 /**
- * Run the one-time "Connect to FNAL" flow: open the CILogon popup and poll
+ * POST /rucio/replicas/batch — per-site PFNs for many file DIDs ("scope:name")
+ * at once, or for every file of a dataset. Keyed by file DID; sites are
+ * ranked as in getReplicas.
+ */
+export async function getReplicasBatch(
+    request: { dids: string[] } | { dataset: string },
+): Promise<Record<string, ReplicaSite[]>> {
+    try {
+        const res = await apiClient.post<{ replicas: Record<string, ReplicaSite[]> }>(
+            '/rucio/replicas/batch', request,
+        );
+        return res.data.replicas;
+    } catch (e) {
+        if (isReauth(e)) throw new ReauthRequired();
+        throw e;
+    }
+}
+
+/**
+ * Run the one-time "Connect to FNAL" flow: open the CILogon popup and wait
  * until the backend has stored the vault token. Resolves when connected.
+ *
+ * /rucio/login/wait is a long-poll: the backend polls vault itself and
+ * answers as soon as the login completes (or "pending" after ~25 s, in
+ * which case we just ask again).
  */
 export async function connectToFnal(): Promise<void> {
     const start = await apiClient.post<{ login_id: string; auth_url: string }>('/rucio/login/start');
@@ -62,15 +91,15 @@ export async function connectToFnal(): Promise<void> {
 
     const deadline = Date.now() + 3 * 60 * 1000; // 3 min
     while (true) {
-        await new Promise((r) => setTimeout(r, 3000));
-        if (Date.now() > deadline) {
+        const remaining = Math.ceil((deadline - Date.now()) / 1000);
+        if (remaining <= 0) {
             try { popup.close(); } catch { /* ignore */ }
             throw new Error('Timed out waiting for FNAL login.');
         }
-        const poll = await apiClient.get<{ status: 'pending' | 'complete' }>('/rucio/login/poll', {
-            params: { login_id },
+        const wait = await apiClient.get<{ status: 'pending' | 'complete' }>('/rucio/login/wait', {
+            params: { login_id, timeout: Math.min(25, remaining) },
         });
-        if (poll.data.status === 'complete') {
+        if (wait.data.status === 'complete') {
             try { popup.close(); } catch { /* ignore */ }
             return;
         }
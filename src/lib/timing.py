@@ -0,0 +1,255 @@
+"""
+timing.py — per-request phase timing (Server-Timing header) and sampled
+trace spans.
+
+A RequestTiming is bound to each HTTP request by InstrumentationMiddleware
+(src/backend/main.py) through a context variable; FastAPI's worker threads
+run in a copy of that context, so code anywhere below a handler (auth,
+mcatapi, condb_api, http_pool) can attribute time to the current request:
+
+    with timing.phase("format"):
+        rows = [...]
+    timing.add("upstream_ttfb", seconds)
+
+Phases reported in Server-Timing:
+
+    auth            session token decode/verify
+    queue           waiting for a worker thread or bulkhead slot
+    upstream_ttfb   upstream calls, until the first response byte/row
+    upstream_stream upstream calls, the remainder (streaming the body)
+    format          turning upstream rows into response rows
+    serialize       handler return -> response headers sent (JSON encoding)
+
+Only handlers wrapped in @timed_handler get the header. A TRACE_SAMPLE_RATE
+fraction of those requests is also kept, with every span, in an in-memory
+ring buffer (GET /admin/traces) and, if TRACE_FILE is set, appended to that
+file as JSON lines.
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "500"))
+TRACE_FILE = os.environ.get("TRACE_FILE") or None
+
+_PHASES = ("auth", "queue", "upstream_ttfb", "upstream_stream", "format", "serialize")
+
+_current: contextvars.ContextVar["RequestTiming | None"] = contextvars.ContextVar(
+    "request_timing", default=None)
+
+_traces: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+_traces_lock = threading.Lock()
+
+# Traces bound for TRACE_FILE. finish() runs on the event loop, so the file
+# is written by a daemon thread of its own; if the disk falls that far
+# behind, traces are dropped rather than queued without bound.
+_file_queue: "queue.Queue[dict]" = queue.Queue(maxsize=TRACE_BUFFER_SIZE)
+_file_writer: threading.Thread | None = None
+_file_writer_lock = threading.Lock()
+
+
+class RequestTiming:
+    __slots__ = ("start", "totals", "spans", "sampled", "timed",
+                 "handler_start", "handler_end", "user", "_lock")
+
+    def __init__(self, sampled: bool):
+        self.start = time.perf_counter()
+        self.totals: dict[str, float] = {}
+        self.spans: list | None = [] if sampled else None
+        self.sampled = sampled
+        self.timed = False
+        self.handler_start = self.handler_end = None
+        self.user = None          # set by auth once the session is verified
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, started: float | None = None) -> None:
+        with self._lock:
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+            if self.spans is not None:
+                begin = (started if started is not None else time.perf_counter() - seconds)
+                self.spans.append((name, begin - self.start, seconds))
+
+    def header(self) -> str:
+        """Server-Timing value, durations in ms."""
+        totals = dict(self.totals)
+        # Upstream time is recorded whole; split off time-to-first-byte.
+        upstream = totals.pop("upstream", 0.0)
+        if upstream:
+            totals["upstream_stream"] = max(0.0, upstream - totals.get("upstream_ttfb", 0.0))
+        parts = ["%s;dur=%.1f" % (name, totals[name] * 1000)
+                 for name in _PHASES if name in totals]
+        parts.append("total;dur=%.1f" % ((time.perf_counter() - self.start) * 1000))
+        return ", ".join(parts)
+
+
+def begin(sampled: bool | None = None) -> tuple[RequestTiming, contextvars.Token]:
+    if sampled is None:
+        sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    rt = RequestTiming(sampled)
+    return rt, _current.set(rt)
+
+
+def end(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+def current() -> RequestTiming | None:
+    return _current.get()
+
+
+def add(name: str, seconds: float, started: float | None = None) -> None:
+    rt = _current.get()
+    if rt is not None:
+        rt.add(name, seconds, started)
+
+
+class phase:
+    """Context manager adding the block's duration to phase `name`."""
+
+    __slots__ = ("name", "_rt", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._rt = _current.get()
+        if self._rt is not None:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._rt is not None:
+            self._rt.add(self.name, time.perf_counter() - self._start, self._start)
+        return False
+
+
+def timed_handler(func):
+    """Endpoint decorator (sync or async): turns on the Server-Timing header
+    for the route and records queue wait (request start -> handler running,
+    less time already attributed, i.e. auth) and the handler's end for
+    `serialize`."""
+
+    def enter():
+        rt = _current.get()
+        if rt is not None:
+            now = time.perf_counter()
+            rt.timed = True
+            rt.handler_start = now
+            waited = now - rt.start - sum(rt.totals.values())
+            if waited > 0:
+                rt.add("queue", waited, rt.start)
+        return rt
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            rt = enter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                if rt is not None:
+                    rt.handler_end = time.perf_counter()
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        rt = enter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if rt is not None:
+                rt.handler_end = time.perf_counter()
+
+    return wrapper
+
+
+def response_started(rt: RequestTiming) -> str | None:
+    """Called as the response headers go out; returns the Server-Timing
+    value, or None for routes without @timed_handler."""
+    if not rt.timed:
+        return None
+    if rt.handler_end is not None:
+        rt.add("serialize", time.perf_counter() - rt.handler_end, rt.handler_end)
+    return rt.header()
+
+
+def finish(rt: RequestTiming, method: str, path: str, status: int) -> None:
+    """Keep the trace of a sampled, timed request."""
+    if not (rt.sampled and rt.timed):
+        return
+    trace = {
+        "id": uuid.uuid4().hex[:16],
+        "at": time.time(),
+        "method": method,
+        "path": path,
+        "status": status,
+        "duration_ms": round((time.perf_counter() - rt.start) * 1000, 1),
+        "spans": [{"name": n, "start_ms": round(s * 1000, 1), "duration_ms": round(d * 1000, 1)}
+                  for n, s, d in rt.spans],
+    }
+    with _traces_lock:
+        _traces.append(trace)
+    if TRACE_FILE:
+        _start_file_writer()
+        try:
+            _file_queue.put_nowait(trace)
+        except queue.Full:
+            logger.warning(f"Trace writer for {TRACE_FILE} is behind; dropping a trace")
+
+
+def _start_file_writer() -> None:
+    global _file_writer
+    if _file_writer is not None:
+        return
+    with _file_writer_lock:
+        if _file_writer is None:
+            _file_writer = threading.Thread(target=_write_traces, name="trace-writer",
+                                            daemon=True)
+            _file_writer.start()
+
+
+def _write_traces() -> None:
+    """Append queued traces to TRACE_FILE, as many per write as are waiting."""
+    while True:
+        traces = [_file_queue.get()]
+        while True:
+            try:
+                traces.append(_file_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            with open(TRACE_FILE, "a") as f:
+                f.write("".join(json.dumps(t) + "\n" for t in traces))
+        except OSError as e:
+            logger.warning(f"Could not write trace to {TRACE_FILE}: {e}")
+
+
+def recent_traces(limit: int = 50, path: str | None = None,
+                  min_ms: float = 0) -> list[dict]:
+    """Most recent sampled traces first, optionally filtered."""
+    with _traces_lock:
+        traces = list(_traces)
+    out = []
+    for trace in reversed(traces):
+        if path and trace["path"] != path:
+            continue
+        if trace["duration_ms"] < min_ms:
+            continue
+        out.append(trace)
+        if len(out) >= limit:
+            break
+    return out